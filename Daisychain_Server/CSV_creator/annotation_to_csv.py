@@ -18,11 +18,14 @@ import os
 
 
 class AnnoToCSV:
-    def __init__(self, CSV_path, nt_transcript_path, prot_translation_path):
+    def __init__(self, CSV_path, nt_transcript_path, prot_translation_path, gff3_db_path="gff3utils.db",
+                 write_buffer_size=1048576, fasta_index_path=None):
         self.CSV_path = CSV_path
         # Initialize GFF3/annotation parser
-        # Parameters: Output path for transcript and translation sequences
-        self.anno_parser = GFF3Parser_v2(nt_transcript_path, prot_translation_path)
+        # Parameters: Output path for transcript and translation sequences, path of the gffutils database,
+        # buffer size of the sequence writers, folder of cached genome indices
+        self.anno_parser = GFF3Parser_v2(nt_transcript_path, prot_translation_path, gff3_db_path, write_buffer_size,
+                                         fasta_index_path)
         # Initialize output files
         # Data from each parsed species will be appended to the following three files
         # Write header lines
@@ -46,12 +49,15 @@ class AnnoToCSV:
         with open(os.path.join(self.CSV_path, "gene_protein_coding.csv"), "w") as gene_protein_coding_output:
             gene_protein_coding_output.write(":START_ID(Gene),:END_ID(Protein)\n")
 
-    def create_csv(self, anno_file, genome_file, parent_feature_type, subfeatures, name_attribute, descr_attribute):
+    # gff3_backend: "gffutils" or "native", see GFF3Parser_v2
+    def create_csv(self, anno_file, genome_file, parent_feature_type, subfeatures, name_attribute, descr_attribute,
+                   gff3_backend="gffutils"):
 
 
         # Parse the file and retrieve gene annotation as list
         gene_list = self.anno_parser.parse_gff3_file(anno_file, genome_file, True,
-                                                     parent_feature_type, subfeatures, name_attribute, descr_attribute)
+                                                     parent_feature_type, subfeatures, name_attribute, descr_attribute,
+                                                     gff3_backend)
 
           # Gene list has to be sorted at this stage (!!!)
         # Walk through gene list and write content to CSV files
@@ -7,15 +7,61 @@
 # Clustering was performed by MCL with different inflation values
 # Higher inflation values create smaller clusters
 # Each homolog relation include the inflation value as attribute
+# and the percent match of the pair from the percent identity store (see PercentIdentityStore), NA if the pair
+# was not hit in the all vs. all search
+# Each cluster of each inflation value becomes a Cluster node, its members are connected to it by MEMBER_OF
+# relations. Cluster nodes store the number of members and the species composition of the cluster:
+# species (sorted by number of members, then by name) and species_sizes (number of members per species).
+# Species are taken from gene_nodes.csv, a protein has the species of its coding gene (same ID number).
+# In addition, the homolog relations within a cluster follow one of these topologies:
+# clique: All pairs of cluster members, including self-pairs (n² relations per cluster)
+# blast_hits: Only the pairs of cluster members that were found by the all vs. all search
+# knn: For each cluster member, its knn best search hits (by percent match) within the cluster, without self-hits
+# hub: No homolog relations, clusters are only represented by their Cluster node
+# Local synteny scores and synteny blocks are computed from the cluster membership (see load_clusters), so they
+# do not depend on the topology: A relation gets the same ls_score and the same synteny blocks are found
+# for every topology. Only the relations that carry the scores and block IDs differ, with hub there are none.
 import os
-import itertools as iter
+import numpy as np
+
+
+# Read the clusters of one inflation value back from a MEMBER_OF CSV file written by ClusterToCSV
+# Returns a list of clusters, each a list of member node IDs in the order of the MCL cluster file
+def load_clusters(member_of_path, clstr_sens):
+    clusters = []
+    last_cluster_id = None
+    with open(member_of_path, "r") as member_of_file:
+        # Skip header
+        next(member_of_file, None)
+        for line in member_of_file:
+            member, cluster_id = line.rstrip("\n").split(",")
+            # Cluster ID: Node prefix, inflation value and cluster number, e.g. g1.4_17
+            if cluster_id[1:].rsplit("_", 1)[0] != clstr_sens:
+                continue
+            if cluster_id != last_cluster_id:
+                clusters.append([])
+                last_cluster_id = cluster_id
+            clusters[-1].append(member)
+    return clusters
 
 
 class ClusterToCSV:
-    def __init__(self, CSV_path, perc_match_dict, type):
+    # perc_match_store: PercentIdentityStore of the all vs. all search
+    def __init__(self, CSV_path, perc_match_store, type, topology="clique", knn=10):
         self.CSV_path = CSV_path
-        self.perc_match_dict = perc_match_dict
+        self.perc_match_store = perc_match_store
         self.type = type
+        self.topology = topology
+        self.knn = knn
+        self.node_prefix = "g" if type == "nucl" else "p"
+        self.member_type = "Gene" if type == "nucl" else "Protein"
+        # Cluster nodes and MEMBER_OF relations are written next to the homolog relations
+        # e.g. gene_hmlg.csv --> gene_clusters.csv, gene_member_of.csv
+        node_name = "gene" if type == "nucl" else "protein"
+        self.cluster_nodes_path = os.path.join(os.path.dirname(self.CSV_path), node_name + "_clusters.csv")
+        self.member_of_path = os.path.join(os.path.dirname(self.CSV_path), node_name + "_member_of.csv")
+        # Species of each gene ID number
+        self.species = self.load_species(os.path.join(os.path.dirname(self.CSV_path), "gene_nodes.csv"))
         # Initialize output file
         if type == "nucl":
             with open(self.CSV_path, "w") as csv_file:
@@ -23,32 +69,101 @@ class ClusterToCSV:
         elif type == "prot":
             with open(self.CSV_path, "w") as csv_file:
                 csv_file.write(":START_ID(Protein),clstr_sens,perc_match,:END_ID(Protein)\n")
+        with open(self.member_of_path, "w") as member_of_file:
+            member_of_file.write(":START_ID(%s),:END_ID(Cluster)\n" % self.member_type)
+        with open(self.cluster_nodes_path, "w") as cluster_nodes_file:
+            cluster_nodes_file.write("clusterId:ID(Cluster),clstr_sens,member_type,size:int,species_count:int,"
+                                     "species:string[],species_sizes:int[]\n")
+
+    # Gene ID number --> species, read from the gene node CSV file
+    def load_species(self, gene_nodes_path):
+        species = {}
+        if not os.path.isfile(gene_nodes_path):
+            return species
+        with open(gene_nodes_path, "r") as gene_nodes_file:
+            # Skip header
+            next(gene_nodes_file, None)
+            for line in gene_nodes_file:
+                line = line.split(",", 2)
+                if len(line) == 3:
+                    species[line[0][1:]] = line[1]
+        return species
 
 
     # Convert a MCL cluster file into Neo4j relations coded in CSV format
     # File names are predefined by DB-Builder
     # Iterate over all cluster files, one for each inflation_value
     def create_csv(self, mcl_clstr_path, mcl_clstr_sens):
+        self.create_cluster_csv(mcl_clstr_path, mcl_clstr_sens)
+        if self.topology == "hub":
+            return
         with open(self.CSV_path, "a") as csv_file:
             with open(mcl_clstr_path, "r") as mcl_cluster_file:
                 for line in mcl_cluster_file:
-                    cluster = line.strip().split("\t")
                     # Skip empty lines
-                    if not cluster: continue
-                    #  Make all possible pairwise combinations between IDs
-                    # i.e. [1,2,3] --> [(1,1),(1,2),(1,3),(2,1),(2,2),(2,3),(3,1),(3,2),(3,3)]
-                    cluster_pw_comb = iter.product(cluster, repeat=2)
+                    if not line.strip(): continue
+                    cluster = np.array(line.strip().split("\t"), dtype=np.int64)
+                    if self.topology == "blast_hits":
+                        query_ids, subject_ids = self.blast_hit_pairs(cluster)
+                    elif self.topology == "knn":
+                        query_ids, subject_ids = self.knn_pairs(cluster)
+                    else:
+                        #  Make all possible pairwise combinations between IDs
+                        # i.e. [1,2,3] --> [(1,1),(1,2),(1,3),(2,1),(2,2),(2,3),(3,1),(3,2),(3,3)]
+                        query_ids = np.repeat(cluster, len(cluster))
+                        subject_ids = np.tile(cluster, len(cluster))
+                    perc_matches = self.perc_match_store.format_perc_ids(
+                        self.perc_match_store.lookup(query_ids, subject_ids))
                     # Add g or p to ID
-                    if self.type == "nucl":
-                        cluster_pw_comb = [("g"+item[0],"g"+item[1]) for item  in cluster_pw_comb]
-                    if self.type == "prot":
-                        cluster_pw_comb = [("p"+item[0],"p"+item[1]) for item  in cluster_pw_comb]
-                    for homolog_pair in cluster_pw_comb:
-                        csv_file.write(",".join([homolog_pair[0], str(mcl_clstr_sens),
-                                                 str(self.perc_match_dict.get(homolog_pair[0]+"_"+homolog_pair[1],"NA")),
-                                                 str(homolog_pair[1])+"\n"]))
-
-
+                    for query_id, perc_match, subject_id in zip(query_ids.tolist(), perc_matches,
+                                                                subject_ids.tolist()):
+                        csv_file.write(",".join([self.node_prefix + str(query_id), str(mcl_clstr_sens), perc_match,
+                                                 self.node_prefix + str(subject_id) + "\n"]))
 
+    # Write one Cluster node per cluster and one MEMBER_OF relation per cluster member
+    # Cluster IDs consist of the node prefix, the inflation value and the cluster number, e.g. g1.4_17
+    def create_cluster_csv(self, mcl_clstr_path, mcl_clstr_sens):
+        with open(self.cluster_nodes_path, "a") as cluster_nodes_file:
+            with open(self.member_of_path, "a") as member_of_file:
+                with open(mcl_clstr_path, "r") as mcl_cluster_file:
+                    for cluster_nr, line in enumerate(mcl_cluster_file):
+                        # Skip empty lines
+                        if not line.strip(): continue
+                        cluster = line.strip().split("\t")
+                        cluster_id = self.node_prefix + str(mcl_clstr_sens) + "_" + str(cluster_nr)
+                        species_sizes = {}
+                        for member in cluster:
+                            member_species = self.species.get(member, "NA")
+                            species_sizes[member_species] = species_sizes.get(member_species, 0) + 1
+                            member_of_file.write(self.node_prefix + member + "," + cluster_id + "\n")
+                        species_sizes = sorted(species_sizes.items(), key=lambda item: (-item[1], item[0]))
+                        cluster_nodes_file.write(",".join([cluster_id, str(mcl_clstr_sens), self.member_type,
+                                                           str(len(cluster)), str(len(species_sizes)),
+                                                           ";".join([item[0] for item in species_sizes]),
+                                                           ";".join([str(item[1]) for item in species_sizes])])
+                                                 + "\n")
 
+    # Pairs of cluster members that are search hits, as arrays of query and subject IDs
+    def blast_hit_pairs(self, cluster):
+        query_ids = []
+        subject_ids = []
+        for query_id in cluster:
+            hit_ids, hit_perc_ids = self.perc_match_store.hits(query_id)
+            hit_ids = hit_ids[np.isin(hit_ids, cluster)]
+            query_ids.append(np.full(len(hit_ids), query_id, dtype=np.int64))
+            subject_ids.append(hit_ids)
+        return np.concatenate(query_ids), np.concatenate(subject_ids)
 
+    # For each cluster member, the knn pairs with its best search hits in the cluster
+    def knn_pairs(self, cluster):
+        query_ids = []
+        subject_ids = []
+        for query_id in cluster:
+            hit_ids, hit_perc_ids = self.perc_match_store.hits(query_id)
+            member_hits = np.isin(hit_ids, cluster) & (hit_ids != query_id)
+            hit_ids = hit_ids[member_hits]
+            # Best hits first, ties are broken by the subject ID (hits are sorted by subject ID)
+            best_hits = np.argsort(-hit_perc_ids[member_hits], kind="stable")[:self.knn]
+            query_ids.append(np.full(len(best_hits), query_id, dtype=np.int64))
+            subject_ids.append(hit_ids[best_hits])
+        return np.concatenate(query_ids), np.concatenate(subject_ids)
@@ -0,0 +1,61 @@
+# Post-process the tabular output of a DIAMOND all vs. all search in a single pass
+# Expected columns: qseqid sseqid evalue qlen slen nident [qcovhsp scovhsp]
+# DIAMOND keeps the 'lcl|' prefix of the sequence headers (blast+ used to remove it), the prefix is stripped here
+# The percent match of a hit is calculated as 100 * nident / max(qlen, slen), rounded to two decimals
+# Writes both the ABC file for mcxload (query, subject, percent match) and the PercentIdentityStore
+# Hits can be filtered by a minimal percent match and, if the coverage columns are present,
+# by a minimal coverage of both query and subject (min(qcovhsp, scovhsp))
+# The output is read in blocks of chunk_size bytes, each block is parsed with NumPy
+import numpy as np
+from CSV_creator.percent_identity_store import PercentIdentityWriter
+
+
+class DiamondToABC:
+    def __init__(self, min_identity=0.0, min_coverage=0.0, chunk_size=1 << 26):
+        self.min_identity = min_identity
+        self.min_coverage = min_coverage
+        self.chunk_size = chunk_size
+
+    # Returns the number of hits written to the ABC file
+    def convert(self, diamond_output_path, abc_path, pid_store_path):
+        pid_writer = PercentIdentityWriter(pid_store_path)
+        hit_count = 0
+        with open(diamond_output_path, "rb") as diamond_file:
+            with open(abc_path, "w") as abc_file:
+                # Incomplete last line of the previous block
+                remainder = b""
+                for block in iter(lambda: diamond_file.read(self.chunk_size), b""):
+                    block = remainder + block
+                    last_newline = block.rfind(b"\n")
+                    remainder = block[last_newline + 1:]
+                    if last_newline >= 0:
+                        hit_count += self.convert_block(block[:last_newline + 1], abc_file, pid_writer)
+                if remainder.strip():
+                    hit_count += self.convert_block(remainder + b"\n", abc_file, pid_writer)
+        pid_writer.save()
+        return hit_count
+
+    # Convert a block of complete lines
+    def convert_block(self, block, abc_file, pid_writer):
+        block = block.replace(b"lcl|", b"")
+        column_count = block[:block.find(b"\n")].count(b"\t") + 1
+        hits = np.array(block.split(), dtype=np.bytes_)
+        if not len(hits):
+            return 0
+        hits = hits.reshape(-1, column_count)
+        query_lengths = hits[:, 3].astype(np.int64)
+        subject_lengths = hits[:, 4].astype(np.int64)
+        perc_ids = 100 * hits[:, 5].astype(np.int64) / np.maximum(query_lengths, subject_lengths)
+        keep = perc_ids >= self.min_identity
+        if self.min_coverage and column_count >= 8:
+            keep &= np.minimum(hits[:, 6].astype(np.float64), hits[:, 7].astype(np.float64)) >= self.min_coverage
+        hits = hits[keep]
+        # Rounded as Python does, so that the ABC file and the store agree with the former line by line conversion
+        perc_ids = [str(round(perc_id, 2)) for perc_id in perc_ids[keep].tolist()]
+        pid_writer.add(hits[:, 0].astype(np.int64), hits[:, 1].astype(np.int64),
+                       np.array(perc_ids, dtype=np.float64))
+        abc_file.write("".join([query_id + "\t" + subject_id + "\t" + perc_id + "\n"
+                                for query_id, subject_id, perc_id in zip(hits[:, 0].astype(np.str_).tolist(),
+                                                                         hits[:, 1].astype(np.str_).tolist(),
+                                                                         perc_ids)]))
+        return len(perc_ids)
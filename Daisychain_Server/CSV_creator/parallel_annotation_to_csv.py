@@ -0,0 +1,106 @@
+# Convert the annotation files of all species in parallel into CSV file format
+# Each species is parsed by AnnoToCSV in a worker process of a ProcessPoolExecutor.
+# Workers write into a private shard directory: Own CSV files, own transcript and translation FASTA files and
+# an own gffutils database, so that no worker touches the files of another one.
+# Gene IDs of a shard start with 1. When the shards are merged in species order, the IDs of each shard are
+# shifted by the number of genes of all previous species. The merged files are thus identical to the files
+# written by calling AnnoToCSV.create_csv species by species.
+# Shards are merged as soon as they and all shards of previous species are finished.
+# After each merged shard, the number of written sequence bytes per second is reported.
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from CSV_creator.annotation_to_csv import AnnoToCSV
+
+
+# Parse the annotation of one species into a shard directory
+# Returns the number of genes and the number of bytes written to the transcript and translation files
+def parse_species_shard(write_buffer_size, fasta_index_path, shard_path, anno_file, genome_file, parent_feature_type,
+                        subfeatures, name_attribute, descr_attribute, gff3_backend):
+    anno_to_csv_parser = AnnoToCSV(shard_path, os.path.join(shard_path, "transcripts.faa"),
+                                   os.path.join(shard_path, "translations.faa"),
+                                   os.path.join(shard_path, "gff3utils.db"), write_buffer_size, fasta_index_path)
+    anno_to_csv_parser.create_csv(anno_file, genome_file, parent_feature_type, subfeatures, name_attribute,
+                                  descr_attribute, gff3_backend)
+    return anno_to_csv_parser.anno_parser.gene_node_id, anno_to_csv_parser.anno_parser.bytes_written
+
+
+class ParallelAnnoToCSV:
+    # CSV_path: Output directory of the merged CSV files
+    # nt_transcript_path, prot_translation_path: Merged transcript and translation FASTA files
+    # processes: Number of worker processes, e.g. cpu_cores from Daisychain_config.txt
+    # write_buffer_size: Buffer size of the sequence writers in bytes
+    # set_status: Function called with the progress of the parsing, e.g. to update the task status
+    # fasta_index_path: Folder of cached genome indices (see FastaIndexCache)
+    def __init__(self, CSV_path, nt_transcript_path, prot_translation_path, processes, write_buffer_size=1048576,
+                 set_status=None, fasta_index_path=None):
+        self.CSV_path = CSV_path
+        self.nt_transcript_path = nt_transcript_path
+        self.prot_translation_path = prot_translation_path
+        self.processes = max(1, processes)
+        self.write_buffer_size = write_buffer_size
+        self.set_status = set_status
+        self.fasta_index_path = fasta_index_path
+        # CSV files with the number of gene/protein ID fields at the start of each line
+        self.csv_files = [("gene_nodes.csv", 1), ("gene_5nb.csv", 2), ("gene_3nb.csv", 2),
+                          ("protein_nodes.csv", 1), ("gene_protein_coding.csv", 2)]
+
+    # anno_files: List of (annotation file, genome file, parent feature type, subfeatures, name attribute,
+    # description attribute, GFF3 backend), one entry per species in species order
+    def create_csv(self, anno_files):
+        shard_root = tempfile.mkdtemp(prefix="anno_shards_", dir=self.CSV_path)
+        try:
+            # Write the headers and truncate the FASTA files
+            AnnoToCSV(self.CSV_path, self.nt_transcript_path, self.prot_translation_path)
+            with ProcessPoolExecutor(max_workers=min(self.processes, max(1, len(anno_files)))) as executor:
+                shards = []
+                for shard_nr, anno_file in enumerate(anno_files):
+                    shard_path = os.path.join(shard_root, str(shard_nr))
+                    os.mkdir(shard_path)
+                    shards.append((shard_path, executor.submit(parse_species_shard, self.write_buffer_size,
+                                                               self.fasta_index_path, shard_path, *anno_file)))
+                start_time = time.time()
+                gene_id_offset = 0
+                bytes_written = 0
+                for shard_nr, (shard_path, shard_future) in enumerate(shards):
+                    gene_count, shard_bytes = shard_future.result()
+                    self.merge_shard(shard_path, gene_id_offset)
+                    shutil.rmtree(shard_path)
+                    gene_id_offset += gene_count
+                    bytes_written += shard_bytes
+                    if self.set_status:
+                        self.set_status("Parsing annotation data: %s of %s species, %.1f MB sequences written "
+                                        "(%.1f MB/s)" % (shard_nr + 1, len(shards), bytes_written / 1e6,
+                                                         bytes_written / 1e6 / max(time.time() - start_time, 1e-6)))
+        finally:
+            shutil.rmtree(shard_root, ignore_errors=True)
+
+    # Append the files of a shard to the merged files, shifting all IDs by gene_id_offset
+    def merge_shard(self, shard_path, gene_id_offset):
+        for csv_file, id_fields in self.csv_files:
+            with open(os.path.join(shard_path, csv_file), "r") as shard_file:
+                with open(os.path.join(self.CSV_path, csv_file), "a", buffering=self.write_buffer_size) as merged_file:
+                    # Skip header
+                    next(shard_file, None)
+                    for line in shard_file:
+                        merged_file.write(self.shift_csv_line(line, gene_id_offset, id_fields))
+        for fasta_file, merged_path in [("transcripts.faa", self.nt_transcript_path),
+                                        ("translations.faa", self.prot_translation_path)]:
+            with open(os.path.join(shard_path, fasta_file), "r") as shard_file:
+                with open(merged_path, "a", buffering=self.write_buffer_size) as merged_file:
+                    for line in shard_file:
+                        # The fasta annotation line is '>lcl|' plus the gene node ID
+                        if line.startswith(">lcl|"):
+                            line = ">lcl|" + str(int(line[5:]) + gene_id_offset) + "\n"
+                        merged_file.write(line)
+
+    # Shift the IDs in the first id_fields fields of a CSV line, IDs are "g" or "p" plus the gene node ID
+    def shift_csv_line(self, line, gene_id_offset, id_fields):
+        if not gene_id_offset:
+            return line
+        fields = line.rstrip("\n").split(",", id_fields)
+        for field_nr in range(id_fields):
+            fields[field_nr] = fields[field_nr][0] + str(int(fields[field_nr][1:]) + gene_id_offset)
+        return ",".join(fields) + "\n"
@@ -0,0 +1,65 @@
+# Compact store of the percent match identity of all vs. all search hits
+# Each hit is stored as int64 key (query ID << 32 | subject ID) and float32 percent match,
+# IDs are the gene node IDs (without "g" or "p" prefix).
+# Keys are sorted, so that hits are looked up with a binary search (np.searchsorted) and all hits of one query
+# form a contiguous range. If a pair was hit more than once, the last hit is kept.
+# The store consists of two NumPy files, <store path>.keys.npy and <store path>.values.npy,
+# that are memory-mapped instead of loaded.
+import os
+import numpy as np
+
+
+class PercentIdentityWriter:
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.keys = []
+        self.values = []
+
+    # Add hits, given as arrays (or lists) of query IDs, subject IDs and percent match
+    def add(self, query_ids, subject_ids, perc_ids):
+        self.keys.append((np.asarray(query_ids, dtype=np.int64) << np.int64(32)) |
+                         np.asarray(subject_ids, dtype=np.int64))
+        self.values.append(np.asarray(perc_ids, dtype=np.float32))
+
+    def save(self):
+        keys = np.concatenate(self.keys) if self.keys else np.zeros(0, dtype=np.int64)
+        values = np.concatenate(self.values) if self.values else np.zeros(0, dtype=np.float32)
+        self.keys = []
+        self.values = []
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        values = values[order]
+        # Keep the last hit of each pair
+        last_hit = np.append(keys[1:] != keys[:-1], True) if len(keys) else np.zeros(0, dtype=bool)
+        for file_suffix, array in [(".keys.npy", keys[last_hit]), (".values.npy", values[last_hit])]:
+            with open(self.store_path + file_suffix + ".tmp", "wb") as store_file:
+                np.save(store_file, array)
+            os.replace(self.store_path + file_suffix + ".tmp", self.store_path + file_suffix)
+
+
+class PercentIdentityStore:
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.keys = np.load(store_path + ".keys.npy", mmap_mode="r")
+        self.values = np.load(store_path + ".values.npy", mmap_mode="r")
+
+    # Percent match of query/subject pairs, NaN if the pair was not hit
+    def lookup(self, query_ids, subject_ids):
+        keys = (np.asarray(query_ids, dtype=np.int64) << np.int64(32)) | np.asarray(subject_ids, dtype=np.int64)
+        perc_ids = np.full(len(keys), np.nan, dtype=np.float32)
+        if len(self.keys) and len(keys):
+            pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found = self.keys[pos] == keys
+            perc_ids[found] = self.values[pos[found]]
+        return perc_ids
+
+    # All hits of one query: Array of subject IDs (sorted) and array of percent match
+    def hits(self, query_id):
+        start, end = np.searchsorted(self.keys, [np.int64(query_id) << np.int64(32),
+                                                 np.int64(query_id + 1) << np.int64(32)])
+        return np.asarray(self.keys[start:end] & np.int64(0xFFFFFFFF)), np.asarray(self.values[start:end])
+
+    # Percent match as written to the CSV files, rounded to two decimals as calculated, NA for missing hits
+    def format_perc_ids(self, perc_ids):
+        # NaN is the only value not equal to itself
+        return ["NA" if perc_id != perc_id else str(round(perc_id, 2)) for perc_id in perc_ids.tolist()]
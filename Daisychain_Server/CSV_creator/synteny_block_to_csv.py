@@ -0,0 +1,59 @@
+# Detect collinear synteny blocks and convert them into CSV files that can be imported by Neo4j
+# Gene order is taken from gene_5nb.csv (written by AnnoToCSV),
+# anchors are all pairs of genes in the same large cluster (inflation value clstr_sens, 1.4 by default),
+# read from gene_member_of.csv. Blocks thus do not depend on the homology topology used to write gene_hmlg.csv.
+# Each block becomes a SyntenyBlock node, every gene spanned by the block is connected to it by an IN_BLOCK relation.
+# In gene_hmlg.csv, the relations between the anchor pairs of a block (if the topology wrote them) get the block ID
+# as additional column synteny_block.
+# All genes of a block can thus be retrieved by one index lookup on the block ID.
+import os
+from CSV_creator.cluster_to_csv import load_clusters
+from Synteny.gene_neighbourhood import GeneNeighbourhoodIndex
+from Synteny.synteny_blocks import SyntenyBlocks
+
+
+class SyntenyBlockToCSV:
+    def __init__(self, CSV_path, min_anchors=5, max_gap=10, clstr_sens="1.4"):
+        self.CSV_path = CSV_path
+        self.clstr_sens = clstr_sens
+        nb_index = GeneNeighbourhoodIndex()
+        nb_index.load_csv(os.path.join(self.CSV_path, "gene_5nb.csv"))
+        self.synteny_blocks = SyntenyBlocks(nb_index, min_anchors, max_gap)
+
+    def create_csv(self):
+        hmlg_csv_path = os.path.join(self.CSV_path, "gene_hmlg.csv")
+        # Collect anchors: All pairs of different genes within each large cluster
+        anchor_pairs = []
+        for cluster in load_clusters(os.path.join(self.CSV_path, "gene_member_of.csv"), self.clstr_sens):
+            for gene_a in cluster:
+                for gene_b in cluster:
+                    if gene_a != gene_b:
+                        anchor_pairs.append((gene_a, gene_b))
+        blocks = self.synteny_blocks.find_blocks(anchor_pairs)
+        del anchor_pairs
+        print("Found %s synteny blocks" % len(blocks))
+        # Format for SyntenyBlock node CSV:
+        # blockId:ID(SyntenyBlock),orientation,anchors:int
+        # Format for (Gene)-[:IN_BLOCK]->(SyntenyBlock):
+        # :START_ID(Gene),:END_ID(SyntenyBlock)
+        anchor_block = {}
+        with open(os.path.join(self.CSV_path, "synteny_block_nodes.csv"), "w") as block_node_output:
+            with open(os.path.join(self.CSV_path, "gene_synteny_block.csv"), "w") as gene_block_output:
+                block_node_output.write("blockId:ID(SyntenyBlock),orientation,anchors:int\n")
+                gene_block_output.write(":START_ID(Gene),:END_ID(SyntenyBlock)\n")
+                for block_id, orientation, anchors in blocks:
+                    block_node_output.write(",".join([block_id, orientation, str(len(anchors))]) + "\n")
+                    for gene in self.synteny_blocks.block_genes(anchors):
+                        gene_block_output.write(gene + "," + block_id + "\n")
+                    for gene_a, gene_b in anchors:
+                        anchor_block[(gene_a, gene_b)] = block_id
+                        anchor_block[(gene_b, gene_a)] = block_id
+        # Add the block ID to the anchor relations
+        with open(hmlg_csv_path, "r") as hmlg_file:
+            with open(hmlg_csv_path + ".tmp", "w") as block_hmlg_file:
+                block_hmlg_file.write(next(hmlg_file).rstrip("\n") + ",synteny_block\n")
+                for line in hmlg_file:
+                    rel = line.rstrip("\n").split(",")
+                    block_id = anchor_block.get((rel[0], rel[3]), "") if rel[1] == self.clstr_sens else ""
+                    block_hmlg_file.write(",".join(rel + [block_id]) + "\n")
+        os.replace(hmlg_csv_path + ".tmp", hmlg_csv_path)
@@ -0,0 +1,75 @@
+# Add local synteny scores to the homology relation CSV files before they are imported into Neo4j
+# Gene order is taken from gene_5nb.csv (written by AnnoToCSV),
+# homology relations from gene_hmlg.csv and protein_hmlg.csv (written by ClusterToCSV).
+# Relations are scored against the large clusters (inflation value clstr_sens, 1.4 by default) read from
+# gene_member_of.csv and protein_member_of.csv: All members of a cluster count as homologs of each other, whatever
+# homology topology was used to write the relations. Each homology CSV file is then read once to score every
+# relation and rewritten with an additional typed column ls_score:int.
+# Protein relations are scored on the neighbourhood of their coding genes (gene_protein_coding.csv),
+# together with the protein clusters.
+# Self-loops get no score, the property is then missing in the graph DB.
+import os
+from CSV_creator.cluster_to_csv import load_clusters
+from Synteny.gene_neighbourhood import GeneNeighbourhoodIndex
+from Synteny.local_synteny import GeneIdEncoder, LocalSynteny
+
+
+class SyntenyToCSV:
+    def __init__(self, CSV_path, batch_size=50000, clstr_sens="1.4"):
+        self.CSV_path = CSV_path
+        self.batch_size = batch_size
+        self.clstr_sens = clstr_sens
+        # Load the gene order of all contigs
+        self.nb_index = GeneNeighbourhoodIndex()
+        self.nb_index.load_csv(os.path.join(self.CSV_path, "gene_5nb.csv"))
+
+    def add_gene_ls_scores(self):
+        self.add_ls_scores("gene_hmlg.csv", "gene_member_of.csv", {})
+
+    def add_protein_ls_scores(self):
+        # Map every protein to its coding gene
+        protein_to_gene = {}
+        with open(os.path.join(self.CSV_path, "gene_protein_coding.csv"), "r") as gene_protein_coding_file:
+            # Skip header
+            next(gene_protein_coding_file, None)
+            for line in gene_protein_coding_file:
+                line = line.rstrip("\n").split(",")
+                if len(line) == 2:
+                    protein_to_gene[line[1]] = line[0]
+        self.add_ls_scores("protein_hmlg.csv", "protein_member_of.csv", protein_to_gene)
+
+    # Score all relations of one homology CSV file
+    # Format: :START_ID(Gene/Protein),clstr_sens,perc_match,:END_ID(Gene/Protein)
+    # node_to_gene maps the node IDs of the file to gene IDs, gene IDs are used as they are
+    # member_of_csv_name: MEMBER_OF file of the same node type, giving the clusters
+    def add_ls_scores(self, hmlg_csv_name, member_of_csv_name, node_to_gene):
+        hmlg_csv_path = os.path.join(self.CSV_path, hmlg_csv_name)
+        gene_encoder = GeneIdEncoder()
+        local_synteny = LocalSynteny(self.nb_index, gene_encoder)
+        # Homolog graph of the large clusters
+        local_synteny.set_cluster_graph(
+            [gene_encoder.encode_many(node_to_gene.get(member, member) for member in cluster)
+             for cluster in load_clusters(os.path.join(self.CSV_path, member_of_csv_name), self.clstr_sens)])
+        # Score all relations batch by batch and write them to a new file
+        with open(hmlg_csv_path, "r") as hmlg_file:
+            with open(hmlg_csv_path + ".tmp", "w") as scored_hmlg_file:
+                header = next(hmlg_file).rstrip("\n")
+                scored_hmlg_file.write(header + ",ls_score:int\n")
+                batch = []
+                for line in hmlg_file:
+                    batch.append(line.rstrip("\n").split(","))
+                    if len(batch) == self.batch_size:
+                        self.write_scored_batch(batch, local_synteny, gene_encoder, node_to_gene, scored_hmlg_file)
+                        batch = []
+                self.write_scored_batch(batch, local_synteny, gene_encoder, node_to_gene, scored_hmlg_file)
+        os.replace(hmlg_csv_path + ".tmp", hmlg_csv_path)
+
+    def write_scored_batch(self, batch, local_synteny, gene_encoder, node_to_gene, scored_hmlg_file):
+        if not batch:
+            return
+        scores = local_synteny.score_edges(
+            gene_encoder.encode_many(node_to_gene.get(rel[0], rel[0]) for rel in batch),
+            gene_encoder.encode_many(node_to_gene.get(rel[3], rel[3]) for rel in batch))
+        for rel, score in zip(batch, scores):
+            ls_score = str(score) if rel[0] != rel[3] else ""
+            scored_hmlg_file.write(",".join(rel + [ls_score]) + "\n")
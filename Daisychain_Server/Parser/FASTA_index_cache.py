@@ -0,0 +1,84 @@
+# Cache of pyfaidx sequence indices (.fai files)
+# Indexing a genome means reading the whole file, so indices are kept in a hidden folder of the project
+# Files folder and reused by GFF3 parser previews and DB builds.
+# An index is named after the sequence file plus its size and modification time:
+# <file name>.<size>_<mtime in ns>.fai
+# A changed file thus never reuses an old index, old indices of the file are removed when a new one is created.
+# FileManagement removes the indices of a file when the file is replaced or removed.
+# For previews, open_contig_regions returns only the beginning of some contigs. The index is created on first use,
+# so later previews and the DB build of the project reuse it. Without a cache folder, the sequence file is read
+# only up to the last needed position and at most max_scan_bytes, so that a preview never reads a whole genome.
+import os
+import re
+from pyfaidx import Fasta
+
+
+class FastaIndexCache:
+    def __init__(self, cache_path, max_scan_bytes=67108864):
+        self.cache_path = cache_path
+        self.max_scan_bytes = max_scan_bytes
+
+    # Path of the index of the current version of a sequence file
+    def index_path(self, fasta_path):
+        fasta_stat = os.stat(fasta_path)
+        return os.path.join(self.cache_path, "%s.%s_%s.fai" % (os.path.basename(fasta_path), fasta_stat.st_size,
+                                                                fasta_stat.st_mtime_ns))
+
+    # Open a sequence file with pyfaidx, using (or creating) the cached index
+    # Additional arguments are passed to pyfaidx, e.g. sequence_always_upper
+    def open_fasta(self, fasta_path, **fasta_args):
+        os.makedirs(self.cache_path, exist_ok=True)
+        index_path = self.index_path(fasta_path)
+        if not os.path.isfile(index_path):
+            self.invalidate(os.path.basename(fasta_path))
+        return Fasta(fasta_path, indexname=index_path, **fasta_args)
+
+    # Sequences of some contigs, each from its start up to (at least) a given end position
+    # contig_ends: Contig name --> last needed position
+    # Returns a pyfaidx Fasta if there is a cache folder, else a dict of contig name --> upper case sequence.
+    # Contigs behind the first max_scan_bytes of the file are shortened or empty in this dict.
+    def open_contig_regions(self, fasta_path, contig_ends):
+        if self.cache_path:
+            return self.open_fasta(fasta_path, sequence_always_upper=True)
+        contig_regions = {contig: "" for contig in contig_ends}
+        remaining_ends = dict(contig_ends)
+        contig_name = None
+        contig_lines = []
+        contig_length = 0
+        scanned_bytes = 0
+        with open(fasta_path, "r") as fasta_file:
+            for line in fasta_file:
+                scanned_bytes += len(line)
+                if scanned_bytes > self.max_scan_bytes:
+                    break
+                if line.startswith(">"):
+                    if contig_name is not None:
+                        contig_regions[contig_name] = "".join(contig_lines)
+                        del remaining_ends[contig_name]
+                    if not remaining_ends:
+                        break
+                    # As in pyfaidx, the contig name ends at the first whitespace
+                    contig_name = line[1:].split()[0] if line[1:].strip() else ""
+                    contig_name = contig_name if contig_name in remaining_ends else None
+                    contig_lines = []
+                    contig_length = 0
+                elif contig_name is not None:
+                    contig_lines.append(line.strip().upper())
+                    contig_length += len(contig_lines[-1])
+                    if contig_length >= remaining_ends[contig_name]:
+                        contig_regions[contig_name] = "".join(contig_lines)
+                        del remaining_ends[contig_name]
+                        contig_name = None
+                        if not remaining_ends:
+                            break
+        if contig_name is not None:
+            contig_regions[contig_name] = "".join(contig_lines)
+        return contig_regions
+
+    # Remove all cached indices of a sequence file
+    def invalidate(self, file_name):
+        if not os.path.isdir(self.cache_path):
+            return
+        for index_name in os.listdir(self.cache_path):
+            if re.fullmatch(re.escape(file_name) + r"\.\d+_\d+\.fai", index_name):
+                os.remove(os.path.join(self.cache_path, index_name))
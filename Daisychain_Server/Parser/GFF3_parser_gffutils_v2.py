@@ -9,11 +9,15 @@
 # Returns a list of gene annotations in this format:
 #(gene_id, species_name, contig_name, start_index, stop_index, strand_orientation, gene_name, gene_description,
 # nt_sequence, prot_sequence)
+# The GFF3 file is either loaded into a gffutils SQLite database (backend "gffutils")
+# or streamed once into memory (backend "native", see GFF3_parser_native)
 import gffutils
 import os
-from pyfaidx import Fasta
-from Bio.Seq import Seq
-from Bio.Alphabet import IUPAC
+from itertools import islice
+from pyfaidx import Fasta, Sequence
+from Parser.FASTA_index_cache import FastaIndexCache
+from Parser.sequence_translation import reverse_complement, translate_nt, translate_nt_batch
+from Parser.GFF3_parser_native import GFF3NativeDB
 
 class GFF3Parser_v2:
     # Path to GFF3
@@ -24,53 +28,56 @@ class GFF3Parser_v2:
     # Feature containing "Description" attribute plus name of attribute e.g. CDS:product
     # Both attributes are NOT mandatory. If name attribute is not set, the transcript ID will be used as name
     # If description is missing, this attribute will not be included in the database
-    def __init__(self, transcript_output, translate_output):
+    # The gffutils database is created at gff3_db_path, parsers running in parallel need different paths
+    # Transcripts and translations are written through buffered writers with write_buffer_size bytes buffer,
+    # the writers stay open while a file is parsed
+    # If fasta_index_path is set, genome indices are kept in this folder (see FastaIndexCache),
+    # else the index is created next to the genome file and removed after parsing
+    # A parser used only for previews (preview_gff3_file) needs no output files, both can be None
+    def __init__(self, transcript_output, translate_output, gff3_db_path="gff3utils.db", write_buffer_size=1048576,
+                 fasta_index_path=None):
         self.output_path_nt_transcript = transcript_output
         self.output_path_prot_translation = translate_output
+        self.gff3_db_path = gff3_db_path
+        self.fasta_index_cache = FastaIndexCache(fasta_index_path) if fasta_index_path else None
+        self.write_buffer_size = write_buffer_size
+        self.output_nt = None
+        self.output_prot = None
+        # Number of bytes written to the transcript and translation files
+        self.bytes_written = 0
         # Ensure that output files are empty
-        with open(self.output_path_nt_transcript, "w") as nt_out:
-            with open(self.output_path_prot_translation, "w") as prot_out:
-                pass
+        if self.output_path_nt_transcript and self.output_path_prot_translation:
+            with open(self.output_path_nt_transcript, "w") as nt_out:
+                with open(self.output_path_prot_translation, "w") as prot_out:
+                    pass
         # Each gene node gets an unique id, starting with zero
         self.gene_node_id = 0
 
 
     # Reverse complement a nucleotide sequence
+    # If non-nucleotide letters are found: return empty string
     def reverse_complement(self, sequence):
-        rev_complement = {"A": "T", "T": "A", "C": "G", "G": "C"}
-        try:
-            sequence = "".join([rev_complement[nt] for nt in sequence])[::-1]
-        # If non-nucleotide letters are found: return empty string
-        except KeyError:
-            sequence = ""
-        return sequence
+        return reverse_complement(sequence)
 
     # Translate a nucleotide sequence into protein sequence
+    # Coding sequence should be in frame and starts with the first in-frame ATG
     def translate_nt(self, nt_sequence):
-        # Coding sequence should be in frame
-        # If nucleotide sequence does not start with ATG, continuously remove 3 letters until sequence starts with ATG
-        while nt_sequence:
-            if nt_sequence[:3] == "ATG": break
-            else:
-                if len(nt_sequence) < 3: return ""
-                else:
-                    nt_sequence = nt_sequence[3:]
-        # Biopython demands coding sequence lengths to be a multiple of three
-        # Add trailing N to those sequences that fail this requirement
-        while len(nt_sequence)%3 != 0:
-            nt_sequence += "N"
-        coding_seq = Seq(nt_sequence, IUPAC.ambiguous_dna)
-        return str(coding_seq.translate(to_stop=True))
+        return translate_nt(nt_sequence)
 
     def parse_gff3_file(self, gff3_file_path, sequence_file_path, seq_is_genome,  parent_feature_type,
-                 subfeatures, name_attribute, descr_attribute):
+                 subfeatures, name_attribute, descr_attribute, gff3_backend="gffutils"):
         species_name = os.path.splitext(os.path.basename(gff3_file_path))[0]
         # Load GFF3 file
-        gffutils.create_db(gff3_file_path, "gff3utils.db", merge_strategy="create_unique", force=True)
-        gff3_db = gffutils.FeatureDB('gff3utils.db', keep_order=False)
+        if gff3_backend == "native":
+            gff3_db = GFF3NativeDB(gff3_file_path)
+        else:
+            gffutils.create_db(gff3_file_path, self.gff3_db_path, merge_strategy="create_unique", force=True)
+            gff3_db = gffutils.FeatureDB(self.gff3_db_path, keep_order=False)
         # Parse sequence file
         # Is sequence the genome (true) or already spliced transcripts (false)
-        if seq_is_genome:
+        if seq_is_genome and self.fasta_index_cache:
+            sequence = self.fasta_index_cache.open_fasta(sequence_file_path, sequence_always_upper=True)
+        elif seq_is_genome:
             sequence = Fasta(sequence_file_path, sequence_always_upper=True)
         else:
             sequence = None
@@ -83,95 +90,158 @@ class GFF3Parser_v2:
         descr_attribute = descr_attribute.split(":")
         # Collect all gene annotations in a list
         gene_annotation_list = []
+        self.open_writers()
         # Iterate through all transcripts (identified by parent_feature_type)
         for transcript in gff3_db.iter_by_parent_childs(parent_feature_type):
-            # Increase gene node ID by one
-            self.gene_node_id += 1
-            # Extract all "standard" attributes for this transcript:
-            # name and description may be changed by name_attribute and descr_attribute
-            gene_annotation = [self.gene_node_id, species_name, transcript[0].seqid, transcript[0].start,
-                               transcript[0].stop, transcript[0].strand, transcript[0].id, ""]
-            if name_attribute[0] == parent_feature_type:
-                try:
-                    gene_annotation[6]=transcript[0][name_attribute[1]][0]
-                except KeyError:
-                    gene_annotation[6] = ""
-            if descr_attribute[0] == parent_feature_type:
-                try:
-                    gene_annotation[7]=transcript[0][descr_attribute[1]][0]
-                except KeyError:
-                    gene_annotation[7]= ""
-            # Collect gene annotation in list
-            gene_sequence = []
-            # Iterate through all subfeatures of this transcript
-            # Two tasks are performed here: Look for name or descr attributes
-            # Build the sequence of this transcript
-            for subfeature in transcript[1:]:
-                # Check if feature type is in the list of selected subfeatures
-                if subfeature.featuretype in subfeatures:
-                    # Check if name or description attribute can be found in this subfeature
-                    if name_attribute[0] == subfeature.featuretype:
-                        try:
-                            gene_annotation[6] = subfeature[name_attribute[1]][0]
-                        except KeyError:
-                            pass
-                    if descr_attribute[0] == subfeature.featuretype:
-                        try:
-                            gene_annotation[7] = subfeature[descr_attribute[1]][0]
-                        except KeyError:
-                            pass
-                    # Collect sequence of this subfeature if nucleotide sequence is the genome
-                    # Important: Current version of GFFutils has a bug preventing the automatic reverse-complement
-                    # of minus-strand features
-                    # Strandedness is therefore evaluated manually here
-                    if seq_is_genome:
-                        # Is sequence from a minus-strand feature?
-                        antisense = subfeature.strand == "-"
-                        # If antisense, reverse complement the sequence
-                        #seq_fragment = subfeature.sequence(sequence, False).seq if not antisense \
-                            #else self.reverse_complement(subfeature.sequence(sequence, False).seq)
-                        seq_fragment = subfeature.sequence(sequence, False) if not antisense \
-                            else self.reverse_complement(subfeature.sequence(sequence, False))
-                        # Include the coding phase, phase is zero if phase field is empty:
-                        phase = int(subfeature.frame) if subfeature.frame.isdigit() else 0
-                        # If a gene consists of multiple segments they need to be sorted by their start index
-                        # For antisense strand features the negative of the start index is used
-                        start_index = int(subfeature.start) if not antisense else int(subfeature.start)*(-1)
-                        # Store each gene sequence fragment in a tuple together with its start index
-                        gene_sequence.append((start_index, seq_fragment[phase:]))
-            # Join all sequence fragments together
-            # First, sort by start_index
-            gene_sequence = sorted(gene_sequence, key=lambda x: x[0])
-            # Now join fragments into a single string
-            gene_sequence = "".join([item[1] for item in gene_sequence])
-            # Translate gene sequence into protein sequence
-            if gene_sequence:
-                protein_sequence = self.translate_nt(gene_sequence)
-            else:
-                protein_sequence = ""
-            # Append gene and protein sequence to gene annotation list
-            gene_annotation.append(gene_sequence)
-            gene_annotation.append(protein_sequence)
+            gene_annotation = self.parse_transcript(transcript, species_name, sequence, seq_is_genome,
+                                                    parent_feature_type, subfeatures, name_attribute, descr_attribute)
             gene_annotation_list.append(gene_annotation)
+            gene_sequence = gene_annotation[8]
             # Write sequence to file, except when no sequence could be retrieved
             if not gene_sequence:
                 continue
             # The fasta annotation line is  '>lcl|' plus the gene node ID
             # 'lcl|' is required by blast+ to ensure correct parsing of the identifier
-            with open(self.output_path_nt_transcript, "a") as output_nt:
-                output_nt.write(">lcl|"+str(gene_annotation[0])+"\n")
-                output_nt.write(gene_sequence+"\n")
-            if not protein_sequence:
-                continue
-            with open(self.output_path_prot_translation, "a") as output_prot:
-                output_prot.write(">lcl|"+str(gene_annotation[0])+"\n")
-                output_prot.write(protein_sequence + "\n")
+            self.write_fasta(self.output_nt, gene_annotation[0], gene_sequence)
+        # Translate all gene sequences into protein sequences at once
+        for gene_annotation, protein_sequence in zip(gene_annotation_list,
+                                                     translate_nt_batch([gene[8] for gene in gene_annotation_list])):
+            gene_annotation.append(protein_sequence)
+            if protein_sequence:
+                self.write_fasta(self.output_prot, gene_annotation[0], protein_sequence)
+        self.close_writers()
         # Sort the gene_list by contig, start and stop. Only one species per file, so no need to sort by species
         gene_annotation_list = sorted(gene_annotation_list, key=lambda x: (x[2], int(x[3]), int(x[4])))
-        # Delete genome index file
-        os.remove(sequence_file_path + ".fai")
+        # Delete genome index file, unless it is cached
+        if not self.fasta_index_cache:
+            os.remove(sequence_file_path + ".fai")
         return gene_annotation_list
 
+    # Parse the first lines of a GFF3 file to test the parser configuration
+    # Features are read by the same backend as the import (gff3_backend), so that the preview shows the same
+    # IDs and transcripts. The gffutils database of the preview is kept in memory.
+    # Only the contig regions covered by these lines are read from the genome
+    # (see FastaIndexCache.open_contig_regions). Nothing is written to the output files.
+    # Returns up to max_genes gene annotations, sorted like the result of parse_gff3_file
+    def preview_gff3_file(self, gff3_file_path, sequence_file_path, parent_feature_type, subfeatures, name_attribute,
+                          descr_attribute, max_lines=100, max_genes=3, gff3_backend="gffutils"):
+        species_name = os.path.splitext(os.path.basename(gff3_file_path))[0]
+        with open(gff3_file_path, "r") as gff3_file:
+            head_lines = list(islice(gff3_file, max_lines))
+        if gff3_backend == "native":
+            gff3_db = GFF3NativeDB()
+            gff3_db.add_lines(head_lines)
+            features = gff3_db.features
+        else:
+            gff3_db = gffutils.create_db("".join(head_lines), ":memory:", from_string=True,
+                                         merge_strategy="create_unique", force=True)
+            features = gff3_db.all_features()
+        # Last position needed on each contig
+        contig_ends = {}
+        for feature in features:
+            contig_ends[feature.seqid] = max(contig_ends.get(feature.seqid, 0), feature.stop)
+        if self.fasta_index_cache:
+            sequence = self.fasta_index_cache.open_contig_regions(sequence_file_path, contig_ends)
+        else:
+            sequence = FastaIndexCache(None).open_contig_regions(sequence_file_path, contig_ends)
+        # Contig regions are wrapped like pyfaidx sequences, as gffutils features expect them
+        if isinstance(sequence, dict):
+            sequence = {contig: Sequence(contig, region) for contig, region in sequence.items()}
+        gene_annotation_list = [self.parse_transcript(transcript, species_name, sequence, True, parent_feature_type,
+                                                      subfeatures.split(","), name_attribute.split(":"),
+                                                      descr_attribute.split(":"))
+                                for transcript in gff3_db.iter_by_parent_childs(parent_feature_type)]
+        for gene_annotation, protein_sequence in zip(gene_annotation_list,
+                                                     translate_nt_batch([gene[8] for gene in gene_annotation_list])):
+            gene_annotation.append(protein_sequence)
+        return sorted(gene_annotation_list, key=lambda x: (x[2], int(x[3]), int(x[4])))[:max_genes]
+
+    # Parse one transcript: Feature of parent_feature_type followed by all its subfeatures
+    # Returns the gene annotation without protein sequence
+    def parse_transcript(self, transcript, species_name, sequence, seq_is_genome, parent_feature_type, subfeatures,
+                         name_attribute, descr_attribute):
+        # Increase gene node ID by one
+        self.gene_node_id += 1
+        # Extract all "standard" attributes for this transcript:
+        # name and description may be changed by name_attribute and descr_attribute
+        gene_annotation = [self.gene_node_id, species_name, transcript[0].seqid, transcript[0].start,
+                           transcript[0].stop, transcript[0].strand, transcript[0].id, ""]
+        if name_attribute[0] == parent_feature_type:
+            try:
+                gene_annotation[6]=transcript[0][name_attribute[1]][0]
+            except KeyError:
+                gene_annotation[6] = ""
+        if descr_attribute[0] == parent_feature_type:
+            try:
+                gene_annotation[7]=transcript[0][descr_attribute[1]][0]
+            except KeyError:
+                gene_annotation[7]= ""
+        # Collect gene annotation in list
+        gene_sequence = []
+        # Iterate through all subfeatures of this transcript
+        # Two tasks are performed here: Look for name or descr attributes
+        # Build the sequence of this transcript
+        for subfeature in transcript[1:]:
+            # Check if feature type is in the list of selected subfeatures
+            if subfeature.featuretype in subfeatures:
+                # Check if name or description attribute can be found in this subfeature
+                if name_attribute[0] == subfeature.featuretype:
+                    try:
+                        gene_annotation[6] = subfeature[name_attribute[1]][0]
+                    except KeyError:
+                        pass
+                if descr_attribute[0] == subfeature.featuretype:
+                    try:
+                        gene_annotation[7] = subfeature[descr_attribute[1]][0]
+                    except KeyError:
+                        pass
+                # Collect sequence of this subfeature if nucleotide sequence is the genome
+                # Important: Current version of GFFutils has a bug preventing the automatic reverse-complement
+                # of minus-strand features
+                # Strandedness is therefore evaluated manually here
+                if seq_is_genome:
+                    # Is sequence from a minus-strand feature?
+                    antisense = subfeature.strand == "-"
+                    # If antisense, reverse complement the sequence
+                    #seq_fragment = subfeature.sequence(sequence, False).seq if not antisense \
+                        #else self.reverse_complement(subfeature.sequence(sequence, False).seq)
+                    seq_fragment = subfeature.sequence(sequence, False) if not antisense \
+                        else self.reverse_complement(subfeature.sequence(sequence, False))
+                    # Include the coding phase, phase is zero if phase field is empty:
+                    phase = int(subfeature.frame) if subfeature.frame.isdigit() else 0
+                    # If a gene consists of multiple segments they need to be sorted by their start index
+                    # For antisense strand features the negative of the start index is used
+                    start_index = int(subfeature.start) if not antisense else int(subfeature.start)*(-1)
+                    # Store each gene sequence fragment in a tuple together with its start index
+                    gene_sequence.append((start_index, seq_fragment[phase:]))
+        # Join all sequence fragments together
+        # First, sort by start_index
+        gene_sequence = sorted(gene_sequence, key=lambda x: x[0])
+        # Now join fragments into a single string
+        gene_sequence = "".join([item[1] for item in gene_sequence])
+        # Append gene sequence to gene annotation list, the protein sequence is added later
+        gene_annotation.append(gene_sequence)
+        return gene_annotation
+
+    # Open the transcript and translation files for appending
+    def open_writers(self):
+        self.close_writers()
+        self.output_nt = open(self.output_path_nt_transcript, "a", buffering=self.write_buffer_size)
+        self.output_prot = open(self.output_path_prot_translation, "a", buffering=self.write_buffer_size)
+
+    # Flush and close the transcript and translation files
+    def close_writers(self):
+        for writer in [self.output_nt, self.output_prot]:
+            if writer is not None:
+                writer.close()
+        self.output_nt = None
+        self.output_prot = None
+
+    def write_fasta(self, writer, gene_node_id, sequence):
+        fasta_record = ">lcl|" + str(gene_node_id) + "\n" + sequence + "\n"
+        writer.write(fasta_record)
+        self.bytes_written += len(fasta_record)
+
     # # Retrieve a single nt transcript by FASTA header ID
     # def get_nt_sequence(self, id):
     #     try:
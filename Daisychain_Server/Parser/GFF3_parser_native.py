@@ -0,0 +1,105 @@
+# Native GFF3 backend for GFF3Parser_v2
+# Streams a GFF3 file once and keeps all features in memory, grouped by their ID and Parent attributes.
+# Offers the subset of the gffutils FeatureDB/Feature interface used by GFF3Parser_v2, so that transcripts
+# are parsed in the same way, but without building and querying a SQLite database.
+# Feature IDs follow the gffutils "create_unique" merge strategy: A repeated ID gets the suffix _1, _2, ...,
+# features without ID attribute get the ID featuretype_1, featuretype_2, ...
+# Parent attributes always refer to the first feature with this ID.
+# Transcripts are returned in file order.
+from urllib.parse import unquote
+
+
+class GFF3Feature:
+    def __init__(self, seqid, featuretype, start, stop, strand, frame, attributes):
+        self.seqid = seqid
+        self.featuretype = featuretype
+        self.start = start
+        self.stop = stop
+        self.strand = strand
+        self.frame = frame
+        self.attributes = attributes
+        self.id = None
+
+    # Attribute values as list, raises KeyError if the attribute is missing
+    def __getitem__(self, key):
+        return self.attributes[key]
+
+    # Genomic sequence of the feature from a pyfaidx Fasta or a dict of contig sequences,
+    # never reverse complemented
+    def sequence(self, fasta, use_strand=False):
+        return str(fasta[self.seqid][self.start - 1:self.stop])
+
+
+class GFF3NativeDB:
+    # Without gff3_file_path, lines can be added by add_lines
+    def __init__(self, gff3_file_path=None):
+        # All features in file order
+        self.features = []
+        # ID --> first feature with this ID
+        self.feature_ids = {}
+        # Parent ID --> child features in file order
+        self.children = {}
+        self.id_counter = {}
+        if gff3_file_path:
+            with open(gff3_file_path, "r") as gff3_file:
+                self.add_lines(gff3_file)
+
+    def add_lines(self, gff3_lines):
+        for line in gff3_lines:
+            if line.startswith("##FASTA"):
+                break
+            if line.startswith("#") or not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 9:
+                continue
+            feature = GFF3Feature(fields[0], fields[2], int(fields[3]), int(fields[4]), fields[6], fields[7],
+                                  self.parse_attributes(fields[8]))
+            feature_id = feature.attributes.get("ID", [None])[0]
+            if feature_id is None:
+                self.id_counter[feature.featuretype] = self.id_counter.get(feature.featuretype, 0) + 1
+                feature.id = feature.featuretype + "_" + str(self.id_counter[feature.featuretype])
+            elif feature_id in self.feature_ids:
+                self.id_counter[feature_id] = self.id_counter.get(feature_id, 0) + 1
+                feature.id = feature_id + "_" + str(self.id_counter[feature_id])
+            else:
+                feature.id = feature_id
+                self.feature_ids[feature_id] = feature
+            self.features.append(feature)
+            for parent_id in feature.attributes.get("Parent", []):
+                self.children.setdefault(parent_id, []).append(feature)
+
+    # Column 9: key=value1,value2;key=value
+    def parse_attributes(self, attribute_field):
+        attributes = {}
+        for attribute in attribute_field.strip().split(";"):
+            if "=" not in attribute:
+                continue
+            key, values = attribute.split("=", 1)
+            attributes[key.strip()] = [unquote(value) for value in values.split(",")]
+        return attributes
+
+    # All features of a type, each followed by all its children, grandchildren etc.
+    # Children are sorted by their ID: gffutils reads them from its relations table, whose primary key
+    # (parent, child, level) orders them by ID, not by file order
+    def iter_by_parent_childs(self, featuretype):
+        for feature in self.features:
+            if feature.featuretype == featuretype:
+                yield [feature] + self.descendants(feature)
+
+    def descendants(self, feature):
+        descendants = []
+        visited = {id(feature)}
+        # Only the first feature with an ID can be referenced as parent
+        if self.feature_ids.get(feature.id) is not feature:
+            return descendants
+        stack = [feature.id]
+        while stack:
+            for child in self.children.get(stack.pop(), []):
+                if id(child) in visited:
+                    continue
+                visited.add(id(child))
+                descendants.append(child)
+                if self.feature_ids.get(child.id) is child:
+                    stack.append(child.id)
+        return sorted(descendants, key=lambda child: child.id)
@@ -0,0 +1,44 @@
+# Streaming scanner of the features and attributes of a GFF3 file
+# Reads the GFF3 file line by line, without building a gffutils database, and collects all feature types
+# and the keys of their attributes, e.g. to help users configure the GFF3 parser.
+# Scanning stops at a ##FASTA section or, if max_features is set, after max_features feature lines.
+# Summary format: feature1§attr1§attr2$feature2§attr1
+# Feature types are sorted as returned by gffutils, attribute keys are in the order they were found.
+# An attribute column of "." has no attributes.
+
+
+class GFF3SchemaScanner:
+    # max_features: Maximal number of feature lines to scan, 0 to scan the whole file
+    def __init__(self, max_features=0):
+        self.max_features = max_features
+
+    # Return a dictionary: Feature type --> list of attribute keys
+    def scan(self, gff3_file_path):
+        features_attributes = {}
+        feature_count = 0
+        with open(gff3_file_path, "r") as gff3_file:
+            for line in gff3_file:
+                if line.startswith("##FASTA"):
+                    break
+                if line.startswith("#") or not line.strip():
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 9:
+                    continue
+                attribute_keys = features_attributes.setdefault(fields[2], [])
+                attribute_field = fields[8].strip()
+                if attribute_field != ".":
+                    for attribute in attribute_field.split(";"):
+                        attribute_key = attribute.split("=", 1)[0].strip()
+                        if attribute_key and attribute_key not in attribute_keys:
+                            attribute_keys.append(attribute_key)
+                feature_count += 1
+                if self.max_features and feature_count >= self.max_features:
+                    break
+        return features_attributes
+
+    # Return the features and attributes of a GFF3 file as string
+    def get_summary(self, gff3_file_path):
+        features_attributes = self.scan(gff3_file_path)
+        return "$".join([feature + "§" + "§".join(features_attributes[feature])
+                         for feature in sorted(features_attributes)])
@@ -0,0 +1,95 @@
+# Table-driven translation and reverse complement of nucleotide sequences
+# Both handle the IUPAC ambiguity codes (ACGT plus RYSWKMBDHVN).
+# Codons are translated with the standard genetic code. All codons of ambiguity codes are precomputed:
+# A codon gets the amino acid of all codons it can stand for, B/Z/J if these are exactly D,N / E,Q / I,L,
+# a stop (*) if all are stop codons and X otherwise (also for codons with letters that are not IUPAC codes).
+# translate_nt_batch translates many sequences at once via a NumPy lookup of all codons.
+import numpy as np
+
+iupac_nt = "ACGTRYSWKMBDHVN"
+iupac_nt_values = {"A": "A", "C": "C", "G": "G", "T": "T", "R": "AG", "Y": "CT", "S": "CG", "W": "AT", "K": "GT",
+                   "M": "AC", "B": "CGT", "D": "AGT", "H": "ACT", "V": "ACG", "N": "ACGT"}
+iupac_complement = str.maketrans("ACGTRYSWKMBDHVN", "TGCAYRSWMKVHDBN")
+iupac_delete = str.maketrans("", "", iupac_nt)
+# Standard genetic code, codons in the order TTT, TTC, TTA, TTG, TCT, ...
+genetic_code = "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"
+standard_codons = {first + second + third: genetic_code[16 * first_nr + 4 * second_nr + third_nr]
+                   for first_nr, first in enumerate("TCAG") for second_nr, second in enumerate("TCAG")
+                   for third_nr, third in enumerate("TCAG")}
+ambiguous_amino_acids = {"DN": "B", "EQ": "Z", "IL": "J"}
+
+
+def translate_codon(codon):
+    amino_acids = set(standard_codons[first + second + third]
+                      for first in iupac_nt_values[codon[0]] for second in iupac_nt_values[codon[1]]
+                      for third in iupac_nt_values[codon[2]])
+    if len(amino_acids) == 1:
+        return amino_acids.pop()
+    if "*" in amino_acids:
+        return "X"
+    return ambiguous_amino_acids.get("".join(sorted(amino_acids)), "X")
+
+
+# Codon --> amino acid for all codons of IUPAC letters
+codon_table = {first + second + third: translate_codon(first + second + third)
+               for first in iupac_nt for second in iupac_nt for third in iupac_nt}
+# The same table as array: Index of a codon is 16*16*letter 1 + 16*letter 2 + letter 3,
+# letters not in iupac_nt get index 15 and thus map to X
+codon_base = len(iupac_nt) + 1
+nt_index = np.full(256, len(iupac_nt), dtype=np.uint8)
+nt_index[np.frombuffer(iupac_nt.encode(), dtype=np.uint8)] = np.arange(len(iupac_nt), dtype=np.uint8)
+codon_array = np.full(codon_base ** 3, ord("X"), dtype=np.uint8)
+for codon, amino_acid in codon_table.items():
+    codon_array[codon_base ** 2 * iupac_nt.index(codon[0]) + codon_base * iupac_nt.index(codon[1]) +
+                iupac_nt.index(codon[2])] = ord(amino_acid)
+
+
+# Reverse complement a nucleotide sequence
+# If letters other than IUPAC nucleotide codes are found: return empty string
+def reverse_complement(sequence):
+    if sequence.translate(iupac_delete):
+        return ""
+    return sequence.translate(iupac_complement)[::-1]
+
+
+# Coding part of a nucleotide sequence: Starts with the first in-frame ATG, is padded with N to full codons
+def coding_sequence(nt_sequence):
+    for start in range(0, len(nt_sequence) - 2, 3):
+        if nt_sequence[start:start + 3] == "ATG":
+            nt_sequence = nt_sequence[start:]
+            return nt_sequence + "N" * (-len(nt_sequence) % 3)
+    return ""
+
+
+# Translate a nucleotide sequence into protein sequence, up to the first stop codon
+# Codons are translated in blocks of 100, so that translation ends soon after a stop codon
+def translate_nt(nt_sequence):
+    nt_sequence = coding_sequence(nt_sequence)
+    protein_sequence = []
+    for block_start in range(0, len(nt_sequence), 300):
+        protein_block = "".join([codon_table.get(nt_sequence[codon_start:codon_start + 3], "X") for codon_start in
+                                 range(block_start, min(block_start + 300, len(nt_sequence)), 3)])
+        if "*" in protein_block:
+            protein_sequence.append(protein_block.split("*", 1)[0])
+            break
+        protein_sequence.append(protein_block)
+    return "".join(protein_sequence)
+
+
+# Translate a list of nucleotide sequences, returns the list of protein sequences
+# All codons of batch_size sequences are looked up in a single NumPy operation
+def translate_nt_batch(nt_sequences, batch_size=10000):
+    protein_sequences = []
+    for batch_start in range(0, len(nt_sequences), batch_size):
+        coding_sequences = [coding_sequence(nt_sequence) for nt_sequence in
+                            nt_sequences[batch_start:batch_start + batch_size]]
+        nt_bytes = np.frombuffer("".join(coding_sequences).encode("ascii", "replace"), dtype=np.uint8)
+        letter_idx = nt_index[nt_bytes].reshape(-1, 3).astype(np.int32)
+        protein_bytes = codon_array[codon_base ** 2 * letter_idx[:, 0] + codon_base * letter_idx[:, 1] +
+                                    letter_idx[:, 2]].tobytes().decode("ascii")
+        codon_start = 0
+        for nt_sequence in coding_sequences:
+            codon_end = codon_start + len(nt_sequence) // 3
+            protein_sequences.append(protein_bytes[codon_start:codon_end].split("*", 1)[0])
+            codon_start = codon_end
+    return protein_sequences
@@ -0,0 +1,63 @@
+# Batched write-back of property updates to a running project DB
+# Instead of one auto-commit query per update, updates are collected as rows (dicts)
+# and flushed as one transaction per batch: UNWIND {rows} AS row <update_query>
+# The update query accesses the values of each update as row.<key>, e.g.
+# "MATCH(gene:Gene) WHERE gene.geneId = row.geneId SET gene.name = row.name"
+# Transient errors (deadlocks, leader switches, short unavailability of the DB) are retried
+# with an increasing delay. Throughput is reported as rows per second of write time.
+import time
+from neo4j.exceptions import TransientError, ServiceUnavailable
+
+
+class BatchWriter:
+    # session: Open session to the project DB
+    # update_query: Cypher query applied to every row
+    # batch_size: Number of rows per transaction
+    # max_retries: Number of retries of a failed batch before the error is raised
+    def __init__(self, session, update_query, batch_size=10000, max_retries=5):
+        self.session = session
+        self.update_query = "UNWIND {rows} AS row " + update_query
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.rows = []
+        # Statistics
+        self.written_rows = 0
+        self.write_time = 0.0
+
+    # Add an update, the batch is flushed automatically once it is full
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    # Write all collected rows in one transaction
+    def flush(self):
+        if not self.rows:
+            return
+        start_time = time.time()
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Transaction is committed when the block is left without error, else rolled back
+                with self.session.begin_transaction() as tx:
+                    tx.run(self.update_query, {"rows": self.rows})
+                break
+            except (TransientError, ServiceUnavailable) as err:
+                if attempt == self.max_retries:
+                    raise
+                print("Batch write failed (%s), retrying" % err)
+                time.sleep(2 ** attempt)
+        self.write_time += time.time() - start_time
+        self.written_rows += len(self.rows)
+        self.rows = []
+
+    # Written rows per second
+    def throughput(self):
+        if not self.write_time:
+            return 0.0
+        return self.written_rows / self.write_time
+
+    # Write remaining rows
+    def close(self):
+        self.flush()
+        print("Wrote %s rows in %s s (%s rows/s)" % (self.written_rows, round(self.write_time, 2),
+                                                     round(self.throughput(), 2)))
@@ -0,0 +1,105 @@
+# Content-addressed cache of the stages of a project DB build
+# Each stage is identified by a key: A hash over the stage name, its parameters and the content of its input files.
+# After a stage finished, the key is stored together with the size and modification time of all its output files
+# in build_cache.json in the project folder.
+# On a rebuild, a stage is skipped if its key did not change and all its output files are still unchanged.
+# Input files are hashed by content, so a stage only runs again if one of its inputs really changed, not just
+# because a previous stage was run again. Content hashes are kept in the cache as well and only recalculated
+# if size or modification time of a file changed.
+# Input and output files can be given as glob patterns, e.g. for the files of a BLAST database
+# Stages may run in parallel threads (see BuildScheduler), changes of the cache are thus locked
+import os
+import threading
+import glob
+import json
+import hashlib
+
+
+class BuildCache:
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        # Stage name --> {"key": Stage key, "outputs": {File path: [Size, Modification time]}}
+        self.stages = {}
+        # File path --> [Size, Modification time, Content hash]
+        self.files = {}
+        self.lock = threading.RLock()
+        if os.path.isfile(self.cache_path):
+            try:
+                with open(self.cache_path, "r") as cache_file:
+                    cache = json.load(cache_file)
+                self.stages = cache["stages"]
+                self.files = cache["files"]
+            except (ValueError, KeyError):
+                print("Ignoring invalid build cache %s" % self.cache_path)
+
+    # Key of a stage
+    # inputs: List of input file paths or glob patterns
+    # params: List of parameters (strings or numbers) influencing the stage results
+    def stage_key(self, stage_name, inputs, params):
+        stage_key = hashlib.blake2b(digest_size=16)
+        stage_key.update(json.dumps([stage_name, [str(param) for param in params]]).encode())
+        for input_pattern in inputs:
+            input_paths = sorted(glob.glob(input_pattern))
+            # Missing input files are part of the key as well
+            if not input_paths:
+                stage_key.update(("missing:" + input_pattern).encode())
+            for input_path in input_paths:
+                stage_key.update((input_path + ":" + self.file_hash(input_path)).encode())
+        return stage_key.hexdigest()
+
+    # Content hash of a file, reused from the cache if the file did not change
+    def file_hash(self, file_path):
+        file_stat = os.stat(file_path)
+        cached = self.files.get(file_path)
+        if cached and cached[0] == file_stat.st_size and cached[1] == file_stat.st_mtime_ns:
+            return cached[2]
+        file_hash = hashlib.blake2b(digest_size=16)
+        with open(file_path, "rb") as hashed_file:
+            for block in iter(lambda: hashed_file.read(1 << 20), b""):
+                file_hash.update(block)
+        with self.lock:
+            self.files[file_path] = [file_stat.st_size, file_stat.st_mtime_ns, file_hash.hexdigest()]
+        return file_hash.hexdigest()
+
+    # Test whether a stage with this key finished before and all its outputs are unchanged
+    # Stages without recorded outputs are never valid
+    def is_valid(self, stage_name, stage_key):
+        stage = self.stages.get(stage_name)
+        if not stage or stage["key"] != stage_key or not stage["outputs"]:
+            return False
+        for output_path, (size, mtime) in stage["outputs"].items():
+            if not os.path.isfile(output_path):
+                return False
+            output_stat = os.stat(output_path)
+            if output_stat.st_size != size or output_stat.st_mtime_ns != mtime:
+                return False
+        return True
+
+    # Record a finished stage
+    # outputs: List of output file paths or glob patterns
+    # Raises FileNotFoundError if a pattern matches no file, the stage is then not recorded
+    def record(self, stage_name, stage_key, outputs):
+        output_files = {}
+        for output_pattern in outputs:
+            output_paths = glob.glob(output_pattern)
+            if not output_paths:
+                self.invalidate(stage_name)
+                raise FileNotFoundError("Build stage %s did not write %s" % (stage_name, output_pattern))
+            for output_path in output_paths:
+                output_stat = os.stat(output_path)
+                output_files[output_path] = [output_stat.st_size, output_stat.st_mtime_ns]
+        with self.lock:
+            self.stages[stage_name] = {"key": stage_key, "outputs": output_files}
+            self.save()
+
+    # Remove a stage, e.g. because it failed
+    def invalidate(self, stage_name):
+        with self.lock:
+            if self.stages.pop(stage_name, None) is not None:
+                self.save()
+
+    def save(self):
+        with self.lock:
+            with open(self.cache_path + ".tmp", "w") as cache_file:
+                json.dump({"stages": self.stages, "files": self.files}, cache_file)
+            os.replace(self.cache_path + ".tmp", self.cache_path)
@@ -0,0 +1,91 @@
+# Scheduler for the stages of a project DB build
+# The build is described as a graph of stages: Each stage names the stages it depends on
+# and the number of CPU cores it uses. A stage is started as soon as all stages it depends on finished
+# and enough cores of the global budget (cpu_cores in Daisychain_config.txt) are free.
+# Independent stages, e.g. the nucleotide and the protein homology chains, thus run in parallel.
+# Stages run in threads of the server process, CPU-heavy work is done by external tools
+# (DIAMOND, MCL) or released by I/O.
+# The status of the build lists all running stages and is reported via a callback, e.g. to TaskManagement.
+# If a stage fails (returns False or raises an exception), no further stages are started and
+# the scheduler waits for all running stages to finish. The failed stages are listed in failed_stages.
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class BuildStage:
+    # name: Unique name of the stage
+    # status: Task status shown while the stage is running
+    # deps: Names of the stages that have to finish first
+    # cpus: Number of CPU cores used by the stage
+    # func: Function running the stage, called with the number of cores granted to the stage.
+    # Returns False if the stage failed, after reporting the reason itself (e.g. in the task results)
+    def __init__(self, name, status, deps, cpus, func):
+        self.name = name
+        self.status = status
+        self.deps = deps
+        self.cpus = cpus
+        self.func = func
+
+
+class BuildScheduler:
+    # stages: List of BuildStage, in the order they should be started if they are ready at the same time
+    # cpu_budget: Number of CPU cores available for all running stages
+    # set_status: Function called with the current build status
+    def __init__(self, stages, cpu_budget, set_status):
+        self.stages = stages
+        self.cpu_budget = max(1, cpu_budget)
+        self.set_status = set_status
+        # Stages that returned False or raised an exception in the last run
+        self.failed_stages = []
+        stage_names = [stage.name for stage in stages]
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in stage_names:
+                    raise ValueError("Stage %s depends on unknown stage %s" % (stage.name, dep))
+
+    # Run all stages, returns True if all stages finished successfully
+    def run(self):
+        waiting = list(self.stages)
+        finished = set()
+        running = {}
+        free_cpus = self.cpu_budget
+        failed = False
+        error = None
+        self.failed_stages = []
+        with ThreadPoolExecutor(max_workers=len(self.stages) or 1) as executor:
+            while (waiting and not failed) or running:
+                # Start all ready stages that fit into the free cores
+                # A stage needing more cores than the budget is granted the whole budget
+                if not failed:
+                    for stage in list(waiting):
+                        stage_cpus = min(stage.cpus, self.cpu_budget)
+                        if all(dep in finished for dep in stage.deps) and stage_cpus <= free_cpus:
+                            waiting.remove(stage)
+                            free_cpus -= stage_cpus
+                            running[executor.submit(stage.func, stage_cpus)] = (stage, stage_cpus)
+                    self.report(running, finished)
+                if not running:
+                    # Remaining stages depend on each other in a cycle
+                    raise ValueError("Build stages %s can not be scheduled" % [stage.name for stage in waiting])
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, stage_cpus = running.pop(future)
+                    free_cpus += stage_cpus
+                    try:
+                        if future.result() is False:
+                            print("Build stage %s failed" % stage.name)
+                            failed = True
+                            self.failed_stages.append(stage)
+                        else:
+                            finished.add(stage.name)
+                    except Exception as err:
+                        print("Build stage %s failed: %s" % (stage.name, err))
+                        failed = True
+                        error = err
+                        self.failed_stages.append(stage)
+        if error is not None:
+            raise error
+        return not failed
+
+    def report(self, running, finished):
+        self.set_status(", ".join([stage.status for stage, _ in running.values()]) +
+                        " (%s of %s build stages finished)" % (len(finished), len(self.stages)))
@@ -3,14 +3,29 @@
 # Functions directly accessible by user query always return a string via socket connection
 import os
 import subprocess
-from itertools import islice, product
-from CSV_creator.annotation_to_csv import AnnoToCSV
+from itertools import islice
+from CSV_creator.parallel_annotation_to_csv import ParallelAnnoToCSV
 from CSV_creator.cluster_to_csv import ClusterToCSV
+from CSV_creator.percent_identity_store import PercentIdentityStore
+from CSV_creator.diamond_to_abc import DiamondToABC
+from CSV_creator.synteny_to_csv import SyntenyToCSV
+from CSV_creator.synteny_block_to_csv import SyntenyBlockToCSV
 from Parser.GFF3_parser_gffutils_v2 import GFF3Parser_v2
+from Server.Project_access.Batch_Writer import BatchWriter
+from Server.Project_access.Build_Cache import BuildCache
+from Server.Project_access.Build_Scheduler import BuildStage, BuildScheduler
+from Server.Project_access.File_Linker import FileLinker
+from Synteny.gene_neighbourhood import GeneNeighbourhoodIndex
+from Synteny.local_synteny import GeneIdEncoder, LocalSynteny
+from Synteny.sharded_synteny import ShardedLocalSynteny, species_shard_keys, contig_shard_keys
+from Synteny.synteny_state import SyntenyState, get_gene_keys
+from Synteny.synteny_checkpoint import SyntenyCheckpoint
 from random import choice
 from neo4j.v1 import GraphDatabase, basic_auth
 import time
-import pickle
+import datetime
+import resource
+import numpy as np
 
 class DBBuilder:
     def __init__(self, main_db_driver, task_manager, send_data, ahgrar_config):
@@ -24,10 +39,9 @@ class DBBuilder:
     # e.g. [STAT, ProjectID, TaskID1, TaskID2]
     def evaluate_user_request(self, user_request):
         # Set GFF3 parser for some or all GFF3 files in a project
-        if user_request[0] == "GFF3" and len(user_request) == 7 and user_request[1].isdigit():
-            # Call format: ProjectID, parent_feat, sub_feature, name_attr, descr_attr
-            self.set_gff3_parser(user_request[1],user_request[2], user_request[3],
-                                 user_request[4], user_request[5], user_request[6])
+        if user_request[0] == "GFF3" and len(user_request) in [7, 8] and user_request[1].isdigit():
+            # Call format: ProjectID, parent_feat, sub_feature, name_attr, descr_attr, file_name, optional backend
+            self.set_gff3_parser(*user_request[1:])
         # Build the neo4j-based project database from the previously added files
         elif user_request[0] == "DB" and len(user_request) == 2 and user_request[1].isdigit():
             self.build_db(user_request[1])
@@ -61,7 +75,8 @@ class DBBuilder:
             file_list = list(session_a.run("MATCH(proj:Project)-[:has_files]->(:File_Manager)-[:file]->(file:File) "
                               "WHERE ID(proj)={proj_id} AND file.hidden = 'False' "
                               "RETURN file.filename, file.filetype, file.species, file.variant, file.parent_feat, "
-                                            "file.sub_features, file.name_attr, file.desc_attr ORDER BY file.filename",
+                                            "file.sub_features, file.name_attr, file.desc_attr, file.gff3_backend "
+                                            "ORDER BY file.filename",
                           {"proj_id":int(proj_id)}))
         # Convert file_list into a dictionary:
         file_dict = {}
@@ -71,7 +86,7 @@ class DBBuilder:
         for file in file_list:
             file_dict[(file["file.species"],file["file.variant"])].append(
                 (file["file.filename"],file["file.filetype"],file["file.parent_feat"],file["file.sub_features"],
-                 file["file.name_attr"],file["file.desc_attr"]))
+                 file["file.name_attr"],file["file.desc_attr"],file["file.gff3_backend"] or "gffutils"))
 
         # Check if each entry in the database consists of exactly two files, one fasta and one annotation file
         # If not, remove that entry from the database
@@ -80,172 +95,134 @@ class DBBuilder:
             if len(file_types) != 2 or "annotation" not in file_types or "genome" not in file_types:
                 del file_dict[species]
 
-        # Initialize the annotation to csv format parser
-        self.task_mngr.set_task_status(proj_id, task_id, "Parsing annotation data")
-        # Initialize CSV parser:  CSV output directory, gene transcript and translation output files
-        # All genes from all files are combined into one set of output files
-        anno_to_csv_parser = AnnoToCSV(os.path.join("Projects", proj_id, "CSV"),
-                                       os.path.join("Projects", proj_id, "BlastDB", "transcripts.faa"),
-                                       os.path.join("Projects", proj_id, "BlastDB", "translations.faa"))
-        # Then convert every annotation file into a Neo4j-specific CSV file format
-        for species in file_dict.keys():
-            try:
-                # Retrieve name of annotation and genome file. Sort file list alphanumerical. Since
-                # annotation < genome the annotation file is nr. 0, the genome file nr. 1
-                anno_file = sorted(file_dict[species], key=lambda x: x[1])[0]
-                genome_file = sorted(file_dict[species], key=lambda x: x[1])[1]
-                anno_to_csv_parser.create_csv(os.path.join("Projects", proj_id, "Files", anno_file[0]),
-                                              os.path.join("Projects", proj_id, "Files", genome_file[0]),
-                                              anno_file[2], anno_file[3],anno_file[4],anno_file[5])
-            except (IndexError, KeyError):
-                self.task_mngr.set_task_status(proj_id, task_id, "Failed")
-                self.task_mngr.add_task_results(proj_id, task_id, "Failed: Annotation parsing")
-                return
-        # Build the BLAST databases using DIAMOND
-        # Define File folder path:
-        # Create transcript blast DB
-        # Perform an all vs all blastn search
+        # The build consists of stages. Each stage is skipped if its inputs and parameters did not change
+        # since its last run and its output files are unchanged (see BuildCache)
+        # Stages form a graph and are run by the BuildScheduler: Independent stages, i.e. the nucleotide and the
+        # protein homology chains, run in parallel as long as they fit into the CPU budget of cpu_cores
+        build_cache = BuildCache(os.path.join("Projects", str(proj_id), "build_cache.json"))
+        CSV_path = os.path.join("Projects", str(proj_id), "CSV")
         BlastDB_path = os.path.join("Projects", str(proj_id), "BlastDB")
-        print(os.path.join(BlastDB_path, "transcripts.blastn"))
-        print(os.path.join(BlastDB_path, "translations.blastp"))
-        self.task_mngr.set_task_status(proj_id, task_id, "Building Blast+ DB")
-        #makeblastdb_path = os.path.join(self.ahgrar_config["Daisychain_Server"]["blast+_path"], "makeblastdb")
         diamond_path = self.ahgrar_config['Daisychain_Server']['diamond_path']
-
-        # we still need to keep the nucleotide database for the BLAST query
-        subprocess.run(
-            [makeblastdb_path, "-dbtype", "nucl", "-in", os.path.join(BlastDB_path, "transcripts.faa"),
-             "-parse_seqids", "-hash_index", "-out", os.path.join(BlastDB_path, "transcript_db")], check=True)
-        # CHANGE - diamond can only do proteins, so make only one DB
-        subprocess.run([diamond_path, 'makedb', '--in', os.path.join(BlastDB_path, "translations.faa"), 
-              '--db', os.path.join(BlastDB_path, "translation_db")], check=True)
-
-        self.task_mngr.set_task_status(proj_id, task_id, "All vs. all BlastN")
-        #blastn_path = os.path.join(self.ahgrar_config["Daisychain_Server"]["blast+_path"], "blastn")
-        cpu_cores = self.ahgrar_config["Daisychain_Server"]["cpu_cores"]
-        print("Blastx now")
-        #subprocess.run(
-        #    [blastn_path, "-query", os.path.join(BlastDB_path, "transcripts.faa"), "-db",
-        #     os.path.join(BlastDB_path, "transcript_db"), "-outfmt", "6 qseqid sseqid evalue qlen slen nident",
-        #                                 "-out", os.path.join(BlastDB_path, "transcripts.blastn"),
-        #                    "-num_threads", cpu_cores, "-evalue", "1e-5", "-parse_deflines"])
-        subprocess.run(
-             [diamond_path, 'blastx', '--query', os.path.join(BlastDB_path, "transcripts.faa"), '--db', 
-              os.path.join(BlastDB_path, "translation_db"), "--outfmt", "6", "qseqid", "sseqid", "evalue",
-              "qlen", "slen", "nident",
-              '-o', os.path.join(BlastDB_path, "transcripts.blastn"), 
-              '--threads', cpu_cores, '--evalue', '1e-5'])
-        # BUGFIX - diamond keeps those annoying 'lcl|' in the header, blast+ used to remove them. We have to sed them away from the results.
-        subprocess.run(
-              ['sed', '-i', 's/lcl|//g', os.path.join(BlastDB_path, "transcripts.blastn")])
-        self.task_mngr.set_task_status(proj_id, task_id, "All vs. all BlastP")
-        #blastp_path = os.path.join(self.ahgrar_config["Daisychain_Server"]["blast+_path"], "blastp")
-        print("Blastp now")
-        #subprocess.run(
-        #    [blastp_path, "-query", os.path.join(BlastDB_path, "translations.faa"), "-db",
-        #     os.path.join(BlastDB_path, "translation_db"), "-outfmt", "6 qseqid sseqid evalue qlen slen nident",
-        #     "-out", os.path.join(BlastDB_path, "translations.blastp"),
-        #    "-num_threads", cpu_cores, "-evalue", "1e-5", "-parse_deflines"])
-        subprocess.run(
-             [diamond_path, 'blastp', '--query',  os.path.join(BlastDB_path, "translations.faa"), "--db",
-              os.path.join(BlastDB_path, "translation_db"), "--outfmt", "6", "qseqid", "sseqid", "evalue",
-              "qlen", "slen", "nident",
-              '--out', os.path.join(BlastDB_path, "translations.blastp"),
-              '--threads', cpu_cores, '--evalue', '1e-5'])
-
-        subprocess.run(
-              ['sed', '-i', 's/lcl|//g', os.path.join(BlastDB_path, "translations.blastp")])
-
-        # Extract sequence match identity from blast result files
-        # Create new blastn/blastp result files lacking the percent match ID column (ABC files)
-        # Dump dict with geneID/geneID/PercentMatch and protID/protID/PercentMatch as json
-        gene_gene_percentID = {}
-        print("blastn to abc")
-        with open(os.path.join(BlastDB_path, "transcripts.blastn"), "r") as nt_blast_file:
-            with open(os.path.join(BlastDB_path, "transcripts.abc"), "w") as  nt_blast_abc_file:
-             for line in nt_blast_file:
-                    line = line.split("\t")
-                    perc_ID = str(round(100*int(line[5].strip())/max(int(line[3]),int(line[4])),2))
-                    gene_gene_percentID["g"+line[0]+"_g"+line[1]] = perc_ID
-                    nt_blast_abc_file.write("\t".join([line[0],line[1],perc_ID])+"\n")
-        with open(os.path.join(BlastDB_path, "transcripts_pid.json"), 'wb') as dict_dump:
-            pickle.dump(gene_gene_percentID, dict_dump)
-        prot_prot_percentID = {}
-        print("blastp to abc")
-        with open(os.path.join(BlastDB_path, "translations.blastp"), "r") as prot_blast_file:
-            with open(os.path.join(BlastDB_path, "translations.abc"), "w") as  prot_blast_abc_file:
-             for line in prot_blast_file:
-                    line = line.split("\t")
-                    perc_ID = str(round(100 * int(line[5].strip()) / max(int(line[3]), int(line[4])), 2))
-                    prot_prot_percentID["p"+line[0]+"_p"+line[1]] = perc_ID
-                    prot_blast_abc_file.write("\t".join([line[0],line[1],perc_ID])+"\n")
-        with open(os.path.join(BlastDB_path, "translations_pid.json"), 'wb') as dict_dump:
-            pickle.dump(prot_prot_percentID, dict_dump)
-        # 0a. Cluster all-vs.-all BlastN results into gene homology groups
-        self.task_mngr.set_task_status(proj_id, task_id, "Cluster BlastN results")
-        # 1a. Convert blastN ABC file into a network and dictionary file.
+        makeblastdb_path = os.path.join(self.ahgrar_config["Daisychain_Server"]["blast+_path"], "makeblastdb")
         mcxload_path = os.path.join(self.ahgrar_config["Daisychain_Server"]["mcxload_path"])
-        # subprocess.run(
-        #     [mcxload_path, "-abc", os.path.join(BlastDB_path, "transcripts.abc"), "--stream-mirror", "--stream-neg-log10",
-        #      "-stream-tf",
-        #      "ceil(200)", "-o", os.path.join(BlastDB_path, "transcripts.mci"), "-write-tab",
-        #      os.path.join(BlastDB_path, "transcripts.tab")], check=True)
-        subprocess.run(
-            [mcxload_path, "-abc", os.path.join(BlastDB_path, "transcripts.abc"), "--stream-mirror",
-             "-o", os.path.join(BlastDB_path, "transcripts.mci"), "-write-tab",
-             os.path.join(BlastDB_path, "transcripts.tab")], check=True)
-        # 2a. Cluster MCL blastN results
         mcl_path = os.path.join(self.ahgrar_config["Daisychain_Server"]["mcl_path"])
-        subprocess.run([mcl_path, os.path.join(BlastDB_path, "transcripts.mci"), "-te", "8", "-I", "1.4", "-use-tab",
-                        os.path.join(BlastDB_path, "transcripts.tab"), "-o",
-                        os.path.join(BlastDB_path, "transcripts_1.4.clstr")], check=True)
-        subprocess.run([mcl_path, os.path.join(BlastDB_path, "transcripts.mci"), "-te", "8", "-I", "5.0", "-use-tab",
-                        os.path.join(BlastDB_path, "transcripts.tab"), "-o",
-                        os.path.join(BlastDB_path, "transcripts_5.0.clstr")], check=True)
-        subprocess.run([mcl_path, os.path.join(BlastDB_path, "transcripts.mci"), "-te", "8", "-I", "10.0", "-use-tab",
-                        os.path.join(BlastDB_path, "transcripts.tab"), "-o",
-                        os.path.join(BlastDB_path, "transcripts_10.0.clstr")], check=True)
-        # 3a. Parse MCL cluster files and create CSV files describing the homology relationships between gene nodes
-        self.task_mngr.set_task_status(proj_id, task_id, "Write CSV files for nucleotide clusters")
-        with open(os.path.join(BlastDB_path, "transcripts_pid.json"), 'rb') as transcripts_pid_dict:
-            nucl_clstr_to_csv_parser = ClusterToCSV(os.path.join("Projects", str(proj_id), "CSV", "gene_hmlg.csv"),
-                                                    pickle.load(transcripts_pid_dict), "nucl")
-            nucl_clstr_to_csv_parser.create_csv(os.path.join(BlastDB_path, "transcripts_1.4.clstr"), "1.4")
-            nucl_clstr_to_csv_parser.create_csv(os.path.join(BlastDB_path, "transcripts_5.0.clstr"), "5.0")
-            nucl_clstr_to_csv_parser.create_csv(os.path.join(BlastDB_path, "transcripts_10.0.clstr"), "10.0")
-        # 0b. Cluster all-vs.-all BlastP results into protein homology groups
-        self.task_mngr.set_task_status(proj_id, task_id, "Cluster BlastP results")
-        # 1b. Convert blastP ABC file into a network and dictionary file.
-        # subprocess.run(
-        #     [mcxload_path, "-abc", os.path.join(BlastDB_path, "translations.abc"), "--stream-mirror",
-        #      "--stream-neg-log10",
-        #      "-stream-tf",
-        #      "ceil(200)", "-o", os.path.join(BlastDB_path, "translations.mci"), "-write-tab",
-        #      os.path.join(BlastDB_path, "translations.tab")], check=True)
-        subprocess.run(
-            [mcxload_path, "-abc", os.path.join(BlastDB_path, "translations.abc"), "--stream-mirror",
-             "-o", os.path.join(BlastDB_path, "translations.mci"), "-write-tab",
-             os.path.join(BlastDB_path, "translations.tab")], check=True)
-        # 2b. Cluster MCL blastP results
-        subprocess.run([mcl_path, os.path.join(BlastDB_path, "translations.mci"), "-te", "8", "-I", "1.4", "-use-tab",
-                        os.path.join(BlastDB_path, "translations.tab"), "-o",
-                        os.path.join(BlastDB_path, "translations_1.4.clstr")], check=True)
-        subprocess.run([mcl_path, os.path.join(BlastDB_path, "translations.mci"), "-te", "8", "-I", "5.0", "-use-tab",
-                        os.path.join(BlastDB_path, "translations.tab"), "-o",
-                        os.path.join(BlastDB_path, "translations_5.0.clstr")], check=True)
-        subprocess.run([mcl_path, os.path.join(BlastDB_path, "translations.mci"), "-te", "8", "-I", "10.0", "-use-tab",
-                        os.path.join(BlastDB_path, "translations.tab"), "-o",
-                        os.path.join(BlastDB_path, "translations_10.0.clstr")], check=True)
-        # 3b. Parse MCL cluster files and create CSV files describing the homology relationships between protein nodes
-        self.task_mngr.set_task_status(proj_id, task_id, "Write CSV files for protein clusters")
-        with open(os.path.join(BlastDB_path, "translations_pid.json"), 'rb') as translations_pid_dict:
-            nucl_clstr_to_csv_parser = ClusterToCSV(os.path.join(os.path.join("Projects", str(proj_id), "CSV",
-                                                                              "protein_hmlg.csv")),
-                                                    pickle.load(translations_pid_dict), "prot")
-            nucl_clstr_to_csv_parser.create_csv(os.path.join(BlastDB_path, "translations_1.4.clstr"), "1.4")
-            nucl_clstr_to_csv_parser.create_csv(os.path.join(BlastDB_path, "translations_5.0.clstr"), "5.0")
-            nucl_clstr_to_csv_parser.create_csv(os.path.join(BlastDB_path, "translations_10.0.clstr"), "10.0")
-
+        cpu_cores = int(self.ahgrar_config["Daisychain_Server"]["cpu_cores"])
+        # Both chains get half of the cores for their multi-threaded stages
+        chain_cores = max(1, cpu_cores // 2)
+        build_stages = []
+        # 1. Parse the annotation files of all species
+        # Species order and parser settings determine the gene IDs and are thus part of the stage key
+        anno_inputs = []
+        anno_params = []
+        for species in file_dict.keys():
+            for file in sorted(file_dict[species], key=lambda x: x[1]):
+                anno_inputs.append(os.path.join("Projects", proj_id, "Files", file[0]))
+                anno_params.append("\t".join(str(item) for item in (species,) + file))
+        build_stages.append(self.cached_build_stage(
+            build_cache, "annotation", "Parsing annotation data", [], cpu_cores, anno_inputs, anno_params,
+            [os.path.join(CSV_path, csv_file) for csv_file in
+             ["gene_nodes.csv", "gene_5nb.csv", "gene_3nb.csv", "protein_nodes.csv", "gene_protein_coding.csv"]] +
+            [os.path.join(BlastDB_path, "transcripts.faa"), os.path.join(BlastDB_path, "translations.faa")],
+            lambda cpus: self.parse_annotations(proj_id, task_id, file_dict, cpus)))
+        # 2. Build the BLAST databases and perform all vs. all searches
+        # The nucleotide BLAST database is only used by BLAST queries (see QueryManagement.blast), not by the build.
+        # Without makeblastdb the build continues and these queries are not available
+        if os.path.isfile(makeblastdb_path):
+            build_stages.append(self.cached_build_stage(
+                build_cache, "transcript_db", "Building Blast+ DB", ["annotation"], 1,
+                [os.path.join(BlastDB_path, "transcripts.faa")], [makeblastdb_path],
+                [os.path.join(BlastDB_path, "transcript_db.*")],
+                lambda cpus: self.build_transcript_db(BlastDB_path, makeblastdb_path)))
+        else:
+            self.task_mngr.add_task_results(proj_id, task_id, "Warning: makeblastdb not found at %s, nucleotide "
+                                                              "BLAST queries will not be available" % makeblastdb_path)
+        build_stages.append(self.cached_build_stage(
+            build_cache, "translation_db", "Building DIAMOND DB", ["annotation"], 1,
+            [os.path.join(BlastDB_path, "translations.faa")], [diamond_path],
+            [os.path.join(BlastDB_path, "translation_db.*")],
+            lambda cpus: self.build_translation_db(BlastDB_path, diamond_path)))
+        build_stages.append(self.cached_build_stage(
+            build_cache, "blastx", "All vs. all BlastN", ["translation_db"], chain_cores,
+            [os.path.join(BlastDB_path, "transcripts.faa"), os.path.join(BlastDB_path, "translation_db.*")],
+            [diamond_path, "1e-5", "qcovhsp scovhsp"], [os.path.join(BlastDB_path, "transcripts.blastn")],
+            lambda cpus: self.blastx_transcripts(BlastDB_path, diamond_path, cpus)))
+        build_stages.append(self.cached_build_stage(
+            build_cache, "blastp", "All vs. all BlastP", ["translation_db"], chain_cores,
+            [os.path.join(BlastDB_path, "translations.faa"), os.path.join(BlastDB_path, "translation_db.*")],
+            [diamond_path, "1e-5", "qcovhsp scovhsp"], [os.path.join(BlastDB_path, "translations.blastp")],
+            lambda cpus: self.blastp_translations(BlastDB_path, diamond_path, cpus)))
+        # 3. Cluster all vs. all search results into homology groups
+        # The network is loaded once by mcxload, then clustered by MCL once per inflation value.
+        # Each clustering is a stage of its own, so that all inflation values run in parallel within the CPU budget
+        # The first inflation value (large clusters) is used for local synteny scores and synteny blocks
+        inflations = self.mcl_inflations()
+        mcl_cores = max(1, chain_cores // len(inflations))
+        # Hits below the minimal percent match or coverage (in percent, of query and subject) are dropped
+        min_identity = float(self.ahgrar_config["Daisychain_Server"].get("homology_min_identity", "0"))
+        min_coverage = float(self.ahgrar_config["Daisychain_Server"].get("homology_min_coverage", "0"))
+        for seq_type, search, blast_file, status in [
+                ("transcripts", "blastx", "transcripts.blastn", "Cluster BlastN results"),
+                ("translations", "blastp", "translations.blastp", "Cluster BlastP results")]:
+            build_stages.append(self.cached_build_stage(
+                build_cache, "abc_" + seq_type, "Extracting sequence match identity of " + seq_type, [search], 1,
+                [os.path.join(BlastDB_path, blast_file)], [min_identity, min_coverage],
+                [os.path.join(BlastDB_path, seq_type + ".abc"), os.path.join(BlastDB_path, seq_type + "_pid.*.npy")],
+                lambda cpus, seq_type=seq_type, blast_file=blast_file:
+                self.blast_to_abc(BlastDB_path, seq_type, blast_file, min_identity, min_coverage)))
+            build_stages.append(self.cached_build_stage(
+                build_cache, "mcxload_" + seq_type, status, ["abc_" + seq_type], 1,
+                [os.path.join(BlastDB_path, seq_type + ".abc")], [mcxload_path],
+                [os.path.join(BlastDB_path, seq_type + ".mci"), os.path.join(BlastDB_path, seq_type + ".tab")],
+                lambda cpus, seq_type=seq_type: self.load_homolog_network(BlastDB_path, seq_type, mcxload_path)))
+            for inflation in inflations:
+                build_stages.append(self.cached_build_stage(
+                    build_cache, "mcl_%s_%s" % (seq_type, inflation), "%s (inflation %s)" % (status, inflation),
+                    ["mcxload_" + seq_type], mcl_cores,
+                    [os.path.join(BlastDB_path, seq_type + ".mci"), os.path.join(BlastDB_path, seq_type + ".tab")],
+                    [mcl_path, inflation], [os.path.join(BlastDB_path, seq_type + "_" + inflation + ".clstr")],
+                    lambda cpus, seq_type=seq_type, inflation=inflation:
+                    self.cluster_homologs(BlastDB_path, seq_type, mcl_path, inflation, cpus)))
+        # 4. Write the homology relations, local synteny scores and synteny blocks
+        min_anchors = int(self.ahgrar_config["Daisychain_Server"].get("synteny_block_min_anchors", "5"))
+        max_gap = int(self.ahgrar_config["Daisychain_Server"].get("synteny_block_max_gap", "10"))
+        # Homolog relations within a cluster: clique, blast_hits, knn or hub (see ClusterToCSV)
+        topology = self.ahgrar_config["Daisychain_Server"].get("homology_topology", "clique")
+        knn = int(self.ahgrar_config["Daisychain_Server"].get("homology_knn", "10"))
+        build_stages.append(self.cached_build_stage(
+            build_cache, "gene_homology_csv", "Write CSV files for nucleotide clusters",
+            ["mcl_transcripts_" + inflation for inflation in inflations], 1,
+            [os.path.join(BlastDB_path, "transcripts_" + inflation + ".clstr") for inflation in inflations] +
+            [os.path.join(BlastDB_path, "transcripts_pid.*.npy"), os.path.join(CSV_path, "gene_5nb.csv"),
+             os.path.join(CSV_path, "gene_nodes.csv")],
+            [min_anchors, max_gap, topology, knn] + inflations,
+            [os.path.join(CSV_path, csv_file) for csv_file in
+             ["gene_hmlg.csv", "gene_clusters.csv", "gene_member_of.csv", "synteny_block_nodes.csv",
+              "gene_synteny_block.csv"]],
+            lambda cpus: self.write_gene_homology_csv(CSV_path, BlastDB_path, min_anchors, max_gap, topology, knn,
+                                                      inflations)))
+        build_stages.append(self.cached_build_stage(
+            build_cache, "protein_homology_csv", "Write CSV files for protein clusters",
+            ["mcl_translations_" + inflation for inflation in inflations], 1,
+            [os.path.join(BlastDB_path, "translations_" + inflation + ".clstr") for inflation in inflations] +
+            [os.path.join(BlastDB_path, "translations_pid.*.npy"), os.path.join(CSV_path, "gene_5nb.csv"),
+             os.path.join(CSV_path, "gene_protein_coding.csv"), os.path.join(CSV_path, "gene_nodes.csv")],
+            [topology, knn] + inflations,
+            [os.path.join(CSV_path, csv_file) for csv_file in
+             ["protein_hmlg.csv", "protein_clusters.csv", "protein_member_of.csv"]],
+            lambda cpus: self.write_protein_homology_csv(CSV_path, BlastDB_path, topology, knn, inflations)))
+        build_scheduler = BuildScheduler(build_stages, cpu_cores,
+                                         lambda status: self.task_mngr.set_task_status(proj_id, task_id, status))
+        try:
+            build_finished = build_scheduler.run()
+        except Exception as err:
+            # Stages returning False report their failure themselves, exceptions are reported here
+            self.task_mngr.add_task_results(proj_id, task_id, "Failed: %s (%s: %s)" % (
+                ", ".join([stage.status for stage in build_scheduler.failed_stages]) or "Scheduling build stages",
+                type(err).__name__, err))
+            build_finished = False
+        if not build_finished:
+            self.task_mngr.set_task_status(proj_id, task_id, "Failed")
+            return
 
         # Use neo4j-admin to create a database from the CSV files
         # The database is created within the projects neo4j folder
@@ -255,8 +232,6 @@ class DBBuilder:
         #    if name != 'asizeof':
         #        print(name, asizeof.asizeof(obj) / 1024)
 
-        del gene_gene_percentID
-        del prot_prot_percentID
         try:
             print([os.path.join("Projects", str(proj_id), "proj_graph_db", "bin", "neo4j-admin"),
                 "import","--id-type","STRING","--nodes:Gene", 
@@ -266,7 +241,13 @@ class DBBuilder:
                 "--nodes:Protein", os.path.join("Projects", str(proj_id), "CSV", "protein_nodes.csv"),
                 "--relationships:CODING", os.path.join("Projects", str(proj_id), "CSV", "gene_protein_coding.csv"),
                 "--relationships:HOMOLOG", os.path.join("Projects", str(proj_id),"CSV", "protein_hmlg.csv"),
-                "--relationships:HOMOLOG", os.path.join("Projects", str(proj_id), "CSV", "gene_hmlg.csv")])
+                "--relationships:HOMOLOG", os.path.join("Projects", str(proj_id), "CSV", "gene_hmlg.csv"),
+                "--nodes:SyntenyBlock", os.path.join("Projects", str(proj_id), "CSV", "synteny_block_nodes.csv"),
+                "--relationships:IN_BLOCK", os.path.join("Projects", str(proj_id), "CSV", "gene_synteny_block.csv"),
+                "--nodes:Cluster", os.path.join("Projects", str(proj_id), "CSV", "gene_clusters.csv"),
+                "--nodes:Cluster", os.path.join("Projects", str(proj_id), "CSV", "protein_clusters.csv"),
+                "--relationships:MEMBER_OF", os.path.join("Projects", str(proj_id), "CSV", "gene_member_of.csv"),
+                "--relationships:MEMBER_OF", os.path.join("Projects", str(proj_id), "CSV", "protein_member_of.csv")])
  
 
             proc = subprocess.run(
@@ -280,6 +261,12 @@ class DBBuilder:
                 "--relationships:CODING", os.path.join("Projects", str(proj_id), "CSV", "gene_protein_coding.csv"),
                 "--relationships:HOMOLOG", os.path.join("Projects", str(proj_id),"CSV", "protein_hmlg.csv"),
                 "--relationships:HOMOLOG", os.path.join("Projects", str(proj_id), "CSV", "gene_hmlg.csv"),
+                "--nodes:SyntenyBlock", os.path.join("Projects", str(proj_id), "CSV", "synteny_block_nodes.csv"),
+                "--relationships:IN_BLOCK", os.path.join("Projects", str(proj_id), "CSV", "gene_synteny_block.csv"),
+                "--nodes:Cluster", os.path.join("Projects", str(proj_id), "CSV", "gene_clusters.csv"),
+                "--nodes:Cluster", os.path.join("Projects", str(proj_id), "CSV", "protein_clusters.csv"),
+                "--relationships:MEMBER_OF", os.path.join("Projects", str(proj_id), "CSV", "gene_member_of.csv"),
+                "--relationships:MEMBER_OF", os.path.join("Projects", str(proj_id), "CSV", "protein_member_of.csv"),
                 "--ignore-missing-nodes=true",
                 "--ignore-duplicate-nodes=true"
                 ],
@@ -355,10 +342,192 @@ class DBBuilder:
         project_db_conn.run("CREATE INDEX ON :Gene(name)")
         project_db_conn.run("CREATE INDEX ON :Gene(descr)")
         project_db_conn.run("CREATE INDEX ON :Protein(proteinId)")
+        project_db_conn.run("CREATE INDEX ON :SyntenyBlock(blockId)")
         project_db_conn.close()
         self.task_mngr.set_task_status(proj_id, task_id, "Finished")
         print("Finished")
 
+    # MCL inflation values as configured, as strings (they are the clstr_sens of the homology relations)
+    def mcl_inflations(self):
+        return [inflation.strip() for inflation in
+                self.ahgrar_config["Daisychain_Server"].get("mcl_inflation", "1.4,5.0,10.0").split(",")
+                if inflation.strip()]
+
+    # Define one stage of the DB build, the stage is skipped if its cached results are still valid
+    # stage_func runs the stage with the number of granted CPU cores and returns False if the stage failed
+    def cached_build_stage(self, build_cache, stage_name, status, deps, cpus, inputs, params, outputs, stage_func):
+        return BuildStage(stage_name, status, deps, cpus,
+                          lambda stage_cpus: self.run_build_stage(build_cache, stage_name, inputs, params, outputs,
+                                                                  lambda: stage_func(stage_cpus)))
+
+    # Run one stage of the DB build, unless its cached results are still valid
+    # Returns False if the stage failed, else True
+    def run_build_stage(self, build_cache, stage_name, inputs, params, outputs, stage_func):
+        stage_key = build_cache.stage_key(stage_name, inputs, params)
+        if build_cache.is_valid(stage_name, stage_key):
+            print("Skipping %s, results are up to date" % stage_name)
+            return True
+        build_cache.invalidate(stage_name)
+        if stage_func() is False:
+            return False
+        build_cache.record(stage_name, stage_key, outputs)
+        return True
+
+    # Convert every annotation file into a Neo4j-specific CSV file format
+    # Species are parsed in parallel by up to cpu_cores worker processes (see ParallelAnnoToCSV)
+    def parse_annotations(self, proj_id, task_id, file_dict, cpu_cores):
+        # Initialize CSV parser:  CSV output directory, gene transcript and translation output files
+        # All genes from all files are combined into one set of output files
+        # Sequences are written through buffered writers, the write rate is shown in the task status
+        write_buffer_size = int(self.ahgrar_config["Daisychain_Server"].get("fasta_write_buffer_size", "1048576"))
+        anno_to_csv_parser = ParallelAnnoToCSV(os.path.join("Projects", proj_id, "CSV"),
+                                               os.path.join("Projects", proj_id, "BlastDB", "transcripts.faa"),
+                                               os.path.join("Projects", proj_id, "BlastDB", "translations.faa"),
+                                               cpu_cores, write_buffer_size,
+                                               lambda status: self.task_mngr.set_task_status(proj_id, task_id,
+                                                                                             status),
+                                               os.path.join("Projects", proj_id, "Files", ".fasta_index"))
+        # Files that were imported as symlinks or hardlinks must still have the content they had at import time
+        file_linker = FileLinker(os.path.join("Projects", proj_id, "Files", ".import_checksums.json"))
+        for species in file_dict.keys():
+            for file in file_dict[species]:
+                if not file_linker.verify(os.path.join("Projects", proj_id, "Files", file[0])):
+                    self.task_mngr.set_task_status(proj_id, task_id, "Failed")
+                    if file_linker.load_error:
+                        self.task_mngr.add_task_results(proj_id, task_id, "Failed: Linked file %s cannot be verified: "
+                                                                          "%s" % (file[0], file_linker.load_error))
+                    else:
+                        self.task_mngr.add_task_results(proj_id, task_id, "Failed: Linked file %s was changed or "
+                                                                          "removed since its import" % file[0])
+                    return False
+        # Then convert every annotation file into a Neo4j-specific CSV file format
+        # Gene IDs are assigned in species order
+        anno_files = []
+        try:
+            for species in file_dict.keys():
+                # Retrieve name of annotation and genome file. Sort file list alphanumerical. Since
+                # annotation < genome the annotation file is nr. 0, the genome file nr. 1
+                anno_file = sorted(file_dict[species], key=lambda x: x[1])[0]
+                genome_file = sorted(file_dict[species], key=lambda x: x[1])[1]
+                anno_files.append((os.path.join("Projects", proj_id, "Files", anno_file[0]),
+                                   os.path.join("Projects", proj_id, "Files", genome_file[0]),
+                                   anno_file[2], anno_file[3], anno_file[4], anno_file[5], anno_file[6]))
+            anno_to_csv_parser.create_csv(anno_files)
+        except (IndexError, KeyError):
+            self.task_mngr.set_task_status(proj_id, task_id, "Failed")
+            self.task_mngr.add_task_results(proj_id, task_id, "Failed: Annotation parsing")
+            return False
+        return True
+
+    # Build the nucleotide BLAST database
+    def build_transcript_db(self, BlastDB_path, makeblastdb_path):
+        # we still need to keep the nucleotide database for the BLAST query
+        subprocess.run(
+            [makeblastdb_path, "-dbtype", "nucl", "-in", os.path.join(BlastDB_path, "transcripts.faa"),
+             "-parse_seqids", "-hash_index", "-out", os.path.join(BlastDB_path, "transcript_db")], check=True)
+
+    # Build the protein database using DIAMOND
+    def build_translation_db(self, BlastDB_path, diamond_path):
+        # CHANGE - diamond can only do proteins, so make only one DB
+        subprocess.run([diamond_path, 'makedb', '--in', os.path.join(BlastDB_path, "translations.faa"), 
+              '--db', os.path.join(BlastDB_path, "translation_db")], check=True)
+
+    # Perform an all vs all search of the transcripts against the translations
+    def blastx_transcripts(self, BlastDB_path, diamond_path, cpu_cores):
+        #blastn_path = os.path.join(self.ahgrar_config["Daisychain_Server"]["blast+_path"], "blastn")
+        print("Blastx now")
+        #subprocess.run(
+        #    [blastn_path, "-query", os.path.join(BlastDB_path, "transcripts.faa"), "-db",
+        #     os.path.join(BlastDB_path, "transcript_db"), "-outfmt", "6 qseqid sseqid evalue qlen slen nident",
+        #                                 "-out", os.path.join(BlastDB_path, "transcripts.blastn"),
+        #                    "-num_threads", cpu_cores, "-evalue", "1e-5", "-parse_deflines"])
+        # diamond keeps the 'lcl|' prefix in the header, it is stripped by DiamondToABC
+        subprocess.run(
+             [diamond_path, 'blastx', '--query', os.path.join(BlastDB_path, "transcripts.faa"), '--db', 
+              os.path.join(BlastDB_path, "translation_db"), "--outfmt", "6", "qseqid", "sseqid", "evalue",
+              "qlen", "slen", "nident", "qcovhsp", "scovhsp",
+              '-o', os.path.join(BlastDB_path, "transcripts.blastn"), 
+              '--threads', str(cpu_cores), '--evalue', '1e-5'], check=True)
+
+    # Perform an all vs all search of the translations
+    def blastp_translations(self, BlastDB_path, diamond_path, cpu_cores):
+        #blastp_path = os.path.join(self.ahgrar_config["Daisychain_Server"]["blast+_path"], "blastp")
+        print("Blastp now")
+        #subprocess.run(
+        #    [blastp_path, "-query", os.path.join(BlastDB_path, "translations.faa"), "-db",
+        #     os.path.join(BlastDB_path, "translation_db"), "-outfmt", "6 qseqid sseqid evalue qlen slen nident",
+        #     "-out", os.path.join(BlastDB_path, "translations.blastp"),
+        #    "-num_threads", cpu_cores, "-evalue", "1e-5", "-parse_deflines"])
+        subprocess.run(
+             [diamond_path, 'blastp', '--query',  os.path.join(BlastDB_path, "translations.faa"), "--db",
+              os.path.join(BlastDB_path, "translation_db"), "--outfmt", "6", "qseqid", "sseqid", "evalue",
+              "qlen", "slen", "nident", "qcovhsp", "scovhsp",
+              '--out', os.path.join(BlastDB_path, "translations.blastp"),
+              '--threads', str(cpu_cores), '--evalue', '1e-5'], check=True)
+
+    # Extract sequence match identity from a DIAMOND result file in a single pass (see DiamondToABC)
+    # Create a new blastn/blastp result file lacking the percent match ID column (ABC file)
+    # Store geneID/geneID/PercentMatch or protID/protID/PercentMatch in a PercentIdentityStore (<seq_type>_pid)
+    # Hits below min_identity or min_coverage are neither clustered nor stored
+    def blast_to_abc(self, BlastDB_path, seq_type, blast_file, min_identity=0.0, min_coverage=0.0):
+        print("%s to abc" % blast_file)
+        hit_count = DiamondToABC(min_identity, min_coverage).convert(
+            os.path.join(BlastDB_path, blast_file), os.path.join(BlastDB_path, seq_type + ".abc"),
+            os.path.join(BlastDB_path, seq_type + "_pid"))
+        print("%s: %d hits" % (blast_file, hit_count))
+
+    # Convert the ABC file of transcripts or translations into a network and dictionary file,
+    # shared by the MCL runs of all inflation values
+    def load_homolog_network(self, BlastDB_path, seq_type, mcxload_path):
+        # subprocess.run(
+        #     [mcxload_path, "-abc", os.path.join(BlastDB_path, seq_type + ".abc"), "--stream-mirror",
+        #      "--stream-neg-log10",
+        #      "-stream-tf",
+        #      "ceil(200)", "-o", os.path.join(BlastDB_path, seq_type + ".mci"), "-write-tab",
+        #      os.path.join(BlastDB_path, seq_type + ".tab")], check=True)
+        subprocess.run(
+            [mcxload_path, "-abc", os.path.join(BlastDB_path, seq_type + ".abc"), "--stream-mirror",
+             "-o", os.path.join(BlastDB_path, seq_type + ".mci"), "-write-tab",
+             os.path.join(BlastDB_path, seq_type + ".tab")], check=True)
+
+    # Cluster the all-vs.-all search results of transcripts or translations into homology groups
+    # with one inflation value
+    def cluster_homologs(self, BlastDB_path, seq_type, mcl_path, inflation, cpu_cores):
+        subprocess.run([mcl_path, os.path.join(BlastDB_path, seq_type + ".mci"), "-te", str(cpu_cores),
+                        "-I", inflation,
+                        "-use-tab", os.path.join(BlastDB_path, seq_type + ".tab"), "-o",
+                        os.path.join(BlastDB_path, seq_type + "_" + inflation + ".clstr")], check=True)
+
+    # Parse MCL cluster files and create the CSV file describing the homology relationships between genes,
+    # then add local synteny scores and synteny blocks
+    # Clusters are written in the order of the inflation values, the first one is used for synteny
+    def write_gene_homology_csv(self, CSV_path, BlastDB_path, min_anchors, max_gap, topology="clique", knn=10,
+                                inflations=("1.4", "5.0", "10.0")):
+        nucl_clstr_to_csv_parser = ClusterToCSV(os.path.join(CSV_path, "gene_hmlg.csv"),
+                                                PercentIdentityStore(os.path.join(BlastDB_path, "transcripts_pid")),
+                                                "nucl", topology, knn)
+        for inflation in inflations:
+            nucl_clstr_to_csv_parser.create_csv(os.path.join(BlastDB_path, "transcripts_" + inflation + ".clstr"),
+                                                inflation)
+        # Calculate local synteny scores for all homology relations
+        # Scores are added as ls_score column to the homology CSV files and thus imported together with the relations
+        SyntenyToCSV(CSV_path, clstr_sens=inflations[0]).add_gene_ls_scores()
+        # Detect collinear synteny blocks between all contig pairs
+        # Blocks are imported as SyntenyBlock nodes, the block ID is added to the anchor homology relations
+        SyntenyBlockToCSV(CSV_path, min_anchors, max_gap, inflations[0]).create_csv()
+
+    # Parse MCL cluster files and create the CSV file describing the homology relationships between proteins,
+    # then add local synteny scores
+    def write_protein_homology_csv(self, CSV_path, BlastDB_path, topology="clique", knn=10,
+                                   inflations=("1.4", "5.0", "10.0")):
+        nucl_clstr_to_csv_parser = ClusterToCSV(os.path.join(CSV_path, "protein_hmlg.csv"),
+                                                PercentIdentityStore(os.path.join(BlastDB_path, "translations_pid")),
+                                                "prot", topology, knn)
+        for inflation in inflations:
+            nucl_clstr_to_csv_parser.create_csv(os.path.join(BlastDB_path, "translations_" + inflation + ".clstr"),
+                                                inflation)
+        SyntenyToCSV(CSV_path, clstr_sens=inflations[0]).add_protein_ls_scores()
+
     def calculate_synteny(self, proj_id):
         self.send_data("Calculating local synteny")
         print('Synteny now!')
@@ -371,236 +540,309 @@ class DBBuilder:
         with open(os.path.join("Projects", str(proj_id), "access"), "r") as file:
             neo4j_pw = file.read().rstrip()
         # Connect to the project DB
-        print(neo4j_pw)
         print(bolt_port)
         project_db_driver = GraphDatabase.driver("bolt://localhost:%s"%(bolt_port),
                                                  auth=("neo4j", neo4j_pw))
         project_db_conn = project_db_driver.session()
-        self.task_mngr.set_task_status(proj_id, task_id, "Retrieving all homology relations for large clusters")
-        relations_14 = project_db_conn.run("MATCH(geneA:Gene)-[rel:HOMOLOG]->(geneB:Gene) WHERE rel.clstr_sens = '1.4' "
-                                       "RETURN startNode(rel).geneId AS start, endNode(rel).geneId AS end")
-        self.task_mngr.set_task_status(proj_id, task_id, "Retrieving all homology relations for medium clusters")
-        relations_50 = project_db_conn.run("MATCH(geneA:Gene)-[rel:HOMOLOG]->(geneB:Gene) WHERE rel.clstr_sens = '5.0' "
-                                       "RETURN startNode(rel).geneId AS start, endNode(rel).geneId AS end")
-        self.task_mngr.set_task_status(proj_id, task_id, "Retrieving all homology relations for small clusters")
-        relations_100 = project_db_conn.run("MATCH(geneA:Gene)-[rel:HOMOLOG]->(geneB:Gene) WHERE rel.clstr_sens='10.0' "
-                                       "RETURN startNode(rel).geneId AS start, endNode(rel).geneId AS end")
-
-        print('All relations found')
+        # Load the gene order of all contigs once
+        # Neighbouring genes are then looked up in memory instead of traversing 5_NB/3_NB relations per edge
+        self.task_mngr.set_task_status(proj_id, task_id, "Building gene neighbourhood index")
+        nb_index = GeneNeighbourhoodIndex()
+        nb_index.load_project_db(project_db_conn)
+        # Gene IDs are mapped to dense integer indices, all further processing works on NumPy arrays
+        gene_encoder = GeneIdEncoder()
+        local_synteny = LocalSynteny(nb_index, gene_encoder)
+        self.calculate_node_synteny(proj_id, task_id, project_db_conn, nb_index, gene_encoder, local_synteny,
+                                    "Gene", {})
+        # Protein homology relations are scored on the neighbourhood of their coding genes,
+        # together with the protein homology relations of large clusters
+        self.task_mngr.set_task_status(proj_id, task_id, "Mapping proteins to coding genes")
+        protein_to_gene = self.get_protein_genes(project_db_conn)
+        self.calculate_node_synteny(proj_id, task_id, project_db_conn, nb_index, gene_encoder,
+                                    local_synteny.share_neighbourhood(), "Protein", protein_to_gene)
+        print('Synteny done, peak memory usage %s MB' % self.peak_rss())
+        self.task_mngr.set_task_status(proj_id, task_id, "Finished")
+        project_db_conn.close()
+
+    # Calculate the local synteny scores of all homology relations between Gene or between Protein nodes
+    # local_synteny: Scorer with the neighbour matrix of all genes, its homology graph is set here
+    # node_to_gene: Maps node IDs to the IDs of the genes whose neighbourhood is used, gene IDs are used as they are
+    def calculate_node_synteny(self, proj_id, task_id, project_db_conn, nb_index, gene_encoder, local_synteny,
+                               node_type, node_to_gene):
+        # In streaming mode, only the homology relations of large clusters are kept in memory (as compact
+        # lookup structure). All relations are then scored chunk by chunk while reading them from the project DB.
+        streaming = self.ahgrar_config["Daisychain_Server"].get("synteny_streaming", "false").lower() == "true"
+        chunk_size = int(self.ahgrar_config["Daisychain_Server"].get("synteny_chunk_size", "100000"))
+        # Node IDs are encoded separately, relations are scored on the encoded genes
+        node_encoder = gene_encoder if node_type == "Gene" else GeneIdEncoder()
+        # Files of the incremental state and checkpoint, one set per node type
+        synteny_path = os.path.join("Projects", str(proj_id), "Synteny")
+        file_suffix = "" if node_type == "Gene" else "_" + node_type.lower()
+        # The first inflation value gives the large clusters
+        inflations = self.mcl_inflations()
+        self.task_mngr.set_task_status(proj_id, task_id, "Retrieving all %s clusters" % node_type.lower())
+        # All members of a large cluster count as homologs, independent of the homology topology
+        clusters = self.get_cluster_members(project_db_conn, gene_encoder, inflations[0], node_type, node_to_gene)
+        clstr_rels = []
+        if not streaming:
+            for inflation in inflations:
+                self.task_mngr.set_task_status(proj_id, task_id, "Retrieving all %s homology relations for "
+                                                                 "inflation value %s" % (node_type.lower(), inflation))
+                clstr_rels.append((inflation, self.get_homolog_relations(project_db_conn, gene_encoder, inflation,
+                                                                         chunk_size, node_type, node_encoder,
+                                                                         node_to_gene)))
+            print('All relations found')
         self.task_mngr.set_task_status(proj_id, task_id, "Converting homology edges")
-        # Convert each relation edge into a dict. Key is start ID, value is a list of end IDs
-        # Also store every hmlg edge as a list of (start, end) tuples
-        rel_14_dict = {}
-        rel_14_list = []
-        print('Rel 14')
-        for rel in relations_14:
-            start_node = rel["start"]
-            end_node = rel["end"]
-            # Do not calculate synteny score for self/self-loops
-            if start_node == end_node: continue
-            try:
-                rel_14_dict[start_node].append(end_node)
-            except KeyError:
-                rel_14_dict[start_node]= [end_node]
-            rel_14_list.append((start_node, end_node))
-        print('Got %s relations for rel14'%(len(rel_14_list)))
-        rel_50_dict = {}
-        rel_50_list = []
-        print('Rel 50')
-        for rel in relations_50:
-            start_node = rel["start"]
-            end_node = rel["end"]
-            # Do not calculate synteny score for self/self-loops
-            if start_node == end_node: continue
-            try:
-                rel_50_dict[start_node].append(end_node)
-            except KeyError:
-                rel_50_dict[start_node] = [end_node]
-            rel_50_list.append((start_node, end_node))
-        rel_100_dict = {}
-        rel_100_list = []
-        print('Rel 100')
-        for rel in relations_100:
-            start_node = rel["start"]
-            end_node = rel["end"]
-            # Do not calculate synteny score for self/self-loops
-            if start_node == end_node: continue
-            try:
-                rel_100_dict[start_node].append(end_node)
-            except KeyError:
-                rel_100_dict[start_node] = [end_node]
-            rel_100_list.append((start_node, end_node))
-
-        out = open('/mnt/AHGraR_Server/Server/Project_access/Synteny_Logs.txt','w')
-        # Loop through every relation
+        if clusters:
+            local_synteny.set_cluster_graph(clusters)
+        else:
+            # Projects built before Cluster nodes were written: Use the homology relations of large clusters
+            homolog_relations = clstr_rels[0][1] if clstr_rels else self.get_homolog_relations(
+                project_db_conn, gene_encoder, inflations[0], chunk_size, node_type, node_encoder, node_to_gene)
+            local_synteny.set_homolog_graph(homolog_relations[0], homolog_relations[1])
+            del homolog_relations
+        del clusters
+        # Compare genes with the state of the previous run
+        # Only relations touching new genes or genes with changed neighbours or homologs are scored again
+        self.task_mngr.set_task_status(proj_id, task_id, "Comparing with previous synteny run")
+        synteny_state = SyntenyState(os.path.join(synteny_path, "ls_state" + file_suffix + ".npz"))
+        synteny_state.load()
+        synteny_state.set_genes(get_gene_keys(project_db_conn, gene_encoder), local_synteny)
+        # Relations are scored in batches
+        batch_size = 50000
+        # Optionally fan the scoring out to several processes
+        # Relations are sharded by the species pair or the contig pair of their start and end gene
+        shard_by = self.ahgrar_config["Daisychain_Server"].get("synteny_shard_by", "none")
+        if shard_by in ["species", "contig"]:
+            self.task_mngr.set_task_status(proj_id, task_id, "Starting synteny worker processes")
+            if shard_by == "species":
+                shard_keys = species_shard_keys(project_db_conn, gene_encoder)
+            else:
+                shard_keys = contig_shard_keys(nb_index, gene_encoder)
+            local_synteny = ShardedLocalSynteny(local_synteny, shard_keys,
+                                                int(self.ahgrar_config["Daisychain_Server"]["cpu_cores"]))
+            # Each batch is split into shards for all worker processes
+            batch_size *= local_synteny.processes
         # For each start and end node, retrieve the neighboring genes
-        # Then test for homology relations between the two sets of neighboring genes
-        # Start with homoogy relations where inflation value = 1.4 (large cluster)
-        nr_of_rel = len(rel_14_list)+len(rel_50_list)+len(rel_100_list)
-        self.task_mngr.set_task_status(proj_id, task_id, "Calculating local synteny 0% completed")
+        # Then test for homology relations (first inflation value) between the two sets of neighboring genes
+        # Scores are written back in batches, one transaction per batch
+        node_id = "geneId" if node_type == "Gene" else "proteinId"
+        score_writer = BatchWriter(project_db_conn,
+                                   "MATCH(nodeStart:%s)-[rel:HOMOLOG]->(nodeEnd:%s) "
+                                   "WHERE nodeStart.%s = row.startID AND nodeEnd.%s = row.endID "
+                                   "AND rel.clstr_sens = row.clstr_sens SET rel.ls_score = row.score"
+                                   % (node_type, node_type, node_id, node_id),
+                                   int(self.ahgrar_config["Daisychain_Server"].get("db_write_batch_size", "10000")))
+        # The worker processes and shared memory of a sharded scorer are released even if scoring fails
+        try:
+            if streaming:
+                self.stream_ls_scores(proj_id, task_id, project_db_conn, gene_encoder, local_synteny, synteny_state,
+                                      score_writer, min(chunk_size, batch_size), node_type, node_encoder, node_to_gene)
+            else:
+                checkpoint = SyntenyCheckpoint(os.path.join(synteny_path, "ls_checkpoint" + file_suffix + ".npz"))
+                self.score_ls_scores(proj_id, task_id, clstr_rels,
+                                     node_type, node_encoder, local_synteny, synteny_state, checkpoint, score_writer,
+                                     batch_size)
+            score_writer.close()
+        finally:
+            if shard_by in ["species", "contig"]:
+                local_synteny.close()
+        synteny_state.save()
+
+    # Score all relations, which are completely loaded into memory
+    # The calculation is checkpointed and resumes from the last checkpoint if it was interrupted
+    # relations: List of (clstr_sens, (start_idx, end_idx, db_scores, start_node, end_node)) per inflation value
+    def score_ls_scores(self, proj_id, task_id, relations, node_type, node_encoder, local_synteny, synteny_state,
+                        checkpoint, score_writer, batch_size):
+        rel_levels = []
+        for clstr_sens, (start_idx, end_idx, db_scores, start_node, end_node) in relations:
+            # Relations are processed in the order of the stable keys of their genes,
+            # so that a checkpoint refers to the same relations when the calculation is resumed
+            order = np.argsort(synteny_state.relation_pairs(start_idx, end_idx), kind="stable")
+            start_idx, end_idx, db_scores = start_idx[order], end_idx[order], db_scores[order]
+            start_node, end_node = start_node[order], end_node[order]
+            dirty, prev_scores = synteny_state.dirty_relations(clstr_sens, start_idx, end_idx)
+            rel_levels.append((clstr_sens, start_idx, end_idx, db_scores, start_node, end_node, dirty, prev_scores))
+        # Resume from the checkpoint of an interrupted calculation
+        checkpoint.set_run(synteny_state, [(rel_level[0], rel_level[1], rel_level[2], rel_level[6])
+                                           for rel_level in rel_levels])
+        checkpoint_scores = checkpoint.load()
+        checkpoint_interval = int(self.ahgrar_config["Daisychain_Server"].get("synteny_checkpoint_interval", "300"))
+        nr_of_rel = sum([int(rel_level[6].sum()) for rel_level in rel_levels])
+        print('Scoring %s of %s %s relations' % (nr_of_rel, sum([len(rel_level[1]) for rel_level in rel_levels]),
+                                                 node_type.lower()))
+        finished_rel_counter = sum([len(scores) for scores in checkpoint_scores.values()])
+        if finished_rel_counter:
+            print('Resuming local synteny from checkpoint, %s relations already scored' % finished_rel_counter)
+        # Relations scored in this run, used to estimate the remaining time
+        resumed_rel_counter = finished_rel_counter
+        start_time = time.time()
+        last_checkpoint = start_time
+        self.task_mngr.set_task_status(proj_id, task_id, "Calculating local synteny " +
+                                       str(round(100 * finished_rel_counter / max(1, nr_of_rel), 2)) + "% completed")
+        print('Calculating local synteny %s' % str(round(100 * finished_rel_counter / max(1, nr_of_rel), 2)))
+        for clstr_sens, start_idx, end_idx, db_scores, start_node, end_node, dirty, prev_scores in rel_levels:
+            print('Now at %s' % clstr_sens)
+            # Unchanged relations keep the score of the previous run,
+            # relations scored before the checkpoint the score stored in the checkpoint
+            scores = prev_scores.copy()
+            dirty_rel = np.flatnonzero(dirty)
+            resume_offset = len(checkpoint_scores.get(clstr_sens, []))
+            scores[dirty_rel[:resume_offset]] = checkpoint_scores.get(clstr_sens, [])
+            # Only scores that differ from the DB are written back
+            pending = np.ones(len(scores), dtype=bool)
+            pending[dirty_rel[resume_offset:]] = False
+            self.write_ls_scores(score_writer, node_encoder, clstr_sens, start_node, end_node,
+                                 np.flatnonzero(pending & (scores != db_scores)), scores)
+            for batch_start in range(resume_offset, len(dirty_rel), batch_size):
+                status = node_type + " relations: " + self.synteny_progress(finished_rel_counter,
+                                                                            resumed_rel_counter, nr_of_rel,
+                                                                            start_time, score_writer)
+                self.task_mngr.set_task_status(proj_id, task_id, status)
+                print('Calculating local synteny, ' + status)
+                batch_rel = dirty_rel[batch_start:batch_start + batch_size]
+                scores[batch_rel] = local_synteny.score_edges(start_idx[batch_rel], end_idx[batch_rel])
+                self.write_ls_scores(score_writer, node_encoder, clstr_sens, start_node, end_node,
+                                     batch_rel[scores[batch_rel] != db_scores[batch_rel]], scores)
+                finished_rel_counter += len(batch_rel)
+                checkpoint_scores[clstr_sens] = scores[dirty_rel[:batch_start + len(batch_rel)]]
+                # Checkpoint after all scores so far are written to the DB
+                if time.time() - last_checkpoint >= checkpoint_interval:
+                    score_writer.flush()
+                    checkpoint.save(checkpoint_scores)
+                    last_checkpoint = time.time()
+            checkpoint_scores[clstr_sens] = scores[dirty_rel]
+            synteny_state.set_scores(clstr_sens, start_idx, end_idx, scores)
+        # All scores are written, the checkpoint is not needed anymore
+        score_writer.flush()
+        checkpoint.remove()
+
+    # Score all relations while streaming them from the project DB, chunk by chunk
+    # Memory usage is bounded by the chunk size. Since relations are not kept, the score stored in the DB is used
+    # as previous score of a relation: Relations with a score whose genes and neighbourhoods did not change
+    # keep it. Scores are not checkpointed, an interrupted calculation scores the changed relations again
+    # but only writes scores that differ from the DB.
+    def stream_ls_scores(self, proj_id, task_id, project_db_conn, gene_encoder, local_synteny, synteny_state,
+                         score_writer, chunk_size, node_type, node_encoder, node_to_gene):
+        nr_of_rel = 0
+        for clstr_sens in self.mcl_inflations():
+            nr_of_rel += project_db_conn.run("MATCH(nodeA:%s)-[rel:HOMOLOG]->(nodeB:%s) "
+                                             "WHERE rel.clstr_sens = {clstr_sens} AND nodeA <> nodeB "
+                                             "RETURN count(rel)" % (node_type, node_type),
+                                             {"clstr_sens": clstr_sens}).single()[0]
         finished_rel_counter = 0
-        print('Calculating local synteny 0%')
-        for rel in rel_14_list:
-            if finished_rel_counter % 5000 == 0:
-                self.task_mngr.set_task_status(proj_id, task_id, str(round(100 * finished_rel_counter / nr_of_rel, 2)) +
-                                               "% completed")
-                print('Calculating local synteny %s'%(str(round(100 * finished_rel_counter / nr_of_rel, 2))))
-            start_node = rel[0]
-            end_node = rel[1]
-            # First get all gene neighbors for start node
-            gene5nb = project_db_conn.run("MATCH(gene:Gene)-[:`5_NB`*1..5]->(gene5NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene5NB.geneId) as IDs",
-                                          {"geneID":start_node}).single()["IDs"]
-            out.write('MATCH(gene:Gene)-[:`5_NB`*1..5]->(gene5NB:Gene) WHERE gene.geneId = %s RETURN COLLECT(gene5NB.geneId) as IDs\n'%start_node)
-            gene3nb = project_db_conn.run("MATCH(gene:Gene)-[:`3_NB`*1..5]->(gene3NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene3NB.geneId) as IDs",
-                                          {"geneID":start_node}).single()["IDs"]
-            out.write('MATCH(gene:Gene)-[:`3_NB`*1..5]->(gene3NB:Gene) WHERE gene.geneId = %s RETURN COLLECT(gene3NB.geneId) as IDs\n'%start_node)
-            start_node_nb = gene5nb+gene3nb
-            # Then get all gene neighbors for end node
-            gene5nb = project_db_conn.run("MATCH(gene:Gene)-[:`5_NB`*1..5]->(gene5NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene5NB.geneId) as IDs", {"geneID": end_node}).single()[
-                "IDs"]
-            gene3nb = project_db_conn.run("MATCH(gene:Gene)-[:`3_NB`*1..5]->(gene3NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene3NB.geneId) as IDs", {"geneID": end_node}).single()[
-                "IDs"]
-            end_node_nb = gene5nb + gene3nb
-            # Create all possible combinations between the two sets of gene neighbor nodes
-            potential_hmlg_relations = list(product(start_node_nb, end_node_nb))
-            # Check for hmlg relations
-            # Keep count of found hmlg relations
-            score = 0
-            # Also keep track of the starting and end nodes of found hmlg relations
-            # Each node of the start_node_nb or end_node_nb set can only be involved in one hmlg relation
-            # This is done to prevent misleading high score counts in case a gene has multiple homology relations
-            # with neighboring genes
-            hmlg_rel_start_nodes = []
-            for pot_hmlg_rel in potential_hmlg_relations:
-                if pot_hmlg_rel[0] in hmlg_rel_start_nodes or pot_hmlg_rel[1] in hmlg_rel_start_nodes:
-                    continue
-                try:
-                    if pot_hmlg_rel[1] in rel_14_dict[pot_hmlg_rel[0]]:
-                        score += 1
-                        hmlg_rel_start_nodes.append(pot_hmlg_rel[0])
-                        hmlg_rel_start_nodes.append(pot_hmlg_rel[1])
-                except KeyError:
-                    continue
-            #print('Score between %s and %s is %s'%(start_node, end_node, score))
-            project_db_conn.run("MATCH(geneStart:Gene)-[rel:HOMOLOG]->(geneEnd:Gene) "
-                                "WHERE geneStart.geneId = {startID} AND geneEnd.geneId = {endID} "
-                                "AND rel.clstr_sens = '1.4' SET rel.ls_score = {score}",
-                                {"startID":start_node,"endID":end_node, "score": str(score)})
-            finished_rel_counter+=1
-
-        print('Now at 50')
-        for rel in rel_50_list:
-            if finished_rel_counter % 5000 == 0:
-                self.task_mngr.set_task_status(proj_id, task_id, str(round(100 * finished_rel_counter / nr_of_rel, 2)) +
-                                               "% completed")
-            start_node = rel[0]
-            end_node = rel[1]
-            # First get all gene neighbors for start node
-            gene5nb = project_db_conn.run("MATCH(gene:Gene)-[:`5_NB`*1..5]->(gene5NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene5NB.geneId) as IDs",
-                                          {"geneID": start_node}).single()["IDs"]
-            gene3nb = project_db_conn.run("MATCH(gene:Gene)-[:`3_NB`*1..5]->(gene3NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene3NB.geneId) as IDs",
-                                          {"geneID": start_node}).single()["IDs"]
-            start_node_nb = gene5nb + gene3nb
-            # Then get all gene neighbors for end node
-            gene5nb = project_db_conn.run("MATCH(gene:Gene)-[:`5_NB`*1..5]->(gene5NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene5NB.geneId) as IDs", {"geneID": end_node}).single()[
-                "IDs"]
-            gene3nb = project_db_conn.run("MATCH(gene:Gene)-[:`3_NB`*1..5]->(gene3NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene3NB.geneId) as IDs", {"geneID": end_node}).single()[
-                "IDs"]
-            end_node_nb = gene5nb + gene3nb
-            # Create all possible combinations between the two sets of gene neighbor nodes
-            potential_hmlg_relations = list(product(start_node_nb, end_node_nb))
-            # Check for hmlg relations
-            # Keep count of found hmlg relations
-            score = 0
-            # Also keep track of the starting and end nodes of found hmlg relations
-            # Each node of the start_node_nb or end_node_nb set can only be involved in one hmlg relation
-            # This is done to prevent misleading high score counts in case a gene has multiple homology relations
-            # with neighboring genes
-            hmlg_rel_start_nodes = []
-            for pot_hmlg_rel in potential_hmlg_relations:
-                if pot_hmlg_rel[0] in hmlg_rel_start_nodes or pot_hmlg_rel[1] in hmlg_rel_start_nodes:
-                    continue
-                try:
-                    if pot_hmlg_rel[1] in rel_14_dict[pot_hmlg_rel[0]]:
-                        score += 1
-                        hmlg_rel_start_nodes.append(pot_hmlg_rel[0])
-                        hmlg_rel_start_nodes.append(pot_hmlg_rel[1])
-                except KeyError:
-                    continue
-            #print('Score between %s and %s is %s'%(start_node, end_node, score))
-            project_db_conn.run("MATCH(geneStart:Gene)-[rel:HOMOLOG]->(geneEnd:Gene) "
-                                "WHERE geneStart.geneId = {startID} AND geneEnd.geneId = {endID} "
-                                "AND rel.clstr_sens = '5.0' SET rel.ls_score = {score}",
-                                {"startID": start_node, "endID": end_node, "score": str(score)})
-            finished_rel_counter += 1
-
-        print('Now at 100')
-        for rel in rel_100_list:
-            if finished_rel_counter % 5000 == 0:
-                self.task_mngr.set_task_status(proj_id, task_id, str(round(100*finished_rel_counter/nr_of_rel, 2))+
-                                               "% completed")
-            start_node = rel[0]
-            end_node = rel[1]
-            # First get all gene neighbors for start node
-            gene5nb = project_db_conn.run("MATCH(gene:Gene)-[:`5_NB`*1..5]->(gene5NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene5NB.geneId) as IDs",
-                                          {"geneID": start_node}).single()["IDs"]
-            gene3nb = project_db_conn.run("MATCH(gene:Gene)-[:`3_NB`*1..5]->(gene3NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene3NB.geneId) as IDs",
-                                          {"geneID": start_node}).single()["IDs"]
-            start_node_nb = gene5nb + gene3nb
-            # Then get all gene neighbors for end node
-            gene5nb = project_db_conn.run("MATCH(gene:Gene)-[:`5_NB`*1..5]->(gene5NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene5NB.geneId) as IDs", {"geneID": end_node}).single()[
-                "IDs"]
-            gene3nb = project_db_conn.run("MATCH(gene:Gene)-[:`3_NB`*1..5]->(gene3NB:Gene) WHERE gene.geneId = {geneID}"
-                                          " RETURN COLLECT(gene3NB.geneId) as IDs", {"geneID": end_node}).single()[
-                "IDs"]
-            end_node_nb = gene5nb + gene3nb
-            # Create all possible combinations between the two sets of gene neighbor nodes
-            potential_hmlg_relations = list(product(start_node_nb, end_node_nb))
-            # Check for hmlg relations
-            # Keep count of found hmlg relations
-            score = 0
-            # Also keep track of the starting and end nodes of found hmlg relations
-            # Each node of the start_node_nb or end_node_nb set can only be involved in one hmlg relation
-            # This is done to prevent misleading high score counts in case a gene has multiple homology relations
-            # with neighboring genes
-            hmlg_rel_start_nodes = []
-            for pot_hmlg_rel in potential_hmlg_relations:
-                if pot_hmlg_rel[0] in hmlg_rel_start_nodes or pot_hmlg_rel[1] in hmlg_rel_start_nodes:
-                    continue
-                try:
-                    if pot_hmlg_rel[1] in rel_14_dict[pot_hmlg_rel[0]]:
-                        score += 1
-                        hmlg_rel_start_nodes.append(pot_hmlg_rel[0])
-                        hmlg_rel_start_nodes.append(pot_hmlg_rel[1])
-                except KeyError:
-                    continue
-            #print('Score between %s and %s is %s'%(start_node, end_node, score))
-            project_db_conn.run("MATCH(geneStart:Gene)-[rel:HOMOLOG]->(geneEnd:Gene) "
-                                "WHERE geneStart.geneId = {startID} AND geneEnd.geneId = {endID} "
-                                "AND rel.clstr_sens = '10.0' SET rel.ls_score = {score}",
-                                {"startID": start_node, "endID": end_node, "score": str(score)})
-            finished_rel_counter += 1
-        print('Synteny done')
-        self.task_mngr.set_task_status(proj_id, task_id, "Finished")
-        project_db_conn.close()
+        scored_rel_counter = 0
+        start_time = time.time()
+        for clstr_sens in self.mcl_inflations():
+            print('Now at %s' % clstr_sens)
+            for start_idx, end_idx, db_scores, start_node, end_node in \
+                    self.iter_homolog_relations(project_db_conn, gene_encoder, clstr_sens, chunk_size,
+                                                node_type, node_encoder, node_to_gene):
+                status = node_type + " relations: " + self.synteny_progress(finished_rel_counter, 0, nr_of_rel,
+                                                                            start_time, score_writer)
+                self.task_mngr.set_task_status(proj_id, task_id, status)
+                print('Calculating local synteny, ' + status)
+                scores = db_scores.copy()
+                chunk_rel = np.flatnonzero(synteny_state.dirty_genes(start_idx, end_idx) | (db_scores < 0))
+                scores[chunk_rel] = local_synteny.score_edges(start_idx[chunk_rel], end_idx[chunk_rel])
+                self.write_ls_scores(score_writer, node_encoder, clstr_sens, start_node, end_node,
+                                     chunk_rel[scores[chunk_rel] != db_scores[chunk_rel]], scores)
+                finished_rel_counter += len(scores)
+                scored_rel_counter += len(chunk_rel)
+        print('Scored %s of %s %s relations' % (scored_rel_counter, finished_rel_counter, node_type.lower()))
+
+    # Progress of a local synteny calculation, incl. remaining time and peak memory usage
+    # The remaining time is estimated from the rate of relations processed since start_time
+    def synteny_progress(self, finished_rel_counter, resumed_rel_counter, nr_of_rel, start_time, score_writer):
+        eta = "unknown"
+        if finished_rel_counter > resumed_rel_counter:
+            eta = str(datetime.timedelta(seconds=int((time.time() - start_time) *
+                                                     max(0, nr_of_rel - finished_rel_counter) /
+                                                     (finished_rel_counter - resumed_rel_counter))))
+        return (str(round(100 * finished_rel_counter / max(1, nr_of_rel), 2)) + "% completed, writing " +
+                str(round(score_writer.throughput())) + " relations/s, ETA " + eta +
+                ", peak memory " + str(self.peak_rss()) + " MB")
 
+    # Peak resident set size of the server process in MB
+    def peak_rss(self):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+    # Add the local synteny scores of some relations of one inflation value to a BatchWriter
+    # rels: Positions of the relations in start_node, end_node and scores
+    def write_ls_scores(self, score_writer, node_encoder, clstr_sens, start_node, end_node, rels, scores):
+        for rel in rels:
+            score_writer.add({"startID": node_encoder.decode(start_node[rel]),
+                              "endID": node_encoder.decode(end_node[rel]),
+                              "clstr_sens": clstr_sens, "score": int(scores[rel])})
+
+    # Map every protein to its coding gene
+    def get_protein_genes(self, project_db_conn):
+        coding = project_db_conn.run("MATCH(gene:Gene)-[:CODING]->(prot:Protein) "
+                                     "RETURN gene.geneId AS gene, prot.proteinId AS protein")
+        return {record["protein"]: record["gene"] for record in coding}
+
+    # Read the members of all clusters of one inflation value, mapped to genes by node_to_gene
+    # Returns a list of int32 arrays of encoded genes, one per cluster, empty if the project has no Cluster nodes
+    def get_cluster_members(self, project_db_conn, gene_encoder, clstr_sens, node_type="Gene", node_to_gene=None):
+        node_id = "geneId" if node_type == "Gene" else "proteinId"
+        node_to_gene = {} if node_to_gene is None else node_to_gene
+        clusters = {}
+        for record in project_db_conn.run("MATCH(node:%s)-[:MEMBER_OF]->(clstr:Cluster) "
+                                          "WHERE clstr.clstr_sens = {clstr_sens} "
+                                          "RETURN clstr.clusterId AS cluster, node.%s AS member"
+                                          % (node_type, node_id), {"clstr_sens": clstr_sens}):
+            clusters.setdefault(record["cluster"], []).append(node_to_gene.get(record["member"], record["member"]))
+        print('Got %s %s clusters for %s' % (len(clusters), node_type.lower(), clstr_sens))
+        return [gene_encoder.encode_many(members) for members in clusters.values()]
+
+    # Retrieve all homology relations of one inflation value between Gene or between Protein nodes
+    # Returns five int32 arrays: The encoded genes used to score start and end node, the
+    # local synteny score currently stored in the DB (-1 if the relation has no score)
+    # and the encoded start and end node IDs (same as the genes for Gene nodes)
+    def get_homolog_relations(self, project_db_conn, gene_encoder, clstr_sens, chunk_size=100000,
+                              node_type="Gene", node_encoder=None, node_to_gene=None):
+        chunks = list(self.iter_homolog_relations(project_db_conn, gene_encoder, clstr_sens, chunk_size,
+                                                  node_type, node_encoder, node_to_gene))
+        if not chunks:
+            chunks = [tuple(np.zeros(0, dtype=np.int32) for _ in range(5))]
+        relations = tuple(np.concatenate([chunk[column] for chunk in chunks]) for column in range(5))
+        print('Got %s %s relations for %s' % (len(relations[0]), node_type.lower(), clstr_sens))
+        return relations
+
+    # Read the homology relations of one inflation value in chunks of chunk_size relations
+    # Yields the same five int32 arrays as get_homolog_relations for each chunk
+    # Self-loops are excluded, no synteny score is calculated for them
+    def iter_homolog_relations(self, project_db_conn, gene_encoder, clstr_sens, chunk_size,
+                               node_type="Gene", node_encoder=None, node_to_gene=None):
+        node_id = "geneId" if node_type == "Gene" else "proteinId"
+        node_encoder = gene_encoder if node_encoder is None else node_encoder
+        node_to_gene = {} if node_to_gene is None else node_to_gene
+        relations = iter(project_db_conn.run("MATCH(nodeA:%s)-[rel:HOMOLOG]->(nodeB:%s) "
+                                             "WHERE rel.clstr_sens = {clstr_sens} AND nodeA <> nodeB "
+                                             "RETURN nodeA.%s AS start, nodeB.%s AS end, rel.ls_score AS score"
+                                             % (node_type, node_type, node_id, node_id),
+                                             {"clstr_sens": clstr_sens}))
+        while True:
+            chunk = list(islice(relations, chunk_size))
+            if not chunk:
+                break
+            start_idx = gene_encoder.encode_many(node_to_gene.get(rel["start"], rel["start"]) for rel in chunk)
+            end_idx = gene_encoder.encode_many(node_to_gene.get(rel["end"], rel["end"]) for rel in chunk)
+            db_scores = np.fromiter((-1 if rel["score"] is None else rel["score"] for rel in chunk),
+                                    dtype=np.int32, count=len(chunk))
+            if node_encoder is gene_encoder and not node_to_gene:
+                yield start_idx, end_idx, db_scores, start_idx, end_idx
+            else:
+                yield (start_idx, end_idx, db_scores, node_encoder.encode_many(rel["start"] for rel in chunk),
+                       node_encoder.encode_many(rel["end"] for rel in chunk))
 
     # For one GFF3 file (or all GFF3 files) in a project, set the annotation mapper and the feature hierarchy
     # Function initializes an instance of the GFF3-parser to check the validity of the annotation mapper string
     # and the feature hierarchy string and then uses the GFF3-parser to parse the beginning of one GFF3 file.
     # Result returned by this function is the first gene and protein node retrieved by the parsing test.
-    def set_gff3_parser(self, proj_id, parent_feat, sub_features, name_attr, desc_attr, file_name):
+    # gff3_backend: "gffutils" (default) or "native", a streaming parser without SQLite database for large files
+    def set_gff3_parser(self, proj_id, parent_feat, sub_features, name_attr, desc_attr, file_name,
+                        gff3_backend="gffutils"):
         # Restore function parameters by replacing "\t" back to "_"
         proj_id = proj_id.replace("\t", "_")
         parent_feat = parent_feat.replace("\t", "_")
@@ -608,6 +850,8 @@ class DBBuilder:
         name_attr = name_attr.replace("\t", "_")
         desc_attr = desc_attr.replace("\t", "_")
         file_name = file_name.replace("\t", "_")
+        if gff3_backend not in ["gffutils", "native"]:
+            gff3_backend = "gffutils"
         # Create a new task and return task-id to user
         task_id = self.task_mngr.define_task(proj_id, "Configure GFF3 parser")
         # # Send task-id to user
@@ -647,48 +891,32 @@ class DBBuilder:
                     "MATCH (fileMngr)-[:file]->(file:File) WHERE file.filename = {file_name} "
                     "AND file.filetype = 'annotation' AND file.hidden = 'False' "
                     "SET file.parent_feat = {parent_feat} SET file.sub_features = {sub_features} "
-                              "SET file.name_attr = {name_attr} SET file.desc_attr = {desc_attr} ",
+                              "SET file.name_attr = {name_attr} SET file.desc_attr = {desc_attr} "
+                              "SET file.gff3_backend = {gff3_backend} ",
                     {"proj_id": int(proj_id), "file_name": file_name,
                      "parent_feat": parent_feat, "sub_features": sub_features,
-                     "name_attr":name_attr, "desc_attr":desc_attr})
+                     "name_attr":name_attr, "desc_attr":desc_attr, "gff3_backend": gff3_backend})
         self.task_mngr.set_task_status(proj_id, task_id, "Added annotation to main-db")
         # Test the parsing of the GFF3 file
-        # Make a copy of the gff3-fie, copying only the first 100 lines
+        # Parse only the first 100 lines of the gff3-file, reading only the contig regions they cover
         # Try to retrieve one gene node
         # Return this node
-        with open(file_path, "r") as original_gff3_file:
-            head = list(islice(original_gff3_file, 100))
-        with open(os.path.join("Projects", str(proj_id), "Files", "tmp.gff3"), "w") as head_gff3_file:
-            for line in head:
-                head_gff3_file.write(line)
         # Retrieve the name of the corresponding genome sequence
         genome_file = file_path[:file_path.rfind(".")]+".faa"
-        gff3_parser_v2 = GFF3Parser_v2(os.path.join("Projects", str(proj_id), "BlastDB", "tmp_transcript.faa"),
-                                       os.path.join("Projects", str(proj_id), "BlastDB", "tmp_translation.faa"))
-        gene_list = gff3_parser_v2.parse_gff3_file(os.path.join("Projects", str(proj_id), "Files", "tmp.gff3"), genome_file, True,
-                                       parent_feat, sub_features, name_attr, desc_attr)
+        # The preview writes no transcript or translation files
+        gff3_parser_v2 = GFF3Parser_v2(None, None, fasta_index_path=os.path.join("Projects", str(proj_id), "Files",
+                                                                                 ".fasta_index"))
+        gene_list = gff3_parser_v2.preview_gff3_file(file_path, genome_file, parent_feat, sub_features, name_attr,
+                                                     desc_attr, max_lines=100, max_genes=3,
+                                                     gff3_backend=gff3_backend)
 
         # Return (at max) the first three genes in the gene list
         return_gene_list = []
         for gene in gene_list:
-            # Stop when there are already three genes in the return list
-            if len(return_gene_list) >= 3:
-                break
             # Convert every item of a gene into string format
             gene = [str(item) for item in gene]
-            # Get transcript
-            #gene_transcript = gff3_parser_v2.get_nt_sequence(gene[0])
-            # Get translation
-            #gene_translation = gff3_parser_v2.get_prot_sequence(gene[0])
-            # Add both to gene list
-            #gene.append(gene_transcript)
-            #gene.append(gene_translation)
             # Add gene to return list, removing the node ID and species name
             return_gene_list.append(gene[2:])
-        # Delete temporary GFF3 file
-        os.remove(os.path.join("Projects", str(proj_id), "Files", "tmp.gff3"))
-        # Delete temporary transcript and translation files
-        gff3_parser_v2.delete_transcripts_translations()
         self.task_mngr.set_task_status(proj_id, task_id, "Finished")
         self.send_data("\n".join(["\t".join(item) for item in return_gene_list]))
         if len(gene_list) >= 1:
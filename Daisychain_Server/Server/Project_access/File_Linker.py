@@ -0,0 +1,121 @@
+# Zero-copy import of files into a project folder
+# Instead of copying a file, link_or_copy tries these strategies in this order:
+# reflink: Copy-on-write clone of the file (Linux, on file systems like Btrfs or XFS)
+# hardlink: Second directory entry of the same file (source and project folder on the same file system)
+# symlink: Link to the absolute source path
+# copy: Plain copy, if none of the above works
+# Reflinks and copies are independent of the source. Hardlinks and symlinks are not: The size, modification time
+# and content hash of the linked file are recorded, so that verify can detect if it was changed (through the source
+# or the project folder) or removed after the import. Hardlinks share the content with the source, an existing
+# target is therefore always removed first instead of being overwritten.
+# Checksums of linked files are stored in a JSON file: File name --> [Checked path, Size, Mtime, Content hash]
+# The checked path is the absolute source path of a symlink and the absolute target path of a hardlink.
+# An unreadable checksum file is reported in load_error, links without checksum record are then never valid.
+import os
+import json
+import shutil
+import hashlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request to clone a file (Linux FICLONE)
+FICLONE = 0x40049409
+
+
+class FileLinker:
+    def __init__(self, checksum_path):
+        self.checksum_path = checksum_path
+        self.checksums = {}
+        # Error message if the checksum file could not be read, else None
+        self.load_error = None
+        if os.path.isfile(self.checksum_path):
+            try:
+                with open(self.checksum_path, "r") as checksum_file:
+                    self.checksums = json.load(checksum_file)
+            except ValueError:
+                self.load_error = "Invalid checksum file %s" % self.checksum_path
+
+    # Import source_path as target_path
+    # mode: "link" tries reflink, hardlink and symlink before copying, "copy" always copies
+    # Returns the strategy used: "reflink", "hardlink", "symlink" or "copy"
+    # Raises FileNotFoundError if the source does not exist and shutil.SameFileError if it is the target itself
+    def link_or_copy(self, source_path, target_path, mode="link"):
+        if not os.path.isfile(source_path):
+            raise FileNotFoundError(source_path)
+        # Never remove the source itself
+        if os.path.realpath(source_path) == os.path.join(os.path.realpath(os.path.dirname(target_path)),
+                                                         os.path.basename(target_path)):
+            raise shutil.SameFileError("%s is the import target itself" % source_path)
+        self.remove(target_path)
+        if mode == "link":
+            for strategy, link_function in [("reflink", self.reflink), ("hardlink", self.hardlink),
+                                             ("symlink", self.symlink)]:
+                try:
+                    link_function(source_path, target_path)
+                    return strategy
+                except OSError:
+                    self.remove(target_path)
+        shutil.copy2(source_path, target_path)
+        return "copy"
+
+    # Clone source_path to target_path, raises OSError if the file system does not support it
+    def reflink(self, source_path, target_path):
+        if fcntl is None:
+            raise OSError("Reflinks are not supported on this platform")
+        with open(source_path, "rb") as source_file:
+            with open(target_path, "wb") as target_file:
+                fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+        shutil.copystat(source_path, target_path)
+
+    def hardlink(self, source_path, target_path):
+        os.link(source_path, target_path)
+        self.record(target_path, os.path.abspath(target_path))
+
+    def symlink(self, source_path, target_path):
+        source_path = os.path.abspath(source_path)
+        os.symlink(source_path, target_path)
+        self.record(target_path, source_path)
+
+    # Record size, modification time and content hash of checked_path for the file target_path
+    def record(self, target_path, checked_path):
+        checked_stat = os.stat(checked_path)
+        self.checksums[os.path.basename(target_path)] = [checked_path, checked_stat.st_size,
+                                                         checked_stat.st_mtime_ns, self.file_hash(checked_path)]
+        self.save()
+
+    # Remove a file of the project folder and its checksum record
+    def remove(self, target_path):
+        if os.path.lexists(target_path):
+            os.remove(target_path)
+        if self.checksums.pop(os.path.basename(target_path), None) is not None:
+            self.save()
+
+    # Test whether a linked file still has the content it had when it was imported
+    # Files without checksum record (reflinks and copies) are always valid, symlinks and hardlinks
+    # without record (e.g. lost with an invalid checksum file) never
+    def verify(self, target_path):
+        checksum = self.checksums.get(os.path.basename(target_path))
+        if checksum is None:
+            return not os.path.islink(target_path) and not (os.path.isfile(target_path) and
+                                                            os.stat(target_path).st_nlink > 1)
+        checked_path, size, mtime, content_hash = checksum
+        if not os.path.isfile(checked_path):
+            return False
+        checked_stat = os.stat(checked_path)
+        if checked_stat.st_size != size:
+            return False
+        # Content is only hashed again if the modification time changed
+        return checked_stat.st_mtime_ns == mtime or self.file_hash(checked_path) == content_hash
+
+    def file_hash(self, file_path):
+        file_hash = hashlib.blake2b(digest_size=16)
+        with open(file_path, "rb") as hashed_file:
+            for block in iter(lambda: hashed_file.read(1 << 20), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def save(self):
+        with open(self.checksum_path, "w") as checksum_file:
+            json.dump(self.checksums, checksum_file)
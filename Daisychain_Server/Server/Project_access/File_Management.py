@@ -4,14 +4,30 @@
 import os
 import urllib.request
 import shutil
-import gffutils
+import threading
+from Parser.FASTA_index_cache import FastaIndexCache
+from Parser.GFF3_schema_scanner import GFF3SchemaScanner
+from Server.Project_access.File_Linker import FileLinker
+
+# Annotation files scanned by a thread of this server process: (project ID, file name)
+running_scans = set()
+running_scans_lock = threading.Lock()
 
 class FileManagement:
 
-    def __init__(self, main_db_driver, task_manager, send_data):
+    def __init__(self, main_db_driver, task_manager, send_data, ahgrar_config=None):
         self.main_db_driver = main_db_driver
         self.task_mngr = task_manager
         self.send_data = send_data
+        self.ahgrar_config = ahgrar_config
+
+    # Remove the cached sequence indices of a file, e.g. because the file is replaced or removed
+    def invalidate_fasta_index(self, proj_id, file_name):
+        FastaIndexCache(os.path.join("Projects", proj_id, "Files", ".fasta_index")).invalidate(file_name)
+
+    # Linker of imported files, keeps the checksums of linked files in the project Files folder
+    def get_file_linker(self, proj_id):
+        return FileLinker(os.path.join("Projects", proj_id, "Files", ".import_checksums.json"))
 
     # Close connection to main-DB
     def close_connection(self):
@@ -55,6 +71,9 @@ class FileManagement:
         self.task_mngr.set_task_status(proj_id, task_id, "downloading")
         file_ending = ".gff3" if filetype == "gff3" else ".faa"
         file_name = "_".join([species, variant]) + file_ending
+        self.invalidate_fasta_index(proj_id, file_name)
+        # Remove the previous file first, it may be linked to a file outside of the project
+        self.get_file_linker(proj_id).remove(os.path.join(download_folder, file_name))
         try:
             with urllib.request.urlopen(url) as request_response, \
                     open (os.path.join(download_folder, file_name), 'wb') as new_file:
@@ -67,55 +86,97 @@ class FileManagement:
         self.task_mngr.set_task_status(proj_id, task_id, "finished")
 
     # Return a list of all features and their attributes contained in a GFF3 file
+    # Format: feature1§attr1§attr2$feature2§attr1
+    # The file is scanned line by line (see GFF3SchemaScanner). At most annotation_scan_max_features
+    # feature lines are scanned, 0 (default) scans the whole file
     def get_annotation_features_attributes(self, gff3_file_path):
-        gffutils.create_db(gff3_file_path, "gff3utils.db", merge_strategy="create_unique", force=True)
-        gff3_db = gffutils.FeatureDB('gff3utils.db', keep_order=False)
-        features_attributes = []
-        # Iterate over all features
-        for feature in gff3_db.featuretypes():
-            # Extract attributes for each feature
-            attribute_list = []
-            for item in gff3_db.features_of_type(feature):
-                attribute_list.extend(list(item.attributes.keys()))
-            # Make list of attributes unique
-            attribute_list = list(set(attribute_list))
-            # Collect all features and their attributes
-            features_attributes.append((feature, attribute_list))
-        # Convert information into a string:
-        # feature1\tattr1\tattr2\tattr\n
-        # feature2\tattr1\tattr2\tattr\n
-        return_str = "$".join([item[0] + "§" + "§".join(item[1]) for item in features_attributes])
-        return return_str
+        max_features = 0
+        if self.ahgrar_config:
+            max_features = int(self.ahgrar_config["Daisychain_Server"].get("annotation_scan_max_features", "0"))
+        return GFF3SchemaScanner(max_features).get_summary(gff3_file_path)
 
+    # The features and attributes of annotation files are collected in a background thread
+    # (see scan_annotation_file), until then feat_attr is empty and feat_attr_status is 'pending'
     def file_manager_add_file(self, proj_id, species, variant, file_name, filetype):
-        # If file is an annotation file, collect additional information about its
-        # features and attributes
-        if filetype == "annotation":
-            anno_feat_attr = self.get_annotation_features_attributes(os.path.join("Projects", proj_id, "Files", file_name))
-        else:
-            anno_feat_attr = ""
         with self.main_db_driver.session() as session_a:
             session_a.run("MATCH(proj:Project)-[:has_files]->(fileMngr:File_Manager) WHERE ID(proj)={proj_id} "
                               "MERGE (fileMngr)-[:file]->(newFile:File{species:{species},"
                               "variant:{variant},"
                               "filetype:{filetype},"
-                              "filename:{file_name},"
-                              "feat_attr:{feat_attr}"
+                              "filename:{file_name}"
                               "}) "
-                              "SET newFile.hidden = 'False' ",
+                              "SET newFile.hidden = 'False' "
+                              "SET newFile.feat_attr = '' "
+                              "SET newFile.feat_attr_status = {feat_attr_status}",
                               {"proj_id": int(proj_id), "variant": variant, "filetype": filetype,
-                               "file_name":file_name, "species":species, "feat_attr":anno_feat_attr})
+                               "file_name":file_name, "species":species,
+                               "feat_attr_status": "pending" if filetype == "annotation" else "finished"})
+        # If file is an annotation file, collect additional information about its
+        # features and attributes
+        if filetype == "annotation":
+            self.start_annotation_scan(proj_id, file_name)
+
+    # Scan an annotation file in a background thread, unless it is already being scanned
+    def start_annotation_scan(self, proj_id, file_name):
+        with running_scans_lock:
+            if (proj_id, file_name) in running_scans:
+                return
+            running_scans.add((proj_id, file_name))
+        threading.Thread(target=self.scan_annotation_file, args=(proj_id, file_name)).start()
+
+    # Collect the features and attributes of an annotation file and store them in its main-db entry
+    # Runs as its own task, feat_attr_status of the file is set to 'finished' or 'failed'
+    # If the scan fails for any reason, the reason is stored as task result and the status is always set to 'failed',
+    # so that clients waiting for the scan do not wait forever
+    def scan_annotation_file(self, proj_id, file_name):
+        task_id = self.task_mngr.define_task(proj_id, "Scan annotation file " + file_name)
+        self.task_mngr.set_task_status(proj_id, task_id, "running")
+        feat_attr_status = "failed"
+        try:
+            anno_feat_attr = self.get_annotation_features_attributes(os.path.join("Projects", proj_id, "Files",
+                                                                                  file_name))
+            self.set_annotation_scan_result(proj_id, file_name, anno_feat_attr, "finished")
+            feat_attr_status = "finished"
+            self.task_mngr.add_task_results(proj_id, task_id, anno_feat_attr)
+        except Exception as err:
+            self.task_mngr.add_task_results(proj_id, task_id, "Failed: %s: %s" % (type(err).__name__, err))
+        finally:
+            if feat_attr_status == "failed":
+                try:
+                    self.set_annotation_scan_result(proj_id, file_name, "", "failed")
+                except Exception as db_err:
+                    print("Could not store failed scan of %s: %s" % (file_name, db_err))
+            with running_scans_lock:
+                running_scans.discard((proj_id, file_name))
+            self.task_mngr.set_task_status(proj_id, task_id, feat_attr_status)
 
 
+    def set_annotation_scan_result(self, proj_id, file_name, feat_attr, feat_attr_status):
+        with self.main_db_driver.session() as session_a:
+            session_a.run("MATCH(proj:Project)-[:has_files]->(:File_Manager)-[:file]->(file:File) "
+                          "WHERE ID(proj)={proj_id} AND file.filename={file_name} "
+                          "SET file.feat_attr = {feat_attr} "
+                          "SET file.feat_attr_status = {feat_attr_status}",
+                          {"proj_id": int(proj_id), "file_name": file_name, "feat_attr": feat_attr,
+                           "feat_attr_status": feat_attr_status})
+
     # Return a list of all files associated with a project
     # Function requires only the project ID as parameter
+    # Format per file: file name, file type, features and attributes, scan status of the features and attributes
+    # ('pending', 'finished' or 'failed'), separated by tabs
+    # Pending scans that no thread of this server process works on, i.e. scans interrupted by a server restart,
+    # are started again
     def file_list(self, proj_id):
         with self.main_db_driver.session() as session_a:
             files_list = list(session_a.run("MATCH(proj:Project)-[:has_files]->(:File_Manager)-[:file]->(file:File) "
                           "WHERE ID(proj)={proj_id} RETURN file.filename, "
-                          "file.filetype, file.feat_attr ORDER BY file.filename",
+                          "file.filetype, file.feat_attr, coalesce(file.feat_attr_status, 'finished') "
+                          "ORDER BY file.filename",
                           {"proj_id":int(proj_id)}))
-        self.send_data("\n".join(["\t".join([item[0],item[1], item[2]]) for item in files_list]))
+        for item in files_list:
+            if item[1] == "annotation" and item[3] == "pending":
+                self.start_annotation_scan(proj_id, item[0])
+        self.send_data("\n".join(["\t".join([item[0],item[1], item[2], item[3]]) for item in files_list]))
 
     # Hide a file in a project so that file is not used in future database builds
     # File can be unhided anytime again
@@ -186,7 +247,10 @@ class FileManagement:
         file_name = file_name.replace("\t", "_")
         file_path = os.path.join("Projects", proj_id, "Files", file_name)
         try:
-            os.remove(file_path)
+            if not os.path.lexists(file_path):
+                raise FileNotFoundError(file_path)
+            self.get_file_linker(proj_id).remove(file_path)
+            self.invalidate_fasta_index(proj_id, file_name)
             with self.main_db_driver.session() as session_a:
                 remove_file = session_a.run("MATCH(proj:Project)-[:has_files]->(:File_Manager)-[:file]->(file:File) "
                                                   "WHERE ID(proj)={proj_id} AND file.filename={file_name} "
@@ -207,6 +271,8 @@ class FileManagement:
     # Batch import files from Import directory
     # Import file describes the files:
     # species,variant,filetype,filepath
+    # With file_import_mode "link", files are reflinked, hardlinked or symlinked instead of copied if possible
+    # (see FileLinker). The task result lists the strategy used for each file
     def file_import(self, proj_id, import_csv_table):
         # Restore table by replacing "\t" with "_"
         import_csv_table = import_csv_table.replace("\t", "_")
@@ -217,6 +283,14 @@ class FileManagement:
         import_csv_table = import_csv_table.split("\n")
         imported_file_counter = 0
         project_file_path = os.path.join("Projects", proj_id, "Files")
+        import_mode = "copy"
+        if self.ahgrar_config:
+            import_mode = self.ahgrar_config["Daisychain_Server"].get("file_import_mode", "copy")
+        file_linker = self.get_file_linker(proj_id)
+        import_strategies = []
+        # Checksums of earlier links are lost if the checksum file is invalid, report this with the results
+        if file_linker.load_error:
+            import_strategies.append("Warning: " + file_linker.load_error)
         self.task_mngr.set_task_status(proj_id, task_id, "running")
         print(import_csv_table)
         for line in import_csv_table:
@@ -235,17 +309,21 @@ class FileManagement:
             else:
                 file_ending = ".faa"
             file_name = "_".join([new_file_desc[0], new_file_desc[1]]) + file_ending
-            # Try to copy the file into the project folder
+            # Try to link or copy the file into the project folder
             # If file not found, continue with next file
             # In that case, no entry in the main DB will be made
             try:
-                shutil.copy2(new_file_path, os.path.join(project_file_path, file_name))
+                import_strategy = file_linker.link_or_copy(new_file_path, os.path.join(project_file_path, file_name),
+                                                           import_mode)
             except FileNotFoundError:
                 continue
+            import_strategies.append(file_name + ": " + import_strategy)
+            self.invalidate_fasta_index(proj_id, file_name)
             self.file_manager_add_file(proj_id, new_file_desc[0], new_file_desc[1], file_name, new_file_desc[2])
             imported_file_counter += 1
         self.task_mngr.set_task_status(proj_id, task_id, "imported " + str(imported_file_counter))
-        self.task_mngr.add_task_results(proj_id, task_id, "imported "+str(imported_file_counter))
+        self.task_mngr.add_task_results(proj_id, task_id, "\n".join(["imported "+str(imported_file_counter)] +
+                                                                     import_strategies))
         self.task_mngr.set_task_status(proj_id, task_id, "finished ")
         print('Finished importing')
 
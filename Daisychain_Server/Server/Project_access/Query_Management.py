@@ -16,6 +16,7 @@
 import os
 from neo4j.v1 import GraphDatabase, basic_auth
 import subprocess
+from CSV_creator.percent_identity_store import PercentIdentityStore
 
 
 class QueryManagement:
@@ -43,6 +44,24 @@ class QueryManagement:
                                       auth=("neo4j", bolt_pw))
         return project_db_driver
 
+    # Test whether a project DB contains Cluster nodes
+    # Projects built before Cluster nodes were introduced only have HOMOLOG relations
+    def has_cluster_nodes(self, project_db_driver):
+        with project_db_driver.session() as session_c:
+            return session_c.run("MATCH (clstr:Cluster) RETURN clstr LIMIT 1").single() is not None
+
+    # Percent match of a node with each of its homologs, as written to the HOMOLOG relations
+    # Looked up in the PercentIdentityStore of the project (seq_type transcripts or translations),
+    # returns a dict homolog ID --> percent match (NA if there was no search hit)
+    def perc_matches(self, proj_id, seq_type, node_id, homolog_ids):
+        homolog_ids = sorted(set(homolog_ids))
+        store_path = os.path.join("Projects", str(proj_id), "BlastDB", seq_type + "_pid")
+        if not homolog_ids or not os.path.isfile(store_path + ".keys.npy"):
+            return {homolog_id: "NA" for homolog_id in homolog_ids}
+        pid_store = PercentIdentityStore(store_path)
+        perc_ids = pid_store.lookup([int(node_id[1:])] * len(homolog_ids),
+                                    [int(homolog_id[1:]) for homolog_id in homolog_ids])
+        return dict(zip(homolog_ids, pid_store.format_perc_ids(perc_ids)))
 
 
 
@@ -233,7 +252,7 @@ class QueryManagement:
             relationship_type = "5_NB"
         if relationship_type == "3NB":
             relationship_type = "3_NB"
-        if not relationship_type in ["5_NB", "3_NB", "HOMOLOG", "CODING", "53NB"]:
+        if not relationship_type in ["5_NB", "3_NB", "HOMOLOG", "CODING", "53NB", "SYNTENY"]:
             self.send_data("-12")
         # Collect nodes and relationships in two lists
         gene_node_hits = {}
@@ -319,6 +338,7 @@ class QueryManagement:
                     query_hits = session_i.run("MATCH(gene:Gene)-[rel:`"+reltype+"`]->(targetGene:Gene) "
                                                 "WHERE gene.geneId = {geneId} "
                                                 "OPTIONAL MATCH (targetGene)-[targetGene_rel]->(secondary_node) "
+                                                "WHERE NOT secondary_node:Cluster "
                                                 "RETURN gene, rel, targetGene, targetGene_rel, "
                                                 "secondary_node.geneId, secondary_node.proteinId",
                                                 {"geneId": node_id} )
@@ -388,26 +408,42 @@ class QueryManagement:
 
         # Retrieve all homologs for a certain Protein ID. Include all relations going out from each homolog gene, i.e.
         # all HOMOLOG and all CODING edges.
+        # Homologs are the members of the clusters of this protein (two MEMBER_OF hops). The percent match is taken
+        # from the PercentIdentityStore, so no HOMOLOG edge is traversed and the lookup is linear in the cluster size,
+        # for every homology topology. HOMOLOG edges between the homologs are therefore not returned, all members
+        # of a cluster are homologs of each other.
+        # Projects without Cluster nodes (built before they were introduced) are queried through their HOMOLOG edges
         if relationship_type == "HOMOLOG" and node_type == "Protein":
+            has_clusters = self.has_cluster_nodes(project_db_driver)
             with project_db_driver.session() as session_j:
-                query_hits = session_j.run("MATCH(protein:Protein)-[rel:HOMOLOG]->(protH:Protein)<-[:CODING]-(geneH:Gene) "
-                                             "WHERE protein.proteinId = {protId} "
-                                             "OPTIONAL MATCH (protH)-[secRel]-(secNode) "
-                                             "RETURN rel, protH, geneH.species, geneH.name, "
-                                             "secRel, secNode.geneId, secNode.proteinId", {"protId": node_id})
+                if has_clusters:
+                    query_hits = list(session_j.run(
+                        "MATCH(protein:Protein)-[:MEMBER_OF]->(clstr:Cluster)<-[:MEMBER_OF]-(protH:Protein)"
+                        "<-[:CODING]-(geneH:Gene) "
+                        "WHERE protein.proteinId = {protId} "
+                        "OPTIONAL MATCH (protH)-[secRel:CODING]-(secNode) "
+                        "RETURN clstr.clstr_sens AS clstr_sens, NULL AS perc_match, protH, geneH.species, geneH.name, "
+                        "secRel, secNode.geneId, secNode.proteinId", {"protId": node_id}))
+                else:
+                    query_hits = list(session_j.run(
+                        "MATCH(protein:Protein)-[rel:HOMOLOG]->(protH:Protein)<-[:CODING]-(geneH:Gene) "
+                        "WHERE protein.proteinId = {protId} "
+                        "OPTIONAL MATCH (protH)-[secRel]-(secNode) "
+                        "RETURN rel.clstr_sens AS clstr_sens, rel.perc_match AS perc_match, protH, geneH.species, "
+                        "geneH.name, secRel, secNode.geneId, secNode.proteinId", {"protId": node_id}))
+            perc_matches = self.perc_matches(user_request[0], "translations", node_id,
+                                             [record["protH"]["proteinId"] for record in query_hits
+                                              if record["perc_match"] is None])
             for record in query_hits:
-                try:
-                    rel_type = record["rel"].type
-                except:
-                    rel_type = "None"
-                if rel_type == "HOMOLOG":
-                    # Don't add the node for which we are searching homologs to the list of nodes
-                    if record["protH"]["proteinId"] != node_id:
-                        protein_node_hits[record["protH"]["proteinId"]] = \
-                            [record["protH"]["prot_seq"], record["geneH.species"], record["geneH.name"]]
-                    protein_node_hmlg_rel.append(
-                        (node_id, rel_type, record["rel"]["clstr_sens"],
-                         record["rel"]["perc_match"], record["protH"]["proteinId"]))
+                # Don't add the node for which we are searching homologs to the list of nodes
+                if record["protH"]["proteinId"] != node_id:
+                    protein_node_hits[record["protH"]["proteinId"]] = \
+                        [record["protH"]["prot_seq"], record["geneH.species"], record["geneH.name"]]
+                protein_node_hmlg_rel.append(
+                    (node_id, "HOMOLOG", record["clstr_sens"],
+                     record["perc_match"] if record["perc_match"] is not None
+                     else perc_matches[record["protH"]["proteinId"]],
+                     record["protH"]["proteinId"]))
                 # Analyse relation going out from this homologeous protein
                 try:
                     relNode_rel_type = record["secRel"].type
@@ -435,19 +471,40 @@ class QueryManagement:
         # genes. We therefore search for all Gene nodes related to our node of interest but return only homologeous gene
         # nodes but all possible relations. For each new gene we also retrieve the complete set of relations, incl.
         # CODING to proteins.
+        # Homologs are the members of the clusters of this gene (two MEMBER_OF hops), the percent match is taken
+        # from the PercentIdentityStore, as for proteins. Only 5_NB, 3_NB and CODING edges of the homologs are returned.
+        # Projects without Cluster nodes are queried through their HOMOLOG edges
         if relationship_type =="HOMOLOG" and node_type == "Gene":
+            has_clusters = self.has_cluster_nodes(project_db_driver)
             with project_db_driver.session() as session_k:
-                 query_hits = session_k.run("MATCH (gene:Gene)-[rel]->(relNode:Gene) WHERE "
-                                             "gene.geneId = {geneId} "
-                                             "OPTIONAL MATCH (relNode)-[relNode_rel]->(relrelNode) "
-                                             "RETURN rel, relNode, relNode_rel, relrelNode.geneId, relrelNode.proteinId",
-                                             {"geneId": node_id})
+                if has_clusters:
+                    query_hits = list(session_k.run(
+                        "MATCH (gene:Gene)-[:MEMBER_OF]->(clstr:Cluster)<-[:MEMBER_OF]-(relNode:Gene) "
+                        "WHERE gene.geneId = {geneId} "
+                        "OPTIONAL MATCH (relNode)-[relNode_rel:`5_NB`|`3_NB`|CODING]->(relrelNode) "
+                        "RETURN 'HOMOLOG' AS rel_type, clstr.clstr_sens AS clstr_sens, NULL AS perc_match, "
+                        "relNode, relNode_rel, relrelNode.geneId, relrelNode.proteinId "
+                        "UNION ALL "
+                        "MATCH (gene:Gene)-[rel:`5_NB`|`3_NB`]->(relNode:Gene) "
+                        "WHERE gene.geneId = {geneId} "
+                        "OPTIONAL MATCH (relNode)-[relNode_rel:`5_NB`|`3_NB`|CODING]->(relrelNode) "
+                        "RETURN type(rel) AS rel_type, NULL AS clstr_sens, NULL AS perc_match, "
+                        "relNode, relNode_rel, relrelNode.geneId, relrelNode.proteinId",
+                        {"geneId": node_id}))
+                else:
+                    query_hits = list(session_k.run(
+                        "MATCH (gene:Gene)-[rel]->(relNode:Gene) WHERE "
+                        "gene.geneId = {geneId} "
+                        "OPTIONAL MATCH (relNode)-[relNode_rel]->(relrelNode) "
+                        "RETURN type(rel) AS rel_type, rel.clstr_sens AS clstr_sens, rel.perc_match AS perc_match, "
+                        "relNode, relNode_rel, relrelNode.geneId, relrelNode.proteinId",
+                        {"geneId": node_id}))
+            perc_matches = self.perc_matches(user_request[0], "transcripts", node_id,
+                                             [record["relNode"]["geneId"] for record in query_hits
+                                              if record["rel_type"] == "HOMOLOG" and record["perc_match"] is None])
 
             for record in query_hits:
-                try:
-                    rel_type = record["rel"].type
-                except:
-                    rel_type = "None"
+                rel_type = record["rel_type"]
                 # First retrieve the set of homologeous genes
                 # and the set of HOMOLOG edges starting from this gene to all homologeous genes
                 if rel_type == "HOMOLOG":
@@ -457,8 +514,10 @@ class QueryManagement:
                             [record["relNode"][item] for item in ["species", "contig",
                                                                "start", "stop", "name", "descr", "nt_seq"]]
                     gene_node_hmlg_rel.append(
-                        (node_id, rel_type, record["rel"]["clstr_sens"],
-                         record["rel"]["perc_match"], record["relNode"]["geneId"]))
+                        (node_id, rel_type, record["clstr_sens"],
+                         record["perc_match"] if record["perc_match"] is not None
+                         else perc_matches[record["relNode"]["geneId"]],
+                         record["relNode"]["geneId"]))
                 # Retrieve 5' and 3' edges starting from this gene
                 if rel_type == "5_NB":
                     gene_node_nb_rel.append((node_id, "5_NB", record["relNode"]["geneId"]))
@@ -493,6 +552,28 @@ class QueryManagement:
                                                     "CODING",
                                                     record["relrelNode.proteinId"]))
 
+        # Retrieve all genes in the same synteny block(s) as a certain Gene-ID, together with the anchor homology
+        # relations of these blocks. Blocks are found by index lookup on their ID, no traversal of neighbours needed.
+        if relationship_type == "SYNTENY" and node_type == "Gene":
+            with project_db_driver.session() as session_l:
+                query_hits = session_l.run("MATCH (gene:Gene)-[:IN_BLOCK]->(block:SyntenyBlock)<-[:IN_BLOCK]-(blockGene:Gene) "
+                                           "WHERE gene.geneId = {geneId} "
+                                           "OPTIONAL MATCH (blockGene)-[rel:HOMOLOG]->(anchorGene:Gene) "
+                                           "WHERE rel.synteny_block = block.blockId "
+                                           "RETURN blockGene, rel, anchorGene.geneId",
+                                           {"geneId": node_id})
+            for record in query_hits:
+                if record["blockGene"]["geneId"] != node_id:
+                    gene_node_hits[record["blockGene"]["geneId"]] = \
+                        [record["blockGene"][item] for item in ["species", "contig",
+                                                               "start", "stop", "name", "descr", "nt_seq"]]
+                if record["rel"] is not None:
+                    gene_node_hmlg_rel.append((record["blockGene"]["geneId"],
+                                               "HOMOLOG",
+                                               record["rel"]["clstr_sens"],
+                                               record["rel"]["perc_match"],
+                                               record["anchorGene.geneId"]))
+
         print("Gene nodes: " + str(len(gene_node_hits)))
         print("Protein nodes: "+ str(len(protein_node_hits)))
         print("Gene-gene NB relations: " + str(len(gene_node_nb_rel)))
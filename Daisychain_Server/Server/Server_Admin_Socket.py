@@ -78,7 +78,8 @@ class DaisychainAdminServer(socketserver.BaseRequestHandler):
             task_manager.evaluate_user_request(user_request[1:])
         elif user_request[0] == "FILE" and 3 <= len(user_request) <= 7:
             # Initialize file manager
-            file_manager = FileManagement(self.get_db_driver(), task_manager, self.send_data)
+            file_manager = FileManagement(self.get_db_driver(), task_manager, self.send_data,
+                                          self.ahgrar_config)
             # Evaluate user request
             file_manager.evaluate_user_request(user_request[1:])
         elif user_request[0] == "BULD":
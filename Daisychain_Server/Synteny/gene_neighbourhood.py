@@ -0,0 +1,67 @@
+# In-memory index of the gene order on every contig of a project
+# AnnoToCSV connects neighbouring genes on the same contig with 5_NB/3_NB relations,
+# i.e. the genes of a contig form a single chain ordered by their start index.
+# The index stores each chain as an ordered list of gene IDs plus the position of every gene
+# in its chain. 5' and 3' neighbours of a gene can thus be looked up without traversing the graph.
+# The index is built once, either from the gene_5nb.csv file written by AnnoToCSV
+# or by a single bulk read of all 5_NB relations from a project DB
+
+
+class GeneNeighbourhoodIndex:
+    # nb_distance: Number of neighbours to report on each side of a gene
+    # Local synteny uses up to five 5' and five 3' neighbours (5_NB*1..5 and 3_NB*1..5)
+    def __init__(self, nb_distance=5):
+        self.nb_distance = nb_distance
+        # List of chains, one per contig (or contig fragment), ordered from 5' to 3'
+        self.chains = []
+        # Gene ID --> (chain index, position in chain)
+        self.gene_position = {}
+
+    # Load all (Gene)-[:5_NB]->(Gene) relations from the gene_5nb.csv file
+    # Format: :START_ID(Gene),:END_ID(Gene) with the 5' neighbour as end node
+    def load_csv(self, gene_5nb_csv_path):
+        with open(gene_5nb_csv_path, "r") as gene_5nb_file:
+            # Skip header
+            next(gene_5nb_file, None)
+            self.build(tuple(line.rstrip("\n").split(",")) for line in gene_5nb_file if line.strip())
+
+    # Load all (Gene)-[:5_NB]->(Gene) relations from a project DB
+    def load_project_db(self, project_db_conn):
+        nb5_relations = project_db_conn.run("MATCH(gene:Gene)-[:`5_NB`]->(gene5NB:Gene) "
+                                            "RETURN gene.geneId AS gene, gene5NB.geneId AS nb")
+        self.build((record["gene"], record["nb"]) for record in nb5_relations)
+
+    # Build the chains from (gene, 5' neighbour) pairs
+    def build(self, nb5_pairs):
+        # Every gene has at most one direct 5' and one direct 3' neighbour
+        prev_gene = {}
+        next_gene = {}
+        for gene, gene_5nb in nb5_pairs:
+            prev_gene[gene] = gene_5nb
+            next_gene[gene_5nb] = gene
+        self.chains = []
+        self.gene_position = {}
+        # Each chain starts with a gene that has a 3' but no 5' neighbour
+        for chain_start in next_gene:
+            if chain_start in prev_gene:
+                continue
+            chain = [chain_start]
+            while chain[-1] in next_gene:
+                chain.append(next_gene[chain[-1]])
+            chain_idx = len(self.chains)
+            for position, gene in enumerate(chain):
+                self.gene_position[gene] = (chain_idx, position)
+            self.chains.append(chain)
+
+    # Return the 5' neighbours (closest first) followed by the 3' neighbours (closest first) of a gene
+    # This is the order in which 5_NB*1..5 and 3_NB*1..5 traversals return them
+    # Genes without any neighbours return an empty list
+    def neighbours(self, gene_id):
+        try:
+            chain_idx, position = self.gene_position[gene_id]
+        except KeyError:
+            return []
+        chain = self.chains[chain_idx]
+        nb_5 = chain[max(0, position - self.nb_distance):position][::-1]
+        nb_3 = chain[position + 1:position + 1 + self.nb_distance]
+        return nb_5 + nb_3
@@ -0,0 +1,165 @@
+# Local synteny score of homology relations between genes
+# The score counts homology relations (inflation value 1.4) between the neighbouring genes
+# of the start gene and the neighbouring genes of the end gene.
+# Each neighbouring gene can only be involved in one counted homology relation
+# to prevent misleading high scores in case a gene has multiple homologs among the neighbours.
+# Gene IDs (e.g. "g123") are mapped to dense int32 indices by a GeneIdEncoder.
+# Neighbours of all genes are kept in one int32 matrix (one row per gene, -1 = no neighbour),
+# the 1.4 homology graph is kept as CSR arrays (indptr, indices) with sorted column indices.
+# Relations are scored in batches with NumPy, so no graph traversal or Python loop is needed per relation
+import numpy as np
+
+
+class GeneIdEncoder:
+    def __init__(self):
+        # Gene ID --> dense index
+        self.gene_idx = {}
+        # Dense index --> gene ID
+        self.gene_ids = []
+
+    def __len__(self):
+        return len(self.gene_ids)
+
+    def encode(self, gene_id):
+        try:
+            return self.gene_idx[gene_id]
+        except KeyError:
+            self.gene_idx[gene_id] = len(self.gene_ids)
+            self.gene_ids.append(gene_id)
+            return self.gene_idx[gene_id]
+
+    def encode_many(self, gene_ids):
+        return np.fromiter((self.encode(gene_id) for gene_id in gene_ids), dtype=np.int32)
+
+    def decode(self, idx):
+        return self.gene_ids[idx]
+
+
+class LocalSynteny:
+    # nb_index: GeneNeighbourhoodIndex of the project
+    # encoder: GeneIdEncoder shared with the homology relations to score
+    def __init__(self, nb_index, encoder):
+        self.encoder = encoder
+        self.nb_width = 2 * nb_index.nb_distance
+        self.nb_matrix = self.build_nb_matrix(nb_index)
+        # CSR arrays of the 1.4 homology graph, set by set_homolog_graph
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+
+    # Create a scorer directly from its arrays, e.g. from arrays placed in shared memory
+    # Such a scorer has no encoder and can only score relations between already encoded genes
+    @classmethod
+    def from_arrays(cls, nb_matrix, indptr, indices):
+        local_synteny = cls.__new__(cls)
+        local_synteny.encoder = None
+        local_synteny.nb_width = nb_matrix.shape[1]
+        local_synteny.nb_matrix = nb_matrix
+        local_synteny.indptr = indptr
+        local_synteny.indices = indices
+        return local_synteny
+
+    # Create a scorer for the same genes sharing the neighbour matrix, but without homology graph
+    # Used to score relations against another homology graph, e.g. protein homology relations mapped to genes
+    def share_neighbourhood(self):
+        local_synteny = LocalSynteny.from_arrays(self.nb_matrix, np.zeros(1, dtype=np.int64),
+                                                 np.zeros(0, dtype=np.int32))
+        local_synteny.encoder = self.encoder
+        return local_synteny
+
+    # Build the neighbour matrix: Columns 0..d-1 are the 5' neighbours (closest first),
+    # columns d..2d-1 the 3' neighbours (closest first), i.e. the order of GeneNeighbourhoodIndex.neighbours
+    def build_nb_matrix(self, nb_index):
+        nb_distance = nb_index.nb_distance
+        chains = [self.encoder.encode_many(chain) for chain in nb_index.chains]
+        nb_matrix = np.full((len(self.encoder), self.nb_width), -1, dtype=np.int32)
+        for chain in chains:
+            for dist in range(1, nb_distance + 1):
+                if dist >= len(chain):
+                    break
+                nb_matrix[chain[dist:], dist - 1] = chain[:-dist]
+                nb_matrix[chain[:-dist], nb_distance + dist - 1] = chain[dist:]
+        return nb_matrix
+
+    # Set the homology relations (inflation value 1.4) used to score, given as two int32 index arrays
+    # Self-loops are removed, duplicate relations do not matter
+    def set_homolog_graph(self, start_idx, end_idx):
+        keep = start_idx != end_idx
+        start_idx = start_idx[keep]
+        end_idx = end_idx[keep]
+        order = np.lexsort((end_idx, start_idx))
+        self.indices = end_idx[order].astype(np.int32)
+        row_counts = np.bincount(start_idx, minlength=len(self.encoder))
+        self.indptr = np.zeros(len(row_counts) + 1, dtype=np.int64)
+        np.cumsum(row_counts, out=self.indptr[1:])
+
+    # Set the homology relations used to score from clusters, given as list of int32 index arrays
+    # All members of a cluster are homologs of each other, independent of the homolog relations written for them
+    def set_cluster_graph(self, clusters):
+        clusters = [cluster for cluster in clusters if len(cluster) > 1]
+        if not clusters:
+            self.set_homolog_graph(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+            return
+        self.set_homolog_graph(np.concatenate([np.repeat(cluster, len(cluster)) for cluster in clusters]),
+                               np.concatenate([np.tile(cluster, len(cluster)) for cluster in clusters]))
+
+    # Neighbour rows of genes, genes without an entry in the neighbour matrix have no neighbours
+    def nb_rows(self, gene_idx):
+        in_matrix = gene_idx < self.nb_matrix.shape[0]
+        rows = np.full((len(gene_idx), self.nb_width), -1, dtype=np.int32)
+        rows[in_matrix] = self.nb_matrix[gene_idx[in_matrix]]
+        return rows
+
+    # Test for every pair (a, b) whether the 1.4 homology graph contains the relation a->b
+    # Vectorised binary search within the sorted CSR row of each a
+    def is_homolog(self, a, b):
+        result = np.zeros(len(a), dtype=bool)
+        valid = (a >= 0) & (b >= 0) & (a < len(self.indptr) - 1)
+        a = a[valid]
+        b = b[valid]
+        lo = self.indptr[a]
+        row_end = self.indptr[a + 1]
+        hi = row_end.copy()
+        searching = lo < hi
+        while searching.any():
+            mid = (lo + hi) // 2
+            go_right = searching & (self.indices[np.minimum(mid, len(self.indices) - 1)] < b)
+            lo = np.where(go_right, mid + 1, lo)
+            hi = np.where(searching & ~go_right, mid, hi)
+            searching = lo < hi
+        found = lo < row_end
+        found[found] = self.indices[lo[found]] == b[found]
+        result[valid] = found
+        return result
+
+    # Score a batch of relations given as two int32 index arrays, returns an int32 array of scores
+    def score_edges(self, start_idx, end_idx):
+        start_nb = self.nb_rows(start_idx)
+        end_nb = self.nb_rows(end_idx)
+        width = self.nb_width
+        # hmlg[r, i, j]: Is there a homology relation start_nb[r, i] -> end_nb[r, j]?
+        hmlg = self.is_homolog(np.repeat(start_nb, width, axis=1).ravel(),
+                               np.tile(end_nb, (1, width)).ravel()).reshape(-1, width, width)
+        scores = np.zeros(len(start_idx), dtype=np.int32)
+        # Only relations with at least one homologous neighbour pair need the greedy pass
+        candidates = np.nonzero(hmlg.any(axis=(1, 2)))[0]
+        start_nb = start_nb[candidates]
+        end_nb = end_nb[candidates]
+        hmlg = hmlg[candidates]
+        # Track which neighbours are already involved in a counted homology relation
+        # A gene counts as used on both sides, as the same gene can be a neighbour of start and end gene
+        start_used = np.zeros(start_nb.shape, dtype=bool)
+        end_used = np.zeros(end_nb.shape, dtype=bool)
+        candidate_scores = np.zeros(len(candidates), dtype=np.int32)
+        # Test all combinations of start and end neighbours in the same order as itertools.product
+        for i in range(width):
+            for j in range(width):
+                match = np.nonzero(hmlg[:, i, j] & ~start_used[:, i] & ~end_used[:, j])[0]
+                if not len(match):
+                    continue
+                candidate_scores[match] += 1
+                start_gene = start_nb[match, i][:, None]
+                end_gene = end_nb[match, j][:, None]
+                start_used[match] |= (start_nb[match] == start_gene) | (start_nb[match] == end_gene)
+                end_used[match] |= (end_nb[match] == start_gene) | (end_nb[match] == end_gene)
+        scores[candidates] = candidate_scores
+        return scores
@@ -0,0 +1,134 @@
+# Multi-process local synteny scoring
+# The neighbour matrix and the CSR arrays of the 1.4 homology graph of a LocalSynteny scorer are copied
+# once into shared memory. Worker processes of a ProcessPoolExecutor attach to these arrays
+# and score shards of homology relations. Relations are sharded either by species pair
+# or by contig pair of their start and end gene, so that each worker touches a compact part of the
+# neighbour matrix. Scores of all shards are merged back into the order of the input relations.
+# ShardedLocalSynteny offers the same score_edges function as LocalSynteny. Its worker processes and shared memory
+# are released by close, or by using it as a context manager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+from Synteny.local_synteny import LocalSynteny
+
+# Scorer of a worker process, created once per process by attach_worker
+worker_scorer = None
+# Keep references to the shared memory blocks so that they stay mapped in the worker
+worker_shm_blocks = []
+
+
+def attach_worker(shm_specs):
+    global worker_scorer
+    arrays = []
+    for shm_name, shape, dtype in shm_specs:
+        shm_block = shared_memory.SharedMemory(name=shm_name)
+        worker_shm_blocks.append(shm_block)
+        arrays.append(np.ndarray(shape, dtype=dtype, buffer=shm_block.buf))
+    worker_scorer = LocalSynteny.from_arrays(*arrays)
+
+
+def score_shard(shard_nr, start_idx, end_idx):
+    return shard_nr, worker_scorer.score_edges(start_idx, end_idx)
+
+
+# Shard keys: Species of every gene, as integer code per encoded gene index
+def species_shard_keys(project_db_conn, gene_encoder):
+    gene_species = project_db_conn.run("MATCH(gene:Gene) RETURN gene.geneId AS gene, gene.species AS species")
+    species_codes = {}
+    shard_keys = np.full(len(gene_encoder), -1, dtype=np.int32)
+    for record in gene_species:
+        gene_idx = gene_encoder.gene_idx.get(record["gene"])
+        if gene_idx is None:
+            continue
+        shard_keys[gene_idx] = species_codes.setdefault(record["species"], len(species_codes))
+    return shard_keys
+
+
+# Shard keys: Contig of every gene, i.e. the chain of the gene in the GeneNeighbourhoodIndex
+def contig_shard_keys(nb_index, gene_encoder):
+    shard_keys = np.full(len(gene_encoder), -1, dtype=np.int32)
+    for gene, (chain_idx, position) in nb_index.gene_position.items():
+        gene_idx = gene_encoder.gene_idx.get(gene)
+        if gene_idx is not None:
+            shard_keys[gene_idx] = chain_idx
+    return shard_keys
+
+
+class ShardedLocalSynteny:
+    # local_synteny: LocalSynteny scorer with neighbour matrix and homology graph already set
+    # shard_keys: int32 array with the species or contig code of every encoded gene
+    # processes: Number of worker processes, e.g. cpu_cores from Daisychain_config.txt
+    def __init__(self, local_synteny, shard_keys, processes):
+        self.shard_keys = shard_keys
+        self.processes = max(1, processes)
+        self.shm_blocks = []
+        self.executor = None
+        shm_specs = []
+        # Blocks created before a failure are released again
+        try:
+            for array in [local_synteny.nb_matrix, local_synteny.indptr, local_synteny.indices]:
+                shm_block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                self.shm_blocks.append(shm_block)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm_block.buf)[...] = array
+                shm_specs.append((shm_block.name, array.shape, array.dtype.str))
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=attach_worker,
+                                                initargs=(shm_specs,))
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Shard key of a relation: pair of the start and end gene keys
+    def relation_keys(self, start_idx, end_idx):
+        start_keys = np.full(len(start_idx), -1, dtype=np.int64)
+        end_keys = np.full(len(end_idx), -1, dtype=np.int64)
+        start_known = start_idx < len(self.shard_keys)
+        end_known = end_idx < len(self.shard_keys)
+        start_keys[start_known] = self.shard_keys[start_idx[start_known]]
+        end_keys[end_known] = self.shard_keys[end_idx[end_known]]
+        return (start_keys + 1) * (int(self.shard_keys.max(initial=0)) + 2) + end_keys + 1
+
+    # Split relations into shards: Relations with the same key pair always end up in the same shard,
+    # key pairs are distributed over the shards so that all shards have about the same size
+    def make_shards(self, start_idx, end_idx):
+        relation_keys = self.relation_keys(start_idx, end_idx)
+        order = np.argsort(relation_keys, kind="stable")
+        unique_keys, group_starts, group_sizes = np.unique(relation_keys[order], return_index=True,
+                                                           return_counts=True)
+        nr_of_shards = min(len(unique_keys), 4 * self.processes)
+        shard_sizes = np.zeros(nr_of_shards, dtype=np.int64)
+        shard_groups = [[] for _ in range(nr_of_shards)]
+        # Largest key pairs first, each into the currently smallest shard
+        for group in np.argsort(group_sizes)[::-1]:
+            shard_nr = int(np.argmin(shard_sizes))
+            shard_groups[shard_nr].append(order[group_starts[group]:group_starts[group] + group_sizes[group]])
+            shard_sizes[shard_nr] += group_sizes[group]
+        return [np.concatenate(groups) for groups in shard_groups if groups]
+
+    def score_edges(self, start_idx, end_idx):
+        scores = np.zeros(len(start_idx), dtype=np.int32)
+        if not len(start_idx):
+            return scores
+        shards = self.make_shards(start_idx, end_idx)
+        futures = [self.executor.submit(score_shard, shard_nr, start_idx[shard], end_idx[shard])
+                   for shard_nr, shard in enumerate(shards)]
+        # Merge shard scores back into the order of the input relations
+        for future in as_completed(futures):
+            shard_nr, shard_scores = future.result()
+            scores[shards[shard_nr]] = shard_scores
+        return scores
+
+    # Stop the worker processes and release the shared memory, calling it again does nothing
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for shm_block in self.shm_blocks:
+            shm_block.close()
+            shm_block.unlink()
+        self.shm_blocks = []
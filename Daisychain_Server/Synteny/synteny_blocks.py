@@ -0,0 +1,111 @@
+# Detection of collinear synteny blocks between pairs of contigs
+# Anchors are pairs of homologous genes (in the same large cluster) on two different contigs.
+# Each anchor is placed at the positions of its two genes in their contig chains (GeneNeighbourhoodIndex).
+# A synteny block is a chain of anchors whose positions increase on both contigs (same orientation)
+# or increase on one and decrease on the other contig (inverted orientation).
+# Chains are found by dynamic programming over the anchors sorted by position A: An anchor extends the longest chain
+# ending in an anchor at most max_gap genes before it on both contigs, so chains never span a larger gap.
+# The chains of both orientations are then taken greedily, longest first: A chain is traced back from its last
+# anchor and stops at anchors already taken by another block. A chain that became shorter is queued again with its
+# remaining length, so anchors that are not part of a block stay available for the other chains.
+# Chains with at least min_anchors anchors become blocks.
+# Runtime per contig pair is O(n * w + n log n) for n anchors, with w the number of anchors within max_gap
+# positions on contig A (bounded by max_gap times the number of homologs per gene).
+# Anchors between genes of the same contig (tandem duplications) are not used.
+import heapq
+from bisect import bisect_left
+
+
+class SyntenyBlocks:
+    # nb_index: GeneNeighbourhoodIndex with the gene order of all contigs
+    # min_anchors: Minimal number of anchors of a block
+    # max_gap: Maximal distance (in genes) between two consecutive anchors of a block on each contig
+    def __init__(self, nb_index, min_anchors=5, max_gap=10):
+        self.nb_index = nb_index
+        self.min_anchors = min_anchors
+        self.max_gap = max_gap
+        # List of blocks, each a tuple of block ID, orientation ("+" or "-") and list of anchors (gene A, gene B)
+        # Gene A of every anchor lies on the contig with the lower chain index
+        self.blocks = []
+
+    # Find all blocks from (gene, homologous gene) pairs
+    # Both directions of a relation and duplicated relations are counted as one anchor
+    def find_blocks(self, anchor_pairs):
+        # Anchors grouped by contig pair: (chain A, chain B) --> set of (position A, position B)
+        contig_pairs = {}
+        for gene_a, gene_b in anchor_pairs:
+            try:
+                chain_a, pos_a = self.nb_index.gene_position[gene_a]
+                chain_b, pos_b = self.nb_index.gene_position[gene_b]
+            except KeyError:
+                continue
+            if chain_a == chain_b:
+                continue
+            if chain_a > chain_b:
+                chain_a, pos_a, chain_b, pos_b = chain_b, pos_b, chain_a, pos_a
+            contig_pairs.setdefault((chain_a, chain_b), set()).add((pos_a, pos_b))
+        self.blocks = []
+        for chain_a, chain_b in sorted(contig_pairs):
+            for orientation, anchors in self.chain_anchors(sorted(contig_pairs[(chain_a, chain_b)])):
+                block_id = "b" + str(len(self.blocks))
+                self.blocks.append((block_id, orientation,
+                                    [(self.nb_index.chains[chain_a][pos_a], self.nb_index.chains[chain_b][pos_b])
+                                     for pos_a, pos_b in anchors]))
+        return self.blocks
+
+    # Chain the anchors of one contig pair, anchors are (position A, position B) sorted by position A
+    # Returns a list of (orientation, anchors) per block
+    def chain_anchors(self, anchors):
+        chains = {"+": self.gap_chains(anchors, 1), "-": self.gap_chains(anchors, -1)}
+        # Queue of chain ends: (-chain length, anchor number, orientation)
+        queue = [(-chain_lengths[anchor_nr], anchor_nr, orientation)
+                 for orientation, (chain_lengths, _) in sorted(chains.items())
+                 for anchor_nr in range(len(anchors)) if chain_lengths[anchor_nr] >= self.min_anchors]
+        heapq.heapify(queue)
+        used = [False] * len(anchors)
+        blocks = []
+        while queue:
+            length, anchor_nr, orientation = heapq.heappop(queue)
+            prev_anchor = chains[orientation][1]
+            chain = []
+            while anchor_nr is not None and not used[anchor_nr]:
+                chain.append(anchor_nr)
+                anchor_nr = prev_anchor[anchor_nr]
+            if len(chain) < -length:
+                # Part of the chain was taken by another block, queue the remaining chain again
+                if len(chain) >= self.min_anchors:
+                    heapq.heappush(queue, (-len(chain), chain[0], orientation))
+                continue
+            for anchor_nr in chain:
+                used[anchor_nr] = True
+            blocks.append((orientation, [anchors[anchor_nr] for anchor_nr in reversed(chain)]))
+        return blocks
+
+    # Longest chains of anchors with strictly increasing position A and strictly increasing (direction 1)
+    # or decreasing (direction -1) position B, consecutive anchors at most max_gap genes apart on both contigs
+    # Returns two lists: Length of the longest chain ending in each anchor and the previous anchor in this chain
+    # (None for the first anchor). Ties are broken by the closest previous anchor.
+    def gap_chains(self, anchors, direction):
+        positions_a = [anchor[0] for anchor in anchors]
+        chain_lengths = [1] * len(anchors)
+        prev_anchor = [None] * len(anchors)
+        for anchor_nr, (pos_a, pos_b) in enumerate(anchors):
+            best = (1, 0)
+            for prev_nr in range(bisect_left(positions_a, pos_a - self.max_gap), bisect_left(positions_a, pos_a)):
+                distance_b = direction * (pos_b - anchors[prev_nr][1])
+                if 0 < distance_b <= self.max_gap:
+                    candidate = (chain_lengths[prev_nr] + 1, -(pos_a - positions_a[prev_nr] + distance_b))
+                    if candidate > best:
+                        best = candidate
+                        prev_anchor[anchor_nr] = prev_nr
+            chain_lengths[anchor_nr] = best[0]
+        return chain_lengths, prev_anchor
+
+    # Genes spanned by a block on both contigs, from its first to its last anchor
+    def block_genes(self, anchors):
+        genes = []
+        for side in [0, 1]:
+            chain_idx, first_pos = self.nb_index.gene_position[anchors[0][side]]
+            last_pos = self.nb_index.gene_position[anchors[-1][side]][1]
+            genes.extend(self.nb_index.chains[chain_idx][min(first_pos, last_pos):max(first_pos, last_pos) + 1])
+        return genes
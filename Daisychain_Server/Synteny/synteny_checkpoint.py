@@ -0,0 +1,60 @@
+# Checkpoint of a running local synteny calculation
+# calculate_synteny scores the relations of each inflation value in a fixed order (sorted by the stable
+# keys of their start and end genes, see SyntenyState). The checkpoint stores, for every inflation value,
+# the scores of the relations scored so far, i.e. the offset of the run plus its partial results.
+# A checkpoint is only valid for the run it was written for: It carries a hash over the genes, their
+# fingerprints and all relations to score. If the project DB changed in between, the checkpoint is ignored.
+# The checkpoint is saved as a NumPy .npz file in the project folder and removed once the run finished
+import os
+import hashlib
+import numpy as np
+
+
+class SyntenyCheckpoint:
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+        self.run_hash = ""
+
+    # Hash of a run: Genes with fingerprints (in the order of their stable key) and the sorted relations
+    # to score of each inflation value together with the mask of relations that are scored again
+    # rel_levels: List of (clstr_sens, start_idx, end_idx, dirty) per inflation value
+    def set_run(self, synteny_state, rel_levels):
+        run_hash = hashlib.blake2b(digest_size=16)
+        order = np.argsort(synteny_state.gene_keys, kind="stable")
+        for array in [synteny_state.gene_keys, synteny_state.nb_hash, synteny_state.hmlg_hash,
+                      synteny_state.gene_changed]:
+            run_hash.update(np.ascontiguousarray(array[order]).tobytes())
+        for clstr_sens, start_idx, end_idx, dirty in rel_levels:
+            run_hash.update(clstr_sens.encode())
+            run_hash.update(synteny_state.relation_pairs(start_idx, end_idx).tobytes())
+            run_hash.update(dirty.tobytes())
+        self.run_hash = run_hash.hexdigest()
+
+    # Load the scores of the last checkpoint of this run
+    # Returns a dictionary clstr_sens --> scores of the first relations to score, empty if there is no
+    # checkpoint or it belongs to another run
+    def load(self):
+        if not os.path.isfile(self.checkpoint_path):
+            return {}
+        with np.load(self.checkpoint_path) as checkpoint:
+            if str(checkpoint["run_hash"]) != self.run_hash:
+                print("Ignoring synteny checkpoint of a previous run")
+                return {}
+            return {str(clstr_sens): checkpoint["scores_" + str(clstr_sens)]
+                    for clstr_sens in checkpoint["clstr_sens"]}
+
+    # Save the scores of all relations scored so far
+    # All scores have to be written to the project DB before
+    def save(self, level_scores):
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        checkpoint = {"run_hash": np.array(self.run_hash), "clstr_sens": np.array(list(level_scores.keys()))}
+        for clstr_sens, scores in level_scores.items():
+            checkpoint["scores_" + clstr_sens] = scores
+        # Write to a temporary file first, so that an interrupted save keeps the last checkpoint
+        with open(self.checkpoint_path + ".tmp", "wb") as checkpoint_file:
+            np.savez(checkpoint_file, **checkpoint)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def remove(self):
+        if os.path.isfile(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
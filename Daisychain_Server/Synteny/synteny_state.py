@@ -0,0 +1,147 @@
+# Persistent state of a local synteny run, used to make reruns incremental
+# Genes are identified by a stable key (hash of species, contig, start and stop), as gene node IDs
+# change when a project DB is rebuilt with additional species.
+# For every gene the state stores two fingerprints:
+# nb_hash: Keys of its 5' and 3' neighbours (in order)
+# hmlg_hash: Keys of its homologs in large clusters (inflation value 1.4)
+# For every scored homology relation the state stores the keys of start and end gene and the score.
+# A relation has to be scored again if it is new, or if its start or end gene or any of their
+# neighbours is new or changed one of its fingerprints. All other relations keep their previous score.
+# The state is saved as a NumPy .npz file in the project folder
+import os
+import hashlib
+import numpy as np
+
+pair_dtype = np.dtype([("start", "<u8"), ("end", "<u8")])
+
+
+# Bit mixer (splitmix64 finalizer) for uint64 arrays
+def mix64(values):
+    with np.errstate(over="ignore"):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return values ^ (values >> np.uint64(31))
+
+
+# Retrieve the stable key of every encoded gene from a project DB
+# Genes not found in the DB get key 0
+def get_gene_keys(project_db_conn, gene_encoder):
+    gene_keys = np.zeros(len(gene_encoder), dtype=np.uint64)
+    genes = project_db_conn.run("MATCH(gene:Gene) RETURN gene.geneId AS gene, gene.species AS species, "
+                                "gene.contig AS contig, gene.start AS start, gene.stop AS stop")
+    for record in genes:
+        gene_idx = gene_encoder.gene_idx.get(record["gene"])
+        if gene_idx is None:
+            continue
+        gene_key = "\t".join([str(record[item]) for item in ["species", "contig", "start", "stop"]])
+        gene_keys[gene_idx] = int.from_bytes(hashlib.blake2b(gene_key.encode(), digest_size=8).digest(), "little")
+    return gene_keys
+
+
+class SyntenyState:
+    def __init__(self, state_path):
+        self.state_path = state_path
+        # Previous state, sorted by gene key / relation key pair
+        self.prev_gene_keys = np.zeros(0, dtype=np.uint64)
+        self.prev_nb_hash = np.zeros(0, dtype=np.uint64)
+        self.prev_hmlg_hash = np.zeros(0, dtype=np.uint64)
+        self.prev_relations = {}
+        # Current state
+        self.gene_keys = np.zeros(0, dtype=np.uint64)
+        self.nb_hash = np.zeros(0, dtype=np.uint64)
+        self.hmlg_hash = np.zeros(0, dtype=np.uint64)
+        self.gene_changed = np.zeros(0, dtype=bool)
+        self.relations = {}
+
+    # Load the state of the previous run, if there is one
+    def load(self):
+        if not os.path.isfile(self.state_path):
+            return False
+        with np.load(self.state_path) as state:
+            self.prev_gene_keys = state["gene_keys"]
+            self.prev_nb_hash = state["nb_hash"]
+            self.prev_hmlg_hash = state["hmlg_hash"]
+            for clstr_sens in state["clstr_sens"]:
+                self.prev_relations[str(clstr_sens)] = (state["relations_" + str(clstr_sens)],
+                                                        state["scores_" + str(clstr_sens)])
+        return True
+
+    # Calculate the fingerprints of all genes and compare them with the previous state
+    # gene_keys: Stable key of every encoded gene (see get_gene_keys)
+    # local_synteny: LocalSynteny scorer with the current neighbour matrix and homology graph
+    def set_genes(self, gene_keys, local_synteny):
+        self.gene_keys = gene_keys
+        self.local_synteny = local_synteny
+        nr_of_genes = len(gene_keys)
+        # Neighbour fingerprint: Position-dependent sum over the keys of all neighbours
+        nb_rows = local_synteny.nb_rows(np.arange(nr_of_genes, dtype=np.int32))
+        nb_keys = np.where(nb_rows >= 0, gene_keys[np.maximum(nb_rows, 0)], np.uint64(0))
+        positions = np.arange(1, nb_rows.shape[1] + 1, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            self.nb_hash = mix64(nb_keys ^ mix64(positions)).sum(axis=1, dtype=np.uint64)
+        # Homolog fingerprint: Order-independent sum over the keys of all homologs, summed per CSR row
+        hmlg_keys = mix64(gene_keys[local_synteny.indices])
+        with np.errstate(over="ignore"):
+            cum_keys = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(hmlg_keys, dtype=np.uint64)])
+            row_hash = cum_keys[local_synteny.indptr[1:]] - cum_keys[local_synteny.indptr[:-1]]
+        self.hmlg_hash = np.zeros(nr_of_genes, dtype=np.uint64)
+        self.hmlg_hash[:len(row_hash)] = row_hash[:nr_of_genes]
+        # Compare with the previous state
+        self.gene_changed = np.ones(nr_of_genes, dtype=bool)
+        if len(self.prev_gene_keys):
+            prev_pos = np.minimum(np.searchsorted(self.prev_gene_keys, gene_keys), len(self.prev_gene_keys) - 1)
+            known = self.prev_gene_keys[prev_pos] == gene_keys
+            self.gene_changed = ~(known & (self.prev_nb_hash[prev_pos] == self.nb_hash) &
+                                  (self.prev_hmlg_hash[prev_pos] == self.hmlg_hash))
+        # Genes without a key can not be tracked
+        self.gene_changed[gene_keys == 0] = True
+        print("%s of %s genes are new or changed" % (int(self.gene_changed.sum()), nr_of_genes))
+
+    # Find the relations of one inflation value that have to be scored
+    # Returns a boolean array (True = score again) and the previous scores (-1 = unknown)
+    def dirty_relations(self, clstr_sens, start_idx, end_idx):
+        prev_scores = np.full(len(start_idx), -1, dtype=np.int32)
+        if clstr_sens in self.prev_relations and len(self.prev_relations[clstr_sens][0]):
+            prev_pairs, prev_pair_scores = self.prev_relations[clstr_sens]
+            pairs = self.relation_pairs(start_idx, end_idx)
+            prev_pos = np.minimum(np.searchsorted(prev_pairs, pairs), len(prev_pairs) - 1)
+            known = prev_pairs[prev_pos] == pairs
+            prev_scores[known] = prev_pair_scores[prev_pos[known]]
+        return self.dirty_genes(start_idx, end_idx) | (prev_scores < 0), prev_scores
+
+    # Find the relations touching a new or changed gene, either directly or through their neighbours
+    # Genes encoded after set_genes are new
+    def dirty_genes(self, start_idx, end_idx):
+        nr_of_genes = max(int(start_idx.max(initial=-1)), int(end_idx.max(initial=-1))) + 1
+        if nr_of_genes > len(self.gene_changed):
+            self.gene_changed = np.concatenate([self.gene_changed,
+                                                np.ones(nr_of_genes - len(self.gene_changed), dtype=bool)])
+        dirty = self.gene_changed[start_idx] | self.gene_changed[end_idx]
+        for nb_rows in [self.local_synteny.nb_rows(start_idx), self.local_synteny.nb_rows(end_idx)]:
+            dirty |= (self.gene_changed[np.maximum(nb_rows, 0)] & (nb_rows >= 0)).any(axis=1)
+        return dirty
+
+    # Store the final scores of all relations of one inflation value
+    def set_scores(self, clstr_sens, start_idx, end_idx, scores):
+        pairs = self.relation_pairs(start_idx, end_idx)
+        order = np.argsort(pairs)
+        self.relations[clstr_sens] = (pairs[order], scores[order].astype(np.int32))
+
+    def relation_pairs(self, start_idx, end_idx):
+        pairs = np.zeros(len(start_idx), dtype=pair_dtype)
+        pairs["start"] = self.gene_keys[start_idx]
+        pairs["end"] = self.gene_keys[end_idx]
+        return pairs
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        order = np.argsort(self.gene_keys)
+        state = {"gene_keys": self.gene_keys[order], "nb_hash": self.nb_hash[order],
+                 "hmlg_hash": self.hmlg_hash[order], "clstr_sens": np.array(list(self.relations.keys()))}
+        for clstr_sens, (pairs, scores) in self.relations.items():
+            state["relations_" + clstr_sens] = pairs
+            state["scores_" + clstr_sens] = scores
+        # Write to a temporary file first, so that an interrupted run keeps the previous state
+        with open(self.state_path + ".tmp", "wb") as state_file:
+            np.savez(state_file, **state)
+        os.replace(self.state_path + ".tmp", self.state_path)
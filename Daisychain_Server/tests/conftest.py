@@ -0,0 +1,5 @@
+# Tests import the server modules the way the server does, relative to Daisychain_Server
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
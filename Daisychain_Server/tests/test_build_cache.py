@@ -0,0 +1,37 @@
+# Tests of the build stage cache
+import pytest
+from Server.Project_access.Build_Cache import BuildCache
+
+
+def write_file(path, content):
+    with open(path, "w") as out_file:
+        out_file.write(content)
+
+
+def test_stage_is_valid_until_input_or_output_changes(tmp_path):
+    cache = BuildCache(str(tmp_path / "build_cache.json"))
+    write_file(str(tmp_path / "in.txt"), "input")
+    write_file(str(tmp_path / "out.txt"), "output")
+    key = cache.stage_key("stage", [str(tmp_path / "in.txt")], ["param"])
+    cache.record("stage", key, [str(tmp_path / "out*.txt")])
+    assert BuildCache(str(tmp_path / "build_cache.json")).is_valid("stage", key)
+    assert not cache.is_valid("stage", cache.stage_key("stage", [str(tmp_path / "in.txt")], ["other"]))
+    write_file(str(tmp_path / "out.txt"), "changed output")
+    assert not cache.is_valid("stage", key)
+
+
+def test_missing_output_is_not_recorded(tmp_path):
+    cache = BuildCache(str(tmp_path / "build_cache.json"))
+    write_file(str(tmp_path / "out.txt"), "output")
+    key = cache.stage_key("stage", [], [])
+    with pytest.raises(FileNotFoundError):
+        cache.record("stage", key, [str(tmp_path / "out.txt"), str(tmp_path / "search.blastp")])
+    assert not cache.is_valid("stage", key)
+    assert "stage" not in BuildCache(str(tmp_path / "build_cache.json")).stages
+
+
+def test_stage_without_outputs_is_never_valid(tmp_path):
+    cache = BuildCache(str(tmp_path / "build_cache.json"))
+    key = cache.stage_key("stage", [], [])
+    cache.record("stage", key, [])
+    assert not cache.is_valid("stage", key)
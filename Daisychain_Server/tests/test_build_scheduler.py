@@ -0,0 +1,39 @@
+# Tests of the build stage scheduler
+import pytest
+from Server.Project_access.Build_Scheduler import BuildStage, BuildScheduler
+
+
+def run_stages(stages):
+    statuses = []
+    scheduler = BuildScheduler(stages, 2, statuses.append)
+    return scheduler, scheduler.run(), statuses
+
+
+def test_stages_run_after_their_dependencies():
+    order = []
+    stages = [BuildStage("b", "Stage b", ["a"], 1, lambda cpus: order.append("b")),
+              BuildStage("a", "Stage a", [], 1, lambda cpus: order.append("a"))]
+    scheduler, finished, statuses = run_stages(stages)
+    assert finished
+    assert order == ["a", "b"]
+    assert scheduler.failed_stages == []
+
+
+def test_failed_stage_stops_the_build():
+    started = []
+    stages = [BuildStage("a", "Stage a", [], 1, lambda cpus: False),
+              BuildStage("b", "Stage b", ["a"], 1, lambda cpus: started.append("b"))]
+    scheduler, finished, statuses = run_stages(stages)
+    assert not finished
+    assert [stage.name for stage in scheduler.failed_stages] == ["a"]
+    assert not started
+
+
+def test_stage_exception_is_raised_with_failed_stage():
+    def fail(cpus):
+        raise NameError("makeblastdb_path")
+    scheduler = BuildScheduler([BuildStage("a", "Stage a", [], 1, fail),
+                                BuildStage("b", "Stage b", [], 1, lambda cpus: True)], 2, lambda status: None)
+    with pytest.raises(NameError):
+        scheduler.run()
+    assert [stage.name for stage in scheduler.failed_stages] == ["a"]
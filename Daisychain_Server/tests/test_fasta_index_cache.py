@@ -0,0 +1,33 @@
+# Previews must not read whole genomes: The index is created and kept on first use, without a cache folder
+# the sequence file is read only up to a limit
+import os
+import pytest
+
+pytest.importorskip("pyfaidx")
+from Parser.FASTA_index_cache import FastaIndexCache
+
+
+def write_genome(path):
+    genome_path = os.path.join(path, "sp.fa")
+    with open(genome_path, "w") as genome_file:
+        for contig, nucleotide in [("chr1", "a"), ("chr2", "c"), ("chr3", "g")]:
+            genome_file.write(">%s description\n" % contig + (nucleotide * 60 + "\n") * 100)
+    return genome_path
+
+
+def test_index_is_created_on_first_use(tmp_path):
+    genome_path = write_genome(str(tmp_path))
+    index_cache = FastaIndexCache(os.path.join(str(tmp_path), ".fasta_index"))
+    sequence = index_cache.open_contig_regions(genome_path, {"chr1": 10, "chr3": 100})
+    assert os.path.isfile(index_cache.index_path(genome_path))
+    assert sequence["chr3"][:5].seq == "GGGGG"
+
+
+def test_scan_without_cache_folder_is_limited(tmp_path):
+    genome_path = write_genome(str(tmp_path))
+    contig_regions = FastaIndexCache(None).open_contig_regions(genome_path, {"chr1": 100, "chr2": 130})
+    assert contig_regions == {"chr1": "A" * 120, "chr2": "C" * 180}
+    # chr2 starts behind the limit, chr1 is cut at the limit
+    contig_regions = FastaIndexCache(None, max_scan_bytes=3000).open_contig_regions(
+        genome_path, {"chr1": 6000, "chr2": 10})
+    assert contig_regions == {"chr1": "A" * 60 * 48, "chr2": ""}
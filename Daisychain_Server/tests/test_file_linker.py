@@ -0,0 +1,59 @@
+# Tests of the import of files as links
+import os
+from Server.Project_access.File_Linker import FileLinker
+
+
+def write_file(path, content):
+    with open(path, "w") as out_file:
+        out_file.write(content)
+
+
+def import_file(tmp_path, strategy):
+    source_path = str(tmp_path / "source.faa")
+    target_path = str(tmp_path / "project" / "sp_v1.faa")
+    os.makedirs(str(tmp_path / "project"), exist_ok=True)
+    write_file(source_path, ">1\nACGT\n")
+    file_linker = FileLinker(str(tmp_path / "project" / ".import_checksums.json"))
+    getattr(file_linker, strategy)(source_path, target_path)
+    return file_linker, source_path, target_path
+
+
+def test_changed_hardlink_is_invalid(tmp_path):
+    file_linker, source_path, target_path = import_file(tmp_path, "hardlink")
+    assert os.stat(target_path).st_nlink == 2
+    assert file_linker.verify(target_path)
+    # Replacing the source (new inode) keeps the content of the hardlink
+    os.remove(source_path)
+    assert FileLinker(file_linker.checksum_path).verify(target_path)
+    # Writing to the shared file (through the source or the project folder) changes the imported content
+    with open(target_path, "a") as target_file:
+        target_file.write(">2\nTTTT\n")
+    assert not FileLinker(file_linker.checksum_path).verify(target_path)
+
+
+def test_symlink_to_removed_source_is_invalid(tmp_path):
+    file_linker, source_path, target_path = import_file(tmp_path, "symlink")
+    assert file_linker.verify(target_path)
+    os.remove(source_path)
+    assert not FileLinker(file_linker.checksum_path).verify(target_path)
+
+
+def test_links_without_checksums_are_invalid(tmp_path):
+    for strategy in ["hardlink", "symlink"]:
+        file_linker, source_path, target_path = import_file(tmp_path, strategy)
+        write_file(file_linker.checksum_path, "{not json")
+        file_linker = FileLinker(file_linker.checksum_path)
+        assert file_linker.load_error
+        assert not file_linker.verify(target_path)
+        file_linker.remove(target_path)
+        os.remove(source_path)
+
+
+def test_copies_are_valid(tmp_path):
+    source_path = str(tmp_path / "source.faa")
+    write_file(source_path, ">1\nACGT\n")
+    file_linker = FileLinker(str(tmp_path / ".import_checksums.json"))
+    assert file_linker.link_or_copy(source_path, str(tmp_path / "sp_v1.faa"), "copy") == "copy"
+    write_file(source_path, ">1\nTTTT\n")
+    assert file_linker.verify(str(tmp_path / "sp_v1.faa"))
+    assert file_linker.load_error is None
@@ -0,0 +1,101 @@
+# GFF3Parser_v2: The gffutils and the native backend must return the same gene annotations
+import os
+import random
+import pytest
+
+# The parser module imports gffutils and pyfaidx
+gffutils = pytest.importorskip("gffutils")
+pytest.importorskip("pyfaidx")
+from Parser.GFF3_parser_gffutils_v2 import GFF3Parser_v2
+from Parser.GFF3_parser_native import GFF3NativeDB
+
+# CDS of tr1 are not in file order of their IDs, CDS of tr2 have no ID
+GFF3_LINES = ["##gff-version 3",
+              "chr1\tsrc\tgene\t101\t700\t.\t+\t.\tID=gene1;Name=Alpha",
+              "chr1\tsrc\tmRNA\t101\t700\t.\t+\t.\tID=tr1;Parent=gene1;Name=Alpha.1",
+              "chr1\tsrc\tCDS\t401\t700\t.\t+\t0\tID=cds1;Parent=tr1;product=second%2Cexon",
+              "chr1\tsrc\tCDS\t101\t300\t.\t+\t0\tID=cds0;Parent=tr1;product=first",
+              "chr1\tsrc\tgene\t1001\t1600\t.\t-\t.\tID=gene2;Name=Beta",
+              "chr1\tsrc\tmRNA\t1001\t1600\t.\t-\t.\tID=tr2;Parent=gene2",
+              "chr1\tsrc\tCDS\t1001\t1200\t.\t-\t0\tParent=tr2;product=p1",
+              "chr1\tsrc\tCDS\t1301\t1600\t.\t-\t0\tParent=tr2;product=p2",
+              "chr2\tsrc\tgene\t51\t350\t.\t+\t.\tID=gene3",
+              "chr2\tsrc\tmRNA\t51\t350\t.\t+\t.\tID=tr3;Parent=gene3",
+              "chr2\tsrc\tCDS\t51\t350\t.\t+\t0\tID=cds3;Parent=tr3;product=only"]
+
+
+def write_files(path):
+    random.seed(3)
+    with open(os.path.join(path, "sp.faa"), "w") as genome_file:
+        for contig in ["chr1", "chr2"]:
+            genome_file.write(">" + contig + "\n")
+            contig_seq = "".join(random.choice("ACGT") for _ in range(3000))
+            genome_file.write("\n".join(contig_seq[pos:pos + 60] for pos in range(0, 3000, 60)) + "\n")
+    with open(os.path.join(path, "sp.gff3"), "w") as gff3_file:
+        gff3_file.write("\n".join(GFF3_LINES) + "\n")
+    return os.path.join(path, "sp.gff3"), os.path.join(path, "sp.faa")
+
+
+def test_preview_uses_configured_backend(tmp_path):
+    gff3_path, genome_path = write_files(str(tmp_path))
+    previews = {}
+    for gff3_backend in ["gffutils", "native"]:
+        previews[gff3_backend] = GFF3Parser_v2(None, None).preview_gff3_file(
+            gff3_path, genome_path, "mRNA", "CDS", "mRNA:Name", "CDS:product", max_genes=2, gff3_backend=gff3_backend)
+    assert previews["gffutils"] == previews["native"]
+    assert [gene[6:8] for gene in previews["native"]] == [["Alpha.1", "second,exon"], ["", "p2"]]
+    assert len(previews["native"][0][8]) == 500
+
+
+# Repeated IDs, features without ID, several parents, escaped characters and a FASTA section
+EDGE_CASE_LINES = ["##gff-version 3",
+                   "# comment",
+                   "chr1\tsrc\tgene\t101\t700\t.\t+\t.\tID=gene1;Name=Alpha%3BOne",
+                   "chr1\tsrc\tmRNA\t101\t700\t.\t+\t.\tID=tr1;Parent=gene1",
+                   "chr1\tsrc\tmRNA\t101\t650\t.\t+\t.\tID=tr1;Parent=gene1;Name=dup",
+                   "chr1\tsrc\texon\t101\t300\t.\t+\t.\tParent=tr1,tr2",
+                   "chr1\tsrc\tCDS\t101\t300\t.\t+\t0\tParent=tr1",
+                   "chr1\tsrc\tCDS\t401\t700\t.\t+\t2\tParent=tr1",
+                   "chr1\tsrc\tmRNA\t101\t300\t.\t+\t.\tID=tr2;Parent=gene1",
+                   "chr1\tsrc\tCDS\t101\t300\t.\t+\t.\tID=c2;Parent=tr2;product=x",
+                   "chr1\tsrc\tgene\t900\t1000\t.\t-\t.\tID=gene2",
+                   "##FASTA",
+                   ">chr1",
+                   "ACGT"]
+
+
+@pytest.mark.parametrize("gff3_lines", [GFF3_LINES, EDGE_CASE_LINES])
+def test_backends_return_same_transcripts(tmp_path, gff3_lines):
+    gff3_path = os.path.join(str(tmp_path), "sp.gff3")
+    with open(gff3_path, "w") as gff3_file:
+        gff3_file.write("\n".join(gff3_lines) + "\n")
+    gffutils_db = gffutils.create_db(gff3_path, ":memory:", merge_strategy="create_unique", force=True)
+    native_db = GFF3NativeDB(gff3_path)
+    # Transcripts followed by their subfeatures, in the same order and with the same IDs and attributes
+    for featuretype in ["gene", "mRNA"]:
+        transcripts = []
+        for gff3_db in [gffutils_db, native_db]:
+            transcripts.append([[(feature.id, feature.featuretype, feature.start, feature.stop, feature.strand,
+                                  feature.frame, dict(feature.attributes)) for feature in transcript]
+                                for transcript in gff3_db.iter_by_parent_childs(featuretype)])
+        assert transcripts[0] == transcripts[1]
+        assert transcripts[0]
+
+
+def test_backends_write_same_genes(tmp_path):
+    gff3_path, genome_path = write_files(str(tmp_path))
+    gene_lists = {}
+    fasta_files = {}
+    for gff3_backend in ["gffutils", "native"]:
+        output_path = os.path.join(str(tmp_path), gff3_backend)
+        gff3_parser = GFF3Parser_v2(output_path + "_transcripts.fa", output_path + "_translations.fa",
+                                    gff3_db_path=output_path + ".db")
+        gene_lists[gff3_backend] = gff3_parser.parse_gff3_file(gff3_path, genome_path, True, "mRNA", "CDS",
+                                                               "mRNA:Name", "CDS:product", gff3_backend=gff3_backend)
+        fasta_files[gff3_backend] = []
+        for fasta_path in [output_path + "_transcripts.fa", output_path + "_translations.fa"]:
+            with open(fasta_path, "r") as fasta_file:
+                fasta_files[gff3_backend].append(fasta_file.read())
+    assert gene_lists["gffutils"] == gene_lists["native"]
+    assert fasta_files["gffutils"] == fasta_files["native"]
+    assert len(gene_lists["native"]) == 3
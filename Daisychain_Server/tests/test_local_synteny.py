@@ -0,0 +1,94 @@
+# Local synteny scores must be the same as the scores of the former per-relation calculation,
+# which read the neighbours of each gene with 5_NB*1..5 and 3_NB*1..5 traversals
+import random
+from itertools import product
+import numpy as np
+import pytest
+from Synteny.gene_neighbourhood import GeneNeighbourhoodIndex
+from Synteny.local_synteny import GeneIdEncoder, LocalSynteny
+from Synteny.sharded_synteny import ShardedLocalSynteny, contig_shard_keys
+
+
+# Contigs of different lengths (including a single gene without neighbours) and random homology relations,
+# dense enough that neighbours often have several homologs
+def random_project(seed):
+    rnd = random.Random(seed)
+    gene_nr = 0
+    contigs = []
+    for contig_length in [1, 3, 40, 60, 80]:
+        contigs.append(["g%d" % (gene_nr + pos) for pos in range(contig_length)])
+        gene_nr += contig_length
+    genes = [gene for contig in contigs for gene in contig]
+    relations = set()
+    for _ in range(30):
+        cluster = rnd.sample(genes, rnd.randint(2, 12))
+        relations.update(product(cluster, repeat=2))
+    relations.update((rnd.choice(genes), rnd.choice(genes)) for _ in range(400))
+    return contigs, sorted(relations)
+
+
+# Neighbours as returned by the traversals: 5' neighbours (closest first), then 3' neighbours (closest first)
+def traversal_neighbours(contigs, gene):
+    for contig in contigs:
+        if gene in contig:
+            pos = contig.index(gene)
+            return contig[max(0, pos - 5):pos][::-1] + contig[pos + 1:pos + 6]
+
+
+# Score of the former calculation: Neighbour pairs in itertools.product order, every neighbour counted once
+def former_score(contigs, homologs, start_gene, end_gene):
+    score = 0
+    hmlg_rel_nodes = []
+    for nb_start, nb_end in product(traversal_neighbours(contigs, start_gene), traversal_neighbours(contigs, end_gene)):
+        if nb_start in hmlg_rel_nodes or nb_end in hmlg_rel_nodes:
+            continue
+        if nb_end in homologs.get(nb_start, []):
+            score += 1
+            hmlg_rel_nodes.extend([nb_start, nb_end])
+    return score
+
+
+def local_synteny_scorer(contigs, relations):
+    nb_index = GeneNeighbourhoodIndex()
+    nb_index.build((contig[pos], contig[pos - 1]) for contig in contigs for pos in range(1, len(contig)))
+    encoder = GeneIdEncoder()
+    local_synteny = LocalSynteny(nb_index, encoder)
+    start_idx = encoder.encode_many(relation[0] for relation in relations)
+    end_idx = encoder.encode_many(relation[1] for relation in relations)
+    local_synteny.set_homolog_graph(start_idx, end_idx)
+    return nb_index, local_synteny, start_idx, end_idx
+
+
+def test_scores_match_former_calculation():
+    for seed in range(3):
+        contigs, relations = random_project(seed)
+        # Self-loops were not part of the homology graph
+        homologs = {}
+        for start_gene, end_gene in relations:
+            if start_gene != end_gene:
+                homologs.setdefault(start_gene, []).append(end_gene)
+        nb_index, local_synteny, start_idx, end_idx = local_synteny_scorer(contigs, relations)
+        scores = local_synteny.score_edges(start_idx, end_idx)
+        assert scores.tolist() == [former_score(contigs, homologs, start_gene, end_gene)
+                                   for start_gene, end_gene in relations]
+        assert np.count_nonzero(scores > 1)
+
+
+# Sharded scoring in worker processes returns the scores of LocalSynteny in the order of the input relations
+def test_sharded_scores_match_local_synteny():
+    contigs, relations = random_project(0)
+    nb_index, local_synteny, start_idx, end_idx = local_synteny_scorer(contigs, relations)
+    with ShardedLocalSynteny(local_synteny, contig_shard_keys(nb_index, local_synteny.encoder), 2) as sharded_synteny:
+        assert sharded_synteny.score_edges(start_idx, end_idx).tolist() == \
+               local_synteny.score_edges(start_idx, end_idx).tolist()
+        # Relations of genes that are not part of the shard keys
+        unknown_idx = np.array([len(local_synteny.encoder) + 1], dtype=np.int32)
+        assert sharded_synteny.score_edges(unknown_idx, start_idx[:1]).tolist() == [0]
+        assert sharded_synteny.score_edges(start_idx[:0], end_idx[:0]).tolist() == []
+    # Worker processes and shared memory are released when leaving the block, also after an error
+    assert sharded_synteny.executor is None and not sharded_synteny.shm_blocks
+    with pytest.raises(KeyError):
+        with ShardedLocalSynteny(local_synteny, contig_shard_keys(nb_index, local_synteny.encoder), 2) as sharded_synteny:
+            raise KeyError("relation")
+    assert sharded_synteny.executor is None and not sharded_synteny.shm_blocks
+    sharded_synteny.close()
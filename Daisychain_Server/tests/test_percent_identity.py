@@ -0,0 +1,84 @@
+# The percent identity store must return the values of the former dict of percent match strings
+# ("g<query>_g<subject>" --> str(round(percent match, 2)), later hits of a pair replacing earlier ones)
+import os
+import random
+import numpy as np
+from CSV_creator.percent_identity_store import PercentIdentityWriter, PercentIdentityStore
+from CSV_creator.diamond_to_abc import DiamondToABC
+
+
+# Hits as (query ID, subject ID, identical positions, query length, subject length), some pairs hit twice
+def random_hits(count):
+    rnd = random.Random(11)
+    hits = []
+    for _ in range(count):
+        query_len = rnd.randint(1, 3000)
+        subject_len = rnd.randint(1, 3000)
+        hits.append((rnd.randint(0, 300), rnd.randint(0, 300), rnd.randint(0, min(query_len, subject_len)),
+                     query_len, subject_len))
+    return hits + [(query_id, subject_id, 1, 7, 3) for query_id, subject_id, _, _, _ in hits[:50]]
+
+
+def former_perc_id_dict(hits):
+    perc_id_dict = {}
+    for query_id, subject_id, nident, query_len, subject_len in hits:
+        perc_id_dict["g%d_g%d" % (query_id, subject_id)] = str(round(100 * nident / max(query_len, subject_len), 2))
+    return perc_id_dict
+
+
+def test_store_matches_former_dict(tmp_path):
+    hits = random_hits(5000)
+    store_path = os.path.join(str(tmp_path), "transcripts_pid")
+    pid_writer = PercentIdentityWriter(store_path)
+    # Added in two parts, as by the conversion of DIAMOND output blocks
+    for part in [hits[:2000], hits[2000:]]:
+        pid_writer.add([hit[0] for hit in part], [hit[1] for hit in part],
+                       [round(100 * hit[2] / max(hit[3], hit[4]), 2) for hit in part])
+    pid_writer.save()
+    perc_id_dict = former_perc_id_dict(hits)
+    pid_store = PercentIdentityStore(store_path)
+    query_ids, subject_ids = np.meshgrid(np.arange(302), np.arange(302), indexing="ij")
+    perc_ids = pid_store.format_perc_ids(pid_store.lookup(query_ids.ravel(), subject_ids.ravel()))
+    assert perc_ids == [perc_id_dict.get("g%d_g%d" % (query_id, subject_id), "NA")
+                        for query_id, subject_id in zip(query_ids.ravel().tolist(), subject_ids.ravel().tolist())]
+    subject_ids, perc_ids = pid_store.hits(hits[0][0])
+    assert pid_store.format_perc_ids(perc_ids) == [perc_id_dict["g%d_g%d" % (hits[0][0], subject_id)]
+                                                   for subject_id in subject_ids.tolist()]
+    assert subject_ids.tolist() == sorted(subject_ids.tolist())
+
+
+def test_empty_store(tmp_path):
+    store_path = os.path.join(str(tmp_path), "empty_pid")
+    PercentIdentityWriter(store_path).save()
+    pid_store = PercentIdentityStore(store_path)
+    assert pid_store.format_perc_ids(pid_store.lookup([1], [2])) == ["NA"]
+    assert len(pid_store.hits(1)[0]) == 0
+
+
+# DIAMOND output is converted in blocks, the ABC file and the store must match the former line by line conversion
+# of the output (after removing 'lcl|' with sed)
+def test_diamond_conversion_matches_former_conversion(tmp_path):
+    hits = random_hits(3000)
+    diamond_path = os.path.join(str(tmp_path), "transcripts.blastn")
+    with open(diamond_path, "w") as diamond_file:
+        for query_id, subject_id, nident, query_len, subject_len in hits:
+            diamond_file.write("lcl|%d\tlcl|%d\t1e-10\t%d\t%d\t%d\n" % (query_id, subject_id, query_len,
+                                                                        subject_len, nident))
+    former_abc = []
+    with open(diamond_path, "r") as diamond_file:
+        for line in diamond_file:
+            line = line.replace("lcl|", "").split("\t")
+            perc_id = str(round(100 * int(line[5].strip()) / max(int(line[3]), int(line[4])), 2))
+            former_abc.append("\t".join([line[0], line[1], perc_id]) + "\n")
+    abc_path = os.path.join(str(tmp_path), "transcripts.abc")
+    store_path = os.path.join(str(tmp_path), "transcripts_pid")
+    # Small blocks, so that lines are split between blocks
+    assert DiamondToABC(chunk_size=1000).convert(diamond_path, abc_path, store_path) == len(hits)
+    with open(abc_path, "r") as abc_file:
+        assert abc_file.read() == "".join(former_abc)
+    perc_id_dict = former_perc_id_dict(hits)
+    pid_store = PercentIdentityStore(store_path)
+    query_ids = [hit[0] for hit in hits]
+    subject_ids = [hit[1] for hit in hits]
+    assert pid_store.format_perc_ids(pid_store.lookup(query_ids, subject_ids)) == \
+           [perc_id_dict["g%d_g%d" % (query_id, subject_id)] for query_id, subject_id in zip(query_ids, subject_ids)]
@@ -0,0 +1,54 @@
+# Translations must match the former Biopython translation of GFF3Parser_v2
+import random
+from itertools import product
+import pytest
+from Parser.sequence_translation import iupac_nt, reverse_complement, translate_nt, translate_nt_batch
+
+
+# Former preparation of a coding sequence: Codons are removed until the sequence starts with ATG,
+# then it is padded with N to full codons
+def former_coding_sequence(nt_sequence):
+    while nt_sequence:
+        if nt_sequence[:3] == "ATG":
+            break
+        if len(nt_sequence) < 3:
+            return ""
+        nt_sequence = nt_sequence[3:]
+    return nt_sequence + "N" * (-len(nt_sequence) % 3)
+
+
+def random_sequences(count):
+    rnd = random.Random(5)
+    sequences = []
+    for _ in range(count):
+        # Mostly ACGT with some ambiguity codes, as in real genomes
+        sequences.append("".join(rnd.choice("ACGT" * 20 + iupac_nt[4:]) for _ in range(rnd.randint(0, 400))))
+    # Every codon once, after a start codon
+    sequences.extend("ATG" + "".join(codon) for codon in product(iupac_nt, repeat=3))
+    return sequences
+
+
+def test_translation_matches_biopython():
+    Seq = pytest.importorskip("Bio.Seq").Seq
+    sequences = random_sequences(500)
+    former_translations = [str(Seq(former_coding_sequence(sequence)).translate(to_stop=True))
+                           for sequence in sequences]
+    assert [translate_nt(sequence) for sequence in sequences] == former_translations
+    assert translate_nt_batch(sequences, batch_size=64) == former_translations
+
+
+def test_translation_examples():
+    assert translate_nt_batch(["GGGATGGCCAAATAGGG", "CCATGGCC", "", "ATGAAYTGA", "ATGGA"]) == \
+           ["MAK", "", "", "MN", "MX"]
+    assert translate_nt("ATGRAY") == "MB"
+
+
+def test_reverse_complement():
+    rnd = random.Random(7)
+    former_complement = {"A": "T", "T": "A", "C": "G", "G": "C"}
+    for _ in range(100):
+        sequence = "".join(rnd.choice("ACGT") for _ in range(rnd.randint(0, 50)))
+        assert reverse_complement(sequence) == "".join([former_complement[nt] for nt in sequence])[::-1]
+    # Letters that are no IUPAC nucleotide codes still give an empty sequence, ambiguity codes are kept
+    assert reverse_complement("ACGX") == ""
+    assert reverse_complement("AACNRY") == "RYNGTT"
@@ -0,0 +1,44 @@
+# Tests of the synteny block detection
+from Synteny.gene_neighbourhood import GeneNeighbourhoodIndex
+from Synteny.synteny_blocks import SyntenyBlocks
+
+
+# Two contigs of 100 genes: a0..a99 and b0..b99
+def blocks_of(anchor_positions, min_anchors=5, max_gap=10):
+    nb_index = GeneNeighbourhoodIndex()
+    nb_index.build([("%s%d" % (contig, pos), "%s%d" % (contig, pos - 1)) for contig in "ab" for pos in range(1, 100)])
+    synteny_blocks = SyntenyBlocks(nb_index, min_anchors, max_gap)
+    blocks = synteny_blocks.find_blocks([("a%d" % pos_a, "b%d" % pos_b) for pos_a, pos_b in anchor_positions])
+    return [(orientation, [(int(gene_a[1:]), int(gene_b[1:])) for gene_a, gene_b in anchors])
+            for _, orientation, anchors in blocks]
+
+
+def test_several_blocks_of_one_contig_pair():
+    forward = [(pos, pos) for pos in range(0, 8)]
+    inverted = [(30 + pos, 60 - pos) for pos in range(0, 6)]
+    # Same orientation as the first block, but more than max_gap genes away
+    forward_far = [(50 + 2 * pos, 5 + 2 * pos) for pos in range(0, 5)]
+    noise = [(20, 90), (70, 40), (90, 95)]
+    blocks = blocks_of(sorted(forward + inverted + forward_far + noise))
+    assert blocks == [("+", forward), ("-", inverted), ("+", forward_far)]
+
+
+def test_anchors_of_a_short_chain_part_stay_available():
+    forward = [(pos, pos) for pos in range(0, 6)]
+    # (6, 30) extends the forward chain over a gap, it belongs to the inverted block
+    inverted = [(6 + pos, 30 - pos) for pos in range(0, 5)]
+    assert blocks_of(forward + inverted) == [("+", forward), ("-", inverted)]
+
+
+def test_chains_are_split_at_large_gaps():
+    anchors = [(pos, pos) for pos in range(0, 5)] + [(pos, pos) for pos in range(20, 24)]
+    assert blocks_of(anchors) == [("+", anchors[:5])]
+    assert blocks_of(anchors, max_gap=20) == [("+", anchors)]
+
+
+def test_both_directions_of_a_relation_are_one_anchor():
+    nb_index = GeneNeighbourhoodIndex()
+    nb_index.build([("%s%d" % (contig, pos), "%s%d" % (contig, pos - 1)) for contig in "ab" for pos in range(1, 10)])
+    pairs = [("a%d" % pos, "b%d" % pos) for pos in range(5)]
+    blocks = SyntenyBlocks(nb_index, 5, 10).find_blocks(pairs + [(gene_b, gene_a) for gene_a, gene_b in pairs])
+    assert blocks == [("b0", "+", pairs)]
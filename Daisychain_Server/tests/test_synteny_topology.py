@@ -0,0 +1,80 @@
+# Local synteny scores and synteny blocks must not depend on the homology topology of ClusterToCSV
+import os
+import pytest
+from CSV_creator.cluster_to_csv import ClusterToCSV
+from CSV_creator.percent_identity_store import PercentIdentityWriter, PercentIdentityStore
+from CSV_creator.synteny_to_csv import SyntenyToCSV
+from CSV_creator.synteny_block_to_csv import SyntenyBlockToCSV
+
+
+# Two collinear contigs of 30 genes (g1..g30 and g31..g60), each gene clustered with its counterpart,
+# plus a few clusters of three genes
+def write_project(project_path, topology):
+    CSV_path = os.path.join(project_path, topology)
+    os.makedirs(CSV_path)
+    with open(os.path.join(CSV_path, "gene_nodes.csv"), "w") as gene_nodes_file:
+        gene_nodes_file.write("geneId:ID(Gene),species,contig\n")
+        for gene in range(1, 61):
+            gene_nodes_file.write("g%d,%s,%s\n" % (gene, "At" if gene <= 30 else "Bn", "A" if gene <= 30 else "B"))
+    with open(os.path.join(CSV_path, "gene_5nb.csv"), "w") as gene_5nb_file:
+        gene_5nb_file.write(":START_ID(Gene),:END_ID(Gene)\n")
+        for gene in list(range(2, 31)) + list(range(32, 61)):
+            gene_5nb_file.write("g%d,g%d\n" % (gene, gene - 1))
+    clusters = [[gene, gene + 30] for gene in range(1, 31) if gene % 10] + \
+               [[10, 40, 20], [30, 50, 60]]
+    clstr_path = os.path.join(project_path, topology + ".clstr")
+    with open(clstr_path, "w") as clstr_file:
+        for cluster in clusters:
+            clstr_file.write("\t".join(str(gene) for gene in cluster) + "\n")
+    # Search hits: Only one direction of each counterpart pair and no hits within the clusters of three
+    pid_writer = PercentIdentityWriter(os.path.join(project_path, topology + "_pid"))
+    pid_writer.add(list(range(1, 31)), list(range(31, 61)), [50.0 + gene for gene in range(30)])
+    pid_writer.save()
+    cluster_to_csv = ClusterToCSV(os.path.join(CSV_path, "gene_hmlg.csv"),
+                                  PercentIdentityStore(os.path.join(project_path, topology + "_pid")),
+                                  "nucl", topology, 1)
+    cluster_to_csv.create_csv(clstr_path, "1.4")
+    cluster_to_csv.create_csv(clstr_path, "5.0")
+    SyntenyToCSV(CSV_path).add_gene_ls_scores()
+    SyntenyBlockToCSV(CSV_path, 5, 10).create_csv()
+    return CSV_path
+
+
+def read_relations(CSV_path):
+    relations = {}
+    with open(os.path.join(CSV_path, "gene_hmlg.csv"), "r") as hmlg_file:
+        next(hmlg_file)
+        for line in hmlg_file:
+            line = line.rstrip("\n").split(",")
+            relations[(line[0], line[1], line[3])] = (line[4], line[5])
+    return relations
+
+
+def read_file(path):
+    with open(path, "r") as read_file:
+        return read_file.read()
+
+
+def test_clique_scores_count_homologous_neighbours(tmp_path):
+    relations = read_relations(write_project(str(tmp_path), "clique"))
+    # Neighbours of g15 and g45 are homologous pairs, except for g20/g50 (different clusters of three)
+    # The relation is an anchor of the only synteny block
+    assert relations[("g15", "1.4", "g45")] == ("9", "b0")
+    assert relations[("g15", "1.4", "g15")] == ("", "")
+
+
+@pytest.mark.parametrize("topology", ["blast_hits", "knn", "hub"])
+def test_topology_does_not_change_synteny(tmp_path, topology):
+    clique_path = write_project(str(tmp_path), "clique")
+    topology_path = write_project(str(tmp_path), topology)
+    clique_relations = read_relations(clique_path)
+    topology_relations = read_relations(topology_path)
+    assert set(topology_relations) <= set(clique_relations)
+    if topology != "hub":
+        assert topology_relations
+    for relation, (ls_score, block_id) in topology_relations.items():
+        assert ls_score == clique_relations[relation][0]
+        assert block_id == clique_relations[relation][1]
+    for csv_file in ["synteny_block_nodes.csv", "gene_synteny_block.csv", "gene_clusters.csv",
+                     "gene_member_of.csv"]:
+        assert read_file(os.path.join(topology_path, csv_file)) == read_file(os.path.join(clique_path, csv_file))
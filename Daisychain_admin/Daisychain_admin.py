@@ -292,6 +292,20 @@ class DaisychainAdmin:
         # Get file list for current project
         file_list = self.send_data("PAFILE_LIST_"+str(proj_id))
         files = [item.split("\t") for item in file_list.split("\n")]
+        # Features and attributes of newly added annotation files are scanned by the server in the background
+        # Wait until all scans finished (status in the fourth column, 'pending' while the file is scanned),
+        # at most scan_timeout seconds. Files still pending then can only be parsed in automatic mode
+        scan_timeout = 600
+        wait_start = time.time()
+        pending_files = [item[0] for item in files if len(item) > 3 and item[3] == "pending"]
+        while pending_files and time.time() - wait_start < scan_timeout:
+            print("Waiting for the server to scan %s annotation file(s)" % len(pending_files))
+            time.sleep(2)
+            file_list = self.send_data("PAFILE_LIST_"+str(proj_id))
+            files = [item.split("\t") for item in file_list.split("\n")]
+            pending_files = [item[0] for item in files if len(item) > 3 and item[3] == "pending"]
+        if pending_files:
+            print("Scanning did not finish within %s seconds for: %s" % (scan_timeout, ", ".join(pending_files)))
         # Count number of genome and annotation files
         genome_files = [item for item in files if item[1]=="genome"]
         anno_files  = [item for item in files if item[1]=="annotation"]
@@ -327,8 +341,16 @@ class DaisychainAdmin:
                 break
             # Manual mode
             if manual_mode:
+                # Scanning the features and attributes of the file failed (the reason is listed in its task)
+                # or did not finish in time
+                if len(anno_file) > 3 and anno_file[3] in ["failed", "pending"]:
+                    print("The features and attributes of this file could not be scanned, see the task list")
+                    print("Press enter to continue")
+                    input("")
+                    anno_file_index += 1
+                    continue
                 # Retrieve all features and their attributes from the current GFF3 file
-                feat_attr= [item.split("§") for item in anno_file[2].split("$")]
+                feat_attr= [item.split("§") for item in anno_file[2].split("$") if item]
                 features = [item[0] for item in feat_attr]
                 # If there are no features, continue with next file
                 if len(features) == 0: